@@ -0,0 +1,123 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks domain rewriting in replay_generator._process_responses.
+
+Generates a synthetic capture with many domains and compares the single-pass
+regex rewriting in _process_responses against rewriting each domain with its
+own call to str.replace.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import urlparse
+
+sys.path.insert(1, os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..')))
+
+from client_wrapper import http_response
+from replay_generator import replay_generator
+
+_FILLER_WORDS = ('<div class="content">', 'lorem', 'ipsum', 'dolor', 'sit',
+                 'amet', '</div>', '<script src="http://')
+
+
+def _create_synthetic_capture(domain_count, total_bytes, response_count):
+    """Creates a synthetic capture of responses that reference many domains.
+
+    Args:
+        domain_count: Number of distinct domains in the capture.
+        total_bytes: Approximate total size of all response bodies.
+        response_count: Number of responses in the capture.
+
+    Returns:
+        A dictionary where each key is an absolute URL and each value is an
+        HttpResponse instance.
+    """
+    random.seed(0)
+    domains = ['cdn%03d.example%d.com' % (i, i % 7)
+               for i in range(domain_count)]
+    response_size = total_bytes // response_count
+    capture = {}
+    for i in range(response_count):
+        parts = []
+        size = 0
+        while size < response_size:
+            # Reference a domain roughly once every 100 words.
+            if random.randint(0, 100) == 0:
+                part = random.choice(domains)
+            else:
+                part = random.choice(_FILLER_WORDS)
+            parts.append(part)
+            size += len(part) + 1
+        url = 'http://%s/resource%d' % (domains[i % domain_count], i)
+        capture[url] = http_response.HttpResponse(200, {}, ' '.join(parts))
+    return capture
+
+
+def _process_responses_sequentially(original):
+    """Rewrites domains with one str.replace pass per domain per response."""
+    domains = set(urlparse.urlparse(url).netloc for url in original)
+    processed = {}
+    for url, response in original.iteritems():
+        data_processed = response.data
+        for domain in domains:
+            data_processed = data_processed.replace(domain, '127.0.0.1')
+        processed[urlparse.urlparse(url).path] = http_response.HttpResponse(
+            response.response_code, response.headers, data_processed)
+    return processed
+
+
+def _time_call(function, *args):
+    start_time = time.time()
+    result = function(*args)
+    return result, time.time() - start_time
+
+
+def main(args):
+    capture = _create_synthetic_capture(args.domains, args.megabytes * 1000000,
+                                        args.responses)
+    print 'synthetic capture: %d domains, %d responses, %d bytes' % (
+        args.domains, len(capture), sum(len(r.data)
+                                        for r in capture.itervalues()))
+    sequential, sequential_seconds = _time_call(_process_responses_sequentially,
+                                                capture)
+    single_pass, single_pass_seconds = _time_call(
+        replay_generator._process_responses, capture)
+    if sequential != single_pass:
+        raise AssertionError('rewriting strategies produced different output')
+    print 'per-domain str.replace: %.3fs' % sequential_seconds
+    print 'single-pass regex:      %.3fs' % single_pass_seconds
+    print 'speedup:                %.1fx' % (sequential_seconds /
+                                             single_pass_seconds)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Replay Generator Domain Rewriting Benchmark',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--domains',
+                        help='Number of distinct domains in the capture',
+                        type=int,
+                        default=100)
+    parser.add_argument('--megabytes',
+                        help='Total size of response bodies (in MB)',
+                        type=int,
+                        default=50)
+    parser.add_argument('--responses',
+                        help='Number of responses in the capture',
+                        type=int,
+                        default=500)
+    main(parser.parse_args())
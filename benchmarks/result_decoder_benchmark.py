@@ -0,0 +1,86 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks decoding of NdtResult JSON strings.
+
+Encodes synthetic results and compares decoding them with the fixed-format
+time parser in result_decoder against decoding every time with dateutil.
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+import mock
+import pytz
+
+sys.path.insert(1, os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..')))
+
+from client_wrapper import result_decoder
+from client_wrapper import result_encoder
+from client_wrapper import results
+
+
+def _create_encoded_results(count):
+    encoder = result_encoder.NdtResultEncoder()
+    start_time = datetime.datetime(2016, 1, 1, 0, 0, 0, 123456, pytz.utc)
+    encoded_results = []
+    for i in range(count):
+        test_start_time = start_time + datetime.timedelta(minutes=i)
+        encoded_results.append(encoder.encode(results.NdtResult(
+            start_time=test_start_time,
+            end_time=test_start_time + datetime.timedelta(seconds=30),
+            client='ndt_js',
+            os='Ubuntu',
+            browser='firefox',
+            latency=20.0,
+            c2s_result=results.NdtSingleTestResult(
+                throughput=10.0,
+                start_time=test_start_time + datetime.timedelta(seconds=5),
+                end_time=test_start_time + datetime.timedelta(seconds=15)),
+            s2c_result=results.NdtSingleTestResult(
+                throughput=20.0,
+                start_time=test_start_time + datetime.timedelta(seconds=15),
+                end_time=test_start_time + datetime.timedelta(seconds=25)))))
+    return encoded_results
+
+
+def _decode_all(encoded_results):
+    decoder = result_decoder.NdtResultDecoder()
+    start_time = time.time()
+    for encoded in encoded_results:
+        decoder.decode(encoded)
+    return time.time() - start_time
+
+
+def main(args):
+    encoded_results = _create_encoded_results(args.results)
+    print 'synthetic results: %d' % len(encoded_results)
+    with mock.patch.object(result_decoder, '_ENCODED_TIME_PATTERN') as pattern:
+        # Force every time through the dateutil fallback.
+        pattern.match.return_value = None
+        print 'dateutil only:     %.3fs' % _decode_all(encoded_results)
+    print 'fixed-format path: %.3fs' % _decode_all(encoded_results)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Result Decoder Benchmark',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--results',
+                        help='Number of synthetic results to decode',
+                        type=int,
+                        default=100000)
+    main(parser.parse_args())
@@ -0,0 +1,92 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks compact encoding of NdtResult instances.
+
+Generates synthetic results and compares encoding them with
+result_encoder.encode_compact against encoding them with the equivalent
+NdtResultEncoder configuration, and checks that both produce identical output.
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+
+import pytz
+
+sys.path.insert(1, os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..')))
+
+from client_wrapper import result_encoder
+from client_wrapper import results
+
+
+def _create_synthetic_results(count):
+    start_time = datetime.datetime(2016, 1, 1, 0, 0, 0, 123456, pytz.utc)
+    synthetic_results = []
+    for i in range(count):
+        test_start_time = start_time + datetime.timedelta(minutes=i)
+        synthetic_results.append(results.NdtResult(
+            start_time=test_start_time,
+            end_time=test_start_time + datetime.timedelta(seconds=30),
+            client='ndt_js',
+            client_version='3.7.0',
+            os='Ubuntu',
+            os_version='14.04',
+            browser='firefox',
+            browser_version='45.0',
+            latency=20.0 + i % 7,
+            c2s_result=results.NdtSingleTestResult(
+                throughput=10.0 + i % 13,
+                start_time=test_start_time + datetime.timedelta(seconds=5),
+                end_time=test_start_time + datetime.timedelta(seconds=15)),
+            s2c_result=results.NdtSingleTestResult(
+                throughput=20.0 + i % 17,
+                start_time=test_start_time + datetime.timedelta(seconds=15),
+                end_time=test_start_time + datetime.timedelta(seconds=25)),
+            errors=[results.TestError('mock error', test_start_time)]))
+    return synthetic_results
+
+
+def _encode_all(encode, synthetic_results):
+    start_time = time.time()
+    encoded_results = [encode(result) for result in synthetic_results]
+    return encoded_results, time.time() - start_time
+
+
+def main(args):
+    synthetic_results = _create_synthetic_results(args.results)
+    encoder = result_encoder.NdtResultEncoder(sort_keys=True,
+                                              separators=(',', ':'))
+    print 'synthetic results: %d' % len(synthetic_results)
+    standard_output, standard_seconds = _encode_all(encoder.encode,
+                                                    synthetic_results)
+    print 'NdtResultEncoder: %.3fs' % standard_seconds
+    compact_output, compact_seconds = _encode_all(result_encoder.encode_compact,
+                                                  synthetic_results)
+    print 'encode_compact:   %.3fs' % compact_seconds
+    if compact_output != standard_output:
+        print 'ERROR: encoders produced different output'
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Result Encoder Benchmark',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--results',
+                        help='Number of synthetic results to encode',
+                        type=int,
+                        default=100000)
+    main(parser.parse_args())
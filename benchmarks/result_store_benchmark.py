@@ -0,0 +1,96 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks filtering and percentile queries on a ResultStore.
+
+Generates synthetic results and compares querying them as a list of NdtResult
+objects against querying them in a columnar ResultStore.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+import pytz
+
+sys.path.insert(1, os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..')))
+
+from client_wrapper import result_store
+from client_wrapper import results
+
+_BROWSERS = ('firefox', 'chrome', 'edge', 'safari')
+_OS_NAMES = ('Windows', 'OSX', 'Ubuntu')
+
+
+def _create_synthetic_results(count):
+    random.seed(0)
+    start_time = datetime.datetime(2016, 1, 1, tzinfo=pytz.utc)
+    synthetic_results = []
+    for i in range(count):
+        test_start_time = start_time + datetime.timedelta(minutes=i)
+        synthetic_results.append(results.NdtResult(
+            start_time=test_start_time,
+            end_time=test_start_time + datetime.timedelta(seconds=30),
+            client='ndt_js',
+            os=random.choice(_OS_NAMES),
+            browser=random.choice(_BROWSERS),
+            latency=random.uniform(5, 100),
+            c2s_result=results.NdtSingleTestResult(throughput=random.uniform(
+                1, 50)),
+            s2c_result=results.NdtSingleTestResult(throughput=random.uniform(
+                1, 100))))
+    return synthetic_results
+
+
+def _query_objects(ndt_results):
+    throughputs = sorted(r.s2c_result.throughput for r in ndt_results
+                         if r.browser == 'firefox' and r.os == 'Ubuntu' and
+                         r.s2c_result.throughput is not None)
+    return throughputs[int((len(throughputs) - 1) * 0.95)]
+
+
+def _query_store(store):
+    rows = store.select(browser='firefox', os='Ubuntu')
+    return store.percentile('s2c_throughput', 95, rows)
+
+
+def _time_call(function, *args):
+    start_time = time.time()
+    result = function(*args)
+    return result, time.time() - start_time
+
+
+def main(args):
+    ndt_results = _create_synthetic_results(args.results)
+    store, build_seconds = _time_call(result_store.ResultStore.from_results,
+                                      ndt_results)
+    print 'synthetic results: %d' % len(ndt_results)
+    print 'building store:        %.3fs' % build_seconds
+    _, objects_seconds = _time_call(_query_objects, ndt_results)
+    _, store_seconds = _time_call(_query_store, store)
+    print 'query NdtResult list:  %.1fms' % (objects_seconds * 1000)
+    print 'query ResultStore:     %.1fms' % (store_seconds * 1000)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Result Store Query Benchmark',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--results',
+                        help='Number of synthetic results to query',
+                        type=int,
+                        default=100000)
+    main(parser.parse_args())
@@ -41,18 +41,71 @@ ERROR_FORMAT_ILLEGAL_S2C_THROUGHPUT = (
 ERROR_FORMAT_ILLEGAL_C2S_THROUGHPUT = (
     'Illegal value shown for c2s throughput: [%s]')
 
+_STATUS_INDICATOR_XPATH = (
+    '//*[contains(@class, "lrfactory-internetspeed__status-indicator")]')
+_S2C_START_PHASE = browser_client_common.Phase(
+    's2c_start', _STATUS_INDICATOR_XPATH, 'Testing download...')
+_S2C_END_PHASE = browser_client_common.Phase('s2c_end', _STATUS_INDICATOR_XPATH,
+                                             'Waiting for upload to start...')
+_C2S_START_PHASE = browser_client_common.Phase(
+    'c2s_start', _STATUS_INDICATOR_XPATH, 'Testing upload...')
+# The appearance of the latency field in the results page indicates that the
+# test is complete.
+_C2S_END_PHASE = browser_client_common.Phase(
+    'c2s_end', '//*[@id="lrfactory-internetspeed__latency"]', None)
+_PHASES = (_S2C_START_PHASE, _S2C_END_PHASE, _C2S_START_PHASE, _C2S_END_PHASE)
+
+# Locators for the metric fields of the results page. The human-readable
+# element IDs are on the parent of each field, so each XPath finds the parent
+# by ID and then selects the child that holds the value.
+_RESULT_LOCATORS = {
+    'latency': (by.By.XPATH,
+                '//div[@id="lrfactory-internetspeed__latency"]/*[2]'),
+    'download': (by.By.XPATH,
+                 '//div[@id="lrfactory-internetspeed__download"]/*[1]'),
+    'upload': (by.By.XPATH,
+               '//div[@id="lrfactory-internetspeed__upload"]/*[1]'),
+}
+# The throughput fields update with live readings while each test runs.
+_THROUGHPUT_LOCATORS = {
+    'download': _RESULT_LOCATORS['download'],
+    'upload': _RESULT_LOCATORS['upload'],
+}
+
 
 class BanjoDriver(object):
 
-    def __init__(self, browser, url):
+    def __init__(self,
+                 browser,
+                 url,
+                 browser_session=None,
+                 observe_phases=False,
+                 throughput_sample_interval=None,
+                 headless=False):
         """Creates a Banjo client driver for the given URL and browser.
 
         Args:
             url: The URL of an NDT server to test against.
             browser: Can be one of 'firefox', 'chrome', 'edge', or 'safari'.
+            browser_session: A BrowserSession or BrowserPool from which to
+                take the browser for each test, or None to launch a new
+                browser for each test.
+            observe_phases: If True, detect the start and end of each test
+                phase with a PhaseObserver injected into the page instead of
+                polling the page through WebDriver.
+            throughput_sample_interval: Time between samples of the client's
+                live throughput readout (in seconds), or None to record only
+                the final throughput of each test.
+            headless: If True, run the browser without a GUI. When a
+                browser_session is provided, this must match the session's
+                own setting.
         """
         self._browser = browser
         self._url = url
+        self._browser_session = browser_session
+        self._observe_phases = observe_phases
+        self._throughput_sample_interval = throughput_sample_interval
+        self._headless = headless
 
     def perform_test(self):
         """Performs a full NDT test (both s2c and c2s) with the Banjo client.
@@ -64,25 +117,44 @@ class BanjoDriver(object):
                                    start_time=datetime.datetime.now(pytz.utc))
 
         logger.info('starting banjo test')
-        with browser_client_common.create_browser(self._browser) as driver:
+        with browser_client_common.record_browser_spans(
+                result, self._open_browser()) as driver:
             result.browser = self._browser
-            result.browser_version = browser_client_common.get_browser_version(
-                driver)
+            result.browser_headless = self._headless
+            with browser_client_common.record_span(result,
+                                                   'get_browser_version'):
+                result.browser_version = (
+                    browser_client_common.get_browser_version(driver))
 
             logger.info('loading URL: %s', self._url)
-            if browser_client_common.load_url(driver, self._url, result.errors):
+            with browser_client_common.record_span(result, 'load_url'):
+                url_loaded = browser_client_common.load_url(driver, self._url,
+                                                            result.errors)
+            if url_loaded:
                 logger.info('page loaded, starting UI flow')
-                _BanjoUiFlowWrapper(driver, self._url,
-                                    result).complete_ui_flow()
+                _BanjoUiFlowWrapper(
+                    driver, self._url, result, self._observe_phases,
+                    self._throughput_sample_interval).complete_ui_flow()
 
         result.end_time = datetime.datetime.now(pytz.utc)
         logger.info('banjo test ended')
         return result
 
+    def _open_browser(self):
+        if self._browser_session:
+            return self._browser_session.use_browser()
+        return browser_client_common.create_browser(self._browser,
+                                                    self._headless)
+
 
 class _BanjoUiFlowWrapper(object):
 
-    def __init__(self, driver, url, result):
+    def __init__(self,
+                 driver,
+                 url,
+                 result,
+                 observe_phases=False,
+                 throughput_sample_interval=None):
         """Performs the UI flow for the Banjo client test and records results.
 
         Args:
@@ -90,55 +162,135 @@ class _BanjoUiFlowWrapper(object):
             url: URL to load to start the UI flow.
             result: NdtResult instance to populate with results from proceeding
                 through the UI flow.
+            observe_phases: If True, detect test phases with a PhaseObserver
+                instead of polling through WebDriver.
+            throughput_sample_interval: Time between samples of the live
+                throughput readout (in seconds), or None to skip sampling.
         """
         self._driver = driver
         self._url = url
         self._result = result
+        self._phase_observer = None
+        if observe_phases:
+            self._phase_observer = browser_client_common.PhaseObserver(driver,
+                                                                       _PHASES)
+        self._throughput_sampler = None
+        if throughput_sample_interval:
+            self._throughput_sampler = browser_client_common.TextSampler(
+                driver, _THROUGHPUT_LOCATORS, throughput_sample_interval)
 
     def complete_ui_flow(self):
-        if not self._click_run_test_button():
+        # The observer must be in place before the test starts so that it sees
+        # every phase transition.
+        if self._phase_observer:
+            with self._record_span('install_phase_observer'):
+                installed = self._phase_observer.install()
+            if not installed:
+                logger.warning('falling back to polling for test phases')
+                self._phase_observer = None
+        with self._record_span('click_run_test_button'):
+            clicked = self._click_run_test_button()
+        if not clicked:
             return
         logger.info('clicked "Run Test" button')
+        if self._throughput_sampler and not self._throughput_sampler.start():
+            self._throughput_sampler = None
         self._record_event_times()
-        self._parse_results_page()
+        if self._throughput_sampler:
+            with self._record_span('collect_throughput_samples'):
+                samples = self._throughput_sampler.stop()
+            self._record_throughput_samples(samples)
+        with self._record_span('parse_results_page'):
+            self._parse_results_page()
+
+    def _record_span(self, name):
+        return browser_client_common.record_span(self._result, name)
 
     def _record_event_times(self):
-        if self._wait_for_download_test_to_start():
-            self._result.s2c_result.start_time = datetime.datetime.now(pytz.utc)
+        s2c_start_time = self._wait_for_phase(
+            _S2C_START_PHASE, self._wait_for_download_test_to_start,
+            browser_client_common.NDT_TEST_NEGOTIATION_TIMEOUT)
+        if s2c_start_time:
+            self._result.s2c_result.start_time = s2c_start_time
             logger.info('s2c test started')
         else:
             self._add_test_error(browser_client_common.ERROR_S2C_NEVER_STARTED)
 
-        if self._wait_for_download_test_to_end():
-            self._result.s2c_result.end_time = datetime.datetime.now(pytz.utc)
+        s2c_end_time = self._wait_for_phase(
+            _S2C_END_PHASE, self._wait_for_download_test_to_end,
+            browser_client_common.NDT_TEST_RUN_TIMEOUT)
+        if s2c_end_time:
+            self._result.s2c_result.end_time = s2c_end_time
             logger.info('s2c test finished')
         else:
             self._add_test_error(browser_client_common.ERROR_S2C_NEVER_ENDED)
 
-        if self._wait_for_upload_test_to_start():
-            self._result.c2s_result.start_time = datetime.datetime.now(pytz.utc)
+        c2s_start_time = self._wait_for_phase(
+            _C2S_START_PHASE, self._wait_for_upload_test_to_start,
+            browser_client_common.NDT_TEST_NEGOTIATION_TIMEOUT)
+        if c2s_start_time:
+            self._result.c2s_result.start_time = c2s_start_time
             logger.info('c2s test started')
         else:
             self._add_test_error(browser_client_common.ERROR_C2S_NEVER_STARTED)
 
         # When the latency field becomes visible in the web UI, the C2S test is
         # complete.
-        if self._wait_for_upload_test_to_end():
-            self._result.c2s_result.end_time = datetime.datetime.now(pytz.utc)
+        c2s_end_time = self._wait_for_phase(
+            _C2S_END_PHASE, self._wait_for_upload_test_to_end,
+            browser_client_common.NDT_TEST_RUN_TIMEOUT)
+        if c2s_end_time:
+            self._result.c2s_result.end_time = c2s_end_time
             logger.info('c2s test ended')
         else:
             self._add_test_error(browser_client_common.ERROR_C2S_NEVER_ENDED)
 
+    def _record_throughput_samples(self, samples):
+        self._result.s2c_result.throughput_samples = (
+            browser_client_common.create_throughput_series(
+                samples, self._result.s2c_result,
+                lambda texts: _parse_sampled_throughput(texts['download'])))
+        self._result.c2s_result.throughput_samples = (
+            browser_client_common.create_throughput_series(
+                samples, self._result.c2s_result,
+                lambda texts: _parse_sampled_throughput(texts['upload'])))
+
+    def _wait_for_phase(self, phase, poll_for_phase, timeout):
+        """Waits for a test phase to begin.
+
+        Args:
+            phase: The Phase for which to wait.
+            poll_for_phase: Function that polls for the phase through WebDriver
+                and returns True if the phase began, used when there is no
+                PhaseObserver.
+            timeout: Amount of time (in seconds) to wait for the phase.
+
+        Returns:
+            The time at which the phase began, as a datetime in UTC, or None if
+            the phase did not begin within the timeout.
+        """
+        with self._record_span('wait_for_' + phase.name):
+            if self._phase_observer:
+                return self._phase_observer.wait_for_phase(phase, timeout)
+            if poll_for_phase():
+                return datetime.datetime.now(pytz.utc)
+            return None
+
     def _parse_results_page(self):
-        latency = self._parse_latency()
+        metric_texts = browser_client_common.get_element_texts(self._driver,
+                                                               _RESULT_LOCATORS)
+
+        latency = self._parse_latency(metric_texts['latency'])
         if latency is not None:
             self._result.latency = latency
 
-        download_throughput = self._parse_download_throughput()
+        download_throughput = self._parse_download_throughput(metric_texts[
+            'download'])
         if download_throughput is not None:
             self._result.s2c_result.throughput = download_throughput
 
-        upload_throughput = self._parse_upload_throughput()
+        upload_throughput = self._parse_upload_throughput(metric_texts[
+            'upload'])
         if upload_throughput is not None:
             self._result.c2s_result.throughput = upload_throughput
 
@@ -200,92 +352,90 @@ class _BanjoUiFlowWrapper(object):
             return False
         return True
 
-    def _parse_latency(self):
+    def _parse_latency(self, latency_text):
         """Parses the latency field of the results page.
 
-        Finds the latency field in the results page DOM and parses the value.
-        The human-readable "latency" label is actually on the parent element of
-        the latency field, so we create an XPath to find the parent element by
-        ID, then parse the value from the parent element's second child tag.
+        Args:
+            latency_text: Text of the latency field, or None if the field is
+                not in the DOM.
 
         Returns:
             The parsed latency value (as a float, in milliseconds) if the
             latency field was found and in valid format, or None if the latency
             field could not be parsed.
         """
-        latency_element = self._driver.find_element_by_xpath(
-            '//div[@id="lrfactory-internetspeed__latency"]/*[2]')
-        if not latency_element:
+        if latency_text is None:
             self._add_test_error(ERROR_NO_LATENCY_FIELD)
             return None
-        # The latency is stored as "[value] ms" like "12 ms" so we split the
-        # string and use the numeric portion.
-        latency_text = latency_element.text
         if not latency_text:
-            self._add_test_error(ERROR_FORMAT_ILLEGAL_LATENCY %
-                                 latency_element.text)
+            self._add_test_error(ERROR_FORMAT_ILLEGAL_LATENCY % latency_text)
             return None
+        # The latency is stored as "[value] ms" like "12 ms" so we split the
+        # string and use the numeric portion.
         latency_value_parts = latency_text.split()
         latency_value = latency_value_parts[0]
         try:
             return float(latency_value)
         except ValueError:
-            self._add_test_error(ERROR_FORMAT_ILLEGAL_LATENCY %
-                                 latency_element.text)
+            self._add_test_error(ERROR_FORMAT_ILLEGAL_LATENCY % latency_text)
             return None
 
-    def _parse_download_throughput(self):
+    def _parse_download_throughput(self, throughput_text):
         """Parses the download throughput field of the results page.
 
-        Finds the download throughput field in the results page DOM and parses
-        the value. The human-readable "download" element ID is actually on the
-        parent element of the download throughput field, so we create an XPath
-        to find the parent element by ID, then parse the value from the parent's
-        first child.
+        Args:
+            throughput_text: Text of the download throughput field, or None if
+                the field is not in the DOM.
 
         Returns:
             The parsed download throughput value (as a float, in Mbps) if the
             download throughput field was found and in valid format, or None if
             the download throughput field could not be parsed.
         """
-        throughput = self._driver.find_element_by_xpath(
-            '//div[@id="lrfactory-internetspeed__download"]/*[1]')
-        if not throughput:
+        if throughput_text is None:
             self._add_test_error(ERROR_NO_S2C_FIELD)
             return None
         try:
-            return float(throughput.text)
+            return float(throughput_text)
         except ValueError:
             self._add_test_error(ERROR_FORMAT_ILLEGAL_S2C_THROUGHPUT %
-                                 throughput.text)
+                                 throughput_text)
             return None
 
-    def _parse_upload_throughput(self):
+    def _parse_upload_throughput(self, throughput_text):
         """Parses the upload throughput field of the results page.
 
-        Finds the upload throughput field in the results page DOM and parses the
-        value. The human-readable "upload" element ID is actually on the parent
-        element of the upload throughput field, so we create an XPath to find
-        the parent element by ID, then parse the value from the parent's first
-        child.
+        Args:
+            throughput_text: Text of the upload throughput field, or None if
+                the field is not in the DOM.
 
         Returns:
             The parsed upload throughput value (as a float, in Mbps) if the
             upload throughput field was found and in valid format, or None if
             the upload throughput field could not be parsed.
         """
-        throughput = self._driver.find_element_by_xpath(
-            '//div[@id="lrfactory-internetspeed__upload"]/*[1]')
-        if not throughput:
+        if throughput_text is None:
             self._add_test_error(ERROR_NO_C2S_FIELD)
             return None
         try:
-            return float(throughput.text)
+            return float(throughput_text)
         except ValueError:
             self._add_test_error(ERROR_FORMAT_ILLEGAL_C2S_THROUGHPUT %
-                                 throughput.text)
+                                 throughput_text)
             return None
 
     def _add_test_error(self, error_message):
         self._result.errors.append(results.TestError(error_message))
         logger.error(error_message)
+
+
+def _parse_sampled_throughput(throughput_text):
+    """Parses a sampled throughput reading, or returns None if it is invalid.
+
+    A sampled reading may be blank or mid-update, so we ignore invalid
+    readings rather than report them as errors.
+    """
+    try:
+        return float(throughput_text)
+    except (TypeError, ValueError):
+        return None
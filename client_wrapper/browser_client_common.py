@@ -12,16 +12,27 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import contextlib
+import datetime
+import logging
+import Queue
+import sys
+import threading
 
+import pytz
 from selenium import webdriver
 from selenium.common import exceptions
+from selenium.webdriver.firefox import firefox_binary
+from selenium.webdriver.common import by
 from selenium.webdriver.support import expected_conditions
 from selenium.webdriver.support import ui
 
 import names
 import results
 
+logger = logging.getLogger(__name__)
+
 # Number of seconds to wait for any particular event to occur in the browser UI
 # (e.g. page load, element becomes clickable).
 UI_WAIT_TIMEOUT = 2
@@ -34,6 +45,9 @@ NDT_TEST_NEGOTIATION_TIMEOUT = 8
 # seconds, plus four seconds of fudge factor).
 NDT_TEST_RUN_TIMEOUT = 10 + 4
 
+# Number of seconds that WebDriver waits for an asynchronous script by default.
+DEFAULT_SCRIPT_TIMEOUT = 30
+
 ERROR_FAILED_TO_LOAD_URL_FORMAT = 'Failed to load URL: %s'
 ERROR_TIMED_OUT_WAITING_FOR_PAGE_LOAD = 'Timed out waiting for page to load.'
 
@@ -53,9 +67,73 @@ class BrowserVersionMissing(Error):
     """Error raised when a browser version does not apper in Selenium driver."""
     pass
 
+# A phase of a test that is visible in a client's web UI. The phase begins when
+# the first element matching the XPath contains the given text or, if text is
+# None, when that element becomes visible.
+Phase = collections.namedtuple('Phase', ['name', 'xpath', 'text'])
+
+# Installs a MutationObserver that records the time at which each phase begins.
+# Each time is in milliseconds since the epoch, with sub-millisecond precision.
+_INSTALL_PHASE_OBSERVER_SCRIPT = """
+var phases = arguments[0];
+var state = {times: {}, waiters: {}};
+function isVisible(node) {
+  return !!(node.offsetWidth || node.offsetHeight ||
+            node.getClientRects().length);
+}
+function checkPhases() {
+  var now = performance.timing.navigationStart + performance.now();
+  for (var i = 0; i < phases.length; i++) {
+    var name = phases[i][0];
+    if (state.times.hasOwnProperty(name)) {
+      continue;
+    }
+    var node = document.evaluate(
+        phases[i][1], document, null,
+        XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    if (!node) {
+      continue;
+    }
+    var text = phases[i][2];
+    if (text === null ? !isVisible(node) :
+        node.textContent.indexOf(text) === -1) {
+      continue;
+    }
+    state.times[name] = now;
+    if (state.waiters[name]) {
+      state.waiters[name](now);
+      delete state.waiters[name];
+    }
+  }
+}
+if (window.__ndtPhaseObserver) {
+  window.__ndtPhaseObserver.observer.disconnect();
+}
+state.observer = new MutationObserver(checkPhases);
+state.observer.observe(document.documentElement, {
+  attributes: true, characterData: true, childList: true, subtree: true});
+window.__ndtPhaseObserver = state;
+checkPhases();
+"""
+
+# Calls back with the start time of a phase as soon as the phase begins, or
+# with null if no PhaseObserver is installed on the current page.
+_WAIT_FOR_PHASE_SCRIPT = """
+var name = arguments[0];
+var callback = arguments[arguments.length - 1];
+var state = window.__ndtPhaseObserver;
+if (!state) {
+  callback(null);
+} else if (state.times.hasOwnProperty(name)) {
+  callback(state.times[name]);
+} else {
+  state.waiters[name] = callback;
+}
+"""
+
 
 @contextlib.contextmanager
-def create_browser(browser):
+def create_browser(browser, headless=False):
     """Creates a context manager for a Selenium-controlled web browser.
 
     Creates a context manager to produce a Selenium-driven web browser. The
@@ -64,15 +142,36 @@ def create_browser(browser):
 
     Args:
         browser: Can be one of 'firefox', 'chrome', 'edge', or 'safari'
+        headless: If True, run the browser without a GUI. Only supported for
+            'firefox' and 'chrome'. Firefox ignores the flag before version
+            55, and Selenium 2 cannot drive Firefox versions that support it,
+            so headless Firefox requires Selenium 3 or later with
+            geckodriver.
 
     Yields:
         An instance of a Selenium webdriver browser class corresponding to
         the specified browser.
     """
+    if headless and browser not in (names.FIREFOX, names.CHROME):
+        raise ValueError('Headless mode is not supported for browser: %s' %
+                         browser)
+
     if browser == names.FIREFOX:
-        driver = webdriver.Firefox()
+        if headless:
+            binary = firefox_binary.FirefoxBinary()
+            binary.add_command_line_options('-headless')
+            driver = webdriver.Firefox(firefox_binary=binary)
+        else:
+            driver = webdriver.Firefox()
     elif browser == names.CHROME:
-        driver = webdriver.Chrome()
+        if headless:
+            options = webdriver.ChromeOptions()
+            options.add_argument('--headless')
+            # Older headless Chrome builds fail to render without this flag.
+            options.add_argument('--disable-gpu')
+            driver = webdriver.Chrome(chrome_options=options)
+        else:
+            driver = webdriver.Chrome()
     elif browser == names.EDGE:
         driver = webdriver.Edge()
     elif browser == names.SAFARI:
@@ -87,6 +186,546 @@ def create_browser(browser):
     driver.quit()
 
 
+class BrowserSession(object):
+    """A Selenium-controlled web browser that persists across multiple tests.
+
+    Launching a browser can take almost as long as an NDT test itself, so
+    rather than launching a fresh browser for every test, a BrowserSession keeps
+    a single browser running and resets its state between tests. If the browser
+    dies, the session launches a new one in its place.
+
+    The owner of the instance is responsible for calling close() to shut down
+    the browser.
+    """
+
+    def __init__(self, browser, headless=False):
+        """Creates a new BrowserSession.
+
+        Args:
+            browser: Can be one of 'firefox', 'chrome', 'edge', or 'safari'
+            headless: If True, run the browser without a GUI.
+        """
+        self._browser = browser
+        self._headless = headless
+        self._browser_context = None
+        self._driver = None
+
+    @contextlib.contextmanager
+    def use_browser(self):
+        """Creates a context manager for the session's browser.
+
+        Unlike create_browser, the browser keeps running when the context
+        manager exits so that the next test can reuse it.
+
+        Yields:
+            An instance of a Selenium webdriver browser class corresponding to
+            the session's browser, with its state reset for a new test.
+        """
+        if self._driver and not reset_browser_state(self._driver):
+            logger.warning('browser session is unresponsive, relaunching')
+            self._quit_browser()
+        if not self._driver:
+            self._launch_browser()
+        yield self._driver
+
+    def close(self):
+        """Shuts down the session's browser."""
+        self._quit_browser()
+
+    def _launch_browser(self):
+        self._browser_context = create_browser(self._browser, self._headless)
+        self._driver = self._browser_context.__enter__()
+
+    def _quit_browser(self):
+        browser_context = self._browser_context
+        self._browser_context = None
+        self._driver = None
+        if not browser_context:
+            return
+        try:
+            browser_context.__exit__(None, None, None)
+        except (exceptions.WebDriverException, IOError) as e:
+            # The browser may have already died, in which case there is
+            # nothing left to shut down.
+            logger.warning('failed to quit browser: %s', e)
+
+# Defines a function that returns the visible text of the element that each
+# locator identifies, or null for each locator that matches no element.
+_READ_ELEMENT_TEXTS_FUNCTION = """
+function readElementTexts(locators) {
+  var texts = {};
+  for (var name in locators) {
+    var strategy = locators[name][0];
+    var value = locators[name][1];
+    var node = null;
+    if (strategy === 'id') {
+      node = document.getElementById(value);
+    } else {
+      node = document.evaluate(
+          value, document, null,
+          XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    }
+    if (!node) {
+      texts[name] = null;
+      continue;
+    }
+    var text = node.innerText === undefined ? node.textContent : node.innerText;
+    texts[name] = text.replace(/^\\s+|\\s+$/g, '');
+  }
+  return texts;
+}
+"""
+
+_GET_ELEMENT_TEXTS_SCRIPT = (
+    _READ_ELEMENT_TEXTS_FUNCTION + 'return readElementTexts(arguments[0]);')
+
+# Starts a timer that records the element texts every interval, along with the
+# time of each sample in milliseconds since the epoch.
+_START_TEXT_SAMPLER_SCRIPT = _READ_ELEMENT_TEXTS_FUNCTION + """
+var locators = arguments[0];
+var intervalMs = arguments[1];
+if (window.__ndtTextSampler) {
+  clearInterval(window.__ndtTextSampler.timer);
+}
+var sampler = {samples: []};
+function takeSample() {
+  sampler.samples.push([performance.timing.navigationStart + performance.now(),
+                        readElementTexts(locators)]);
+}
+sampler.timer = setInterval(takeSample, intervalMs);
+window.__ndtTextSampler = sampler;
+takeSample();
+"""
+
+# Stops the sampler timer and returns every sample it recorded, or null if no
+# sampler is running on the current page.
+_STOP_TEXT_SAMPLER_SCRIPT = """
+var sampler = window.__ndtTextSampler;
+if (!sampler) {
+  return null;
+}
+clearInterval(sampler.timer);
+delete window.__ndtTextSampler;
+return sampler.samples;
+"""
+
+
+class PhaseObserver(object):
+    """Detects the phases of a test from within the page under test.
+
+    Waiting for a phase with WebDriverWait polls the browser over the WebDriver
+    protocol, so each wait costs many round trips and the recorded time of the
+    phase can be off by up to a full polling interval. A PhaseObserver instead
+    injects a MutationObserver into the page, which timestamps each phase with
+    performance.now() the moment the DOM changes. Waiting for a phase then
+    costs a single asynchronous script call.
+
+    The observer lives in the page, so it must be installed after the page
+    loads and before the test begins, and it is lost if the page navigates.
+    """
+
+    def __init__(self, driver, phases, script_timeout=DEFAULT_SCRIPT_TIMEOUT):
+        """Creates a new PhaseObserver.
+
+        Args:
+            driver: An instance of a Selenium webdriver browser class.
+            phases: A list of Phase instances to observe.
+            script_timeout: The driver's script timeout (in seconds), which is
+                restored after each wait. WebDriver offers no way to read the
+                current timeout back from the driver.
+        """
+        self._driver = driver
+        self._phases = phases
+        self._script_timeout = script_timeout
+
+    def install(self):
+        """Injects the observer into the page currently loaded in the browser.
+
+        Returns:
+            True if the observer was installed.
+        """
+        try:
+            self._driver.execute_script(_INSTALL_PHASE_OBSERVER_SCRIPT, [
+                [phase.name, phase.xpath, phase.text] for phase in self._phases
+            ])
+        except exceptions.WebDriverException as e:
+            logger.warning('failed to install phase observer: %s', e)
+            return False
+        return True
+
+    def wait_for_phase(self, phase, timeout):
+        """Waits until a phase begins within a given timeout.
+
+        Args:
+            phase: The Phase for which to wait.
+            timeout: The maximum time to wait (in seconds).
+
+        Returns:
+            The time at which the phase began, as a datetime in UTC, or None if
+            the phase did not begin within the timeout.
+        """
+        try:
+            self._driver.set_script_timeout(timeout)
+            start_time_ms = self._driver.execute_async_script(
+                _WAIT_FOR_PHASE_SCRIPT, phase.name)
+        except exceptions.TimeoutException:
+            return None
+        except exceptions.WebDriverException as e:
+            logger.warning('failed to wait for phase %s: %s', phase.name, e)
+            return None
+        finally:
+            self._restore_script_timeout()
+        if start_time_ms is None:
+            logger.warning('phase observer is missing from page')
+            return None
+        return datetime.datetime.fromtimestamp(start_time_ms / 1000.0, pytz.utc)
+
+    def _restore_script_timeout(self):
+        try:
+            self._driver.set_script_timeout(self._script_timeout)
+        except exceptions.WebDriverException as e:
+            logger.warning('failed to restore script timeout: %s', e)
+
+
+class TextSampler(object):
+    """Samples the text of DOM elements at a fixed interval from within a page.
+
+    Sampling a client's live readouts through WebDriver would cost several
+    round trips per sample and compete with the test for the driver, so a
+    TextSampler instead runs a timer in the page that records the samples
+    locally. WebDriver is only involved to start the sampler and to collect
+    its samples once the test is over.
+    """
+
+    def __init__(self, driver, locators, interval):
+        """Creates a new TextSampler.
+
+        Args:
+            driver: An instance of a Selenium webdriver browser class.
+            locators: A dictionary of element locators, in the format accepted
+                by get_element_texts.
+            interval: Time between samples (in seconds).
+        """
+        _check_locators(locators)
+        self._driver = driver
+        self._locators = locators
+        self._interval = interval
+
+    def start(self):
+        """Starts sampling in the page currently loaded in the browser.
+
+        Returns:
+            True if the sampler started.
+        """
+        try:
+            self._driver.execute_script(_START_TEXT_SAMPLER_SCRIPT,
+                                        _serialize_locators(self._locators),
+                                        int(self._interval * 1000))
+        except exceptions.WebDriverException as e:
+            logger.warning('failed to start text sampler: %s', e)
+            return False
+        return True
+
+    def stop(self):
+        """Stops sampling and collects the samples.
+
+        Returns:
+            A list of (timestamp, texts) pairs in the order in which the samples
+            were taken, where timestamp is a datetime in UTC and texts is a
+            dictionary in the format returned by get_element_texts. The list is
+            empty if the sampler was not running.
+        """
+        try:
+            raw_samples = self._driver.execute_script(_STOP_TEXT_SAMPLER_SCRIPT)
+        except exceptions.WebDriverException as e:
+            logger.warning('failed to collect text samples: %s', e)
+            return []
+        samples = []
+        for timestamp_ms, texts in raw_samples or []:
+            timestamp = datetime.datetime.fromtimestamp(timestamp_ms / 1000.0,
+                                                        pytz.utc)
+            samples.append((timestamp, {name: texts.get(name)
+                                        for name in self._locators}))
+        return samples
+
+
+def create_throughput_series(samples, test_result, parse_throughput):
+    """Creates a series of the throughput samples taken during a single test.
+
+    Args:
+        samples: A list of (timestamp, texts) pairs, as returned by
+            TextSampler.stop.
+        test_result: The NdtSingleTestResult of the test, with its start_time
+            and end_time populated.
+        parse_throughput: Function that takes the texts of a sample and returns
+            the throughput reading (in Mbps), or None if the sample does not
+            contain a valid reading.
+
+    Returns:
+        A ThroughputSeries of the valid readings sampled between the start and
+        end of the test, or None if the test never started or ended.
+    """
+    if not test_result.start_time or not test_result.end_time:
+        return None
+    series = results.ThroughputSeries()
+    for timestamp, texts in samples:
+        if not test_result.start_time <= timestamp <= test_result.end_time:
+            continue
+        throughput = parse_throughput(texts)
+        if throughput is not None:
+            offset = (timestamp - test_result.start_time).total_seconds()
+            series.append(offset, throughput)
+    return series
+
+
+class BrowserPool(object):
+    """A pool of Selenium-controlled web browsers launched ahead of time.
+
+    Launching a browser takes several seconds, which otherwise sits between
+    the end of one test and the start of the next. A BrowserPool keeps a number
+    of browsers launched in the background, so that each test can start in an
+    already-running browser. Each browser is used for a single test. When the
+    test ends, the pool quits that browser and launches its replacement in the
+    background while the next test runs.
+
+    After calling start(), the owner of the instance is responsible for calling
+    close() to shut down the pool's browsers.
+    """
+
+    def __init__(self, browser, size, headless=False):
+        """Creates a new BrowserPool.
+
+        Args:
+            browser: Can be one of 'firefox', 'chrome', 'edge', or 'safari'
+            size: Number of browsers to keep launched ahead of time.
+            headless: If True, run the browsers without a GUI.
+        """
+        if size < 1:
+            raise ValueError('Browser pool size must be positive: %d' % size)
+        self._browser = browser
+        self._size = size
+        self._headless = headless
+        # Each item is a (browser_context, driver, launch_error) tuple, where
+        # either launch_error is None or the other two are.
+        self._ready_browsers = Queue.Queue()
+        self._threads = []
+        self._threads_lock = threading.Lock()
+        self._closed = False
+
+    def start(self):
+        """Starts launching the pool's browsers in the background."""
+        for _ in range(self._size):
+            self._run_in_background(self._launch_browser)
+
+    @contextlib.contextmanager
+    def use_browser(self):
+        """Creates a context manager for a browser from the pool.
+
+        Blocks until the pool has a browser ready. When the context manager
+        exits, the browser is shut down and replaced in the background.
+
+        Yields:
+            An instance of a Selenium webdriver browser class corresponding to
+            the pool's browser.
+
+        Raises:
+            Exception: Launching the browser failed. The pool launches a
+                replacement in the background before raising.
+        """
+        browser_context, driver = self._take_browser()
+        try:
+            yield driver
+        finally:
+            self._run_in_background(self._quit_browser, browser_context)
+            self._run_in_background(self._launch_browser)
+
+    def close(self):
+        """Shuts down the pool's browsers, including any still launching."""
+        self._closed = True
+        while True:
+            with self._threads_lock:
+                threads = list(self._threads)
+            if not threads:
+                break
+            for thread in threads:
+                thread.join()
+        while True:
+            try:
+                browser_context, _, _ = self._ready_browsers.get_nowait()
+            except Queue.Empty:
+                break
+            # A failed launch leaves no browser to shut down.
+            if browser_context is None:
+                continue
+            self._quit_browser(browser_context)
+
+    def _take_browser(self):
+        """Takes the next launched browser from the pool.
+
+        Browsers that stopped responding while they waited in the pool are
+        replaced in the background and skipped.
+        """
+        while True:
+            browser_context, driver, launch_error = self._ready_browsers.get()
+            if launch_error:
+                self._run_in_background(self._launch_browser)
+                raise launch_error
+            if _is_browser_responsive(driver):
+                return browser_context, driver
+            logger.warning('pooled browser is unresponsive, replacing it')
+            self._run_in_background(self._quit_browser, browser_context)
+            self._run_in_background(self._launch_browser)
+
+    def _run_in_background(self, target, *args):
+        if self._closed:
+            return
+        thread = threading.Thread(target=self._run_thread,
+                                  args=(target,) + args)
+        thread.daemon = True
+        with self._threads_lock:
+            self._threads.append(thread)
+        thread.start()
+
+    def _run_thread(self, target, *args):
+        try:
+            target(*args)
+        finally:
+            with self._threads_lock:
+                self._threads.remove(threading.current_thread())
+
+    def _launch_browser(self):
+        browser_context = create_browser(self._browser, self._headless)
+        try:
+            driver = browser_context.__enter__()
+        except Exception as e:
+            # Hand the error to the test that takes this slot in the pool, so
+            # that launch failures are reported rather than silently retried.
+            logger.error('failed to launch browser: %s', e)
+            self._ready_browsers.put((None, None, e))
+            return
+        if self._closed:
+            self._quit_browser(browser_context)
+            return
+        self._ready_browsers.put((browser_context, driver, None))
+
+    def _quit_browser(self, browser_context):
+        try:
+            browser_context.__exit__(None, None, None)
+        except (exceptions.WebDriverException, IOError) as e:
+            # The browser may have already died, in which case there is
+            # nothing left to shut down.
+            logger.warning('failed to quit browser: %s', e)
+
+
+def _is_browser_responsive(driver):
+    # Any WebDriver command fails once the browser has died.
+    try:
+        driver.window_handles
+    except (exceptions.WebDriverException, IOError):
+        return False
+    return True
+
+
+def reset_browser_state(driver):
+    """Resets a browser's state so that it can run a fresh test.
+
+    Closes all but one window, clears the cookies and web storage that the
+    previous test left behind, and navigates to a blank page.
+
+    Args:
+        driver: An instance of a Selenium webdriver browser class.
+
+    Returns:
+        True if the browser responded and its state was reset, False if the
+        browser could not be reset (e.g. because it crashed).
+    """
+    try:
+        window_handles = driver.window_handles
+        for window_handle in window_handles[1:]:
+            driver.switch_to.window(window_handle)
+            driver.close()
+        driver.switch_to.window(window_handles[0])
+        driver.delete_all_cookies()
+        # Web storage is scoped to the current page's origin, so we must clear
+        # it before navigating away. Pages like about:blank throw on access to
+        # storage, which we ignore.
+        driver.execute_script('try {'
+                              '  window.localStorage.clear();'
+                              '  window.sessionStorage.clear();'
+                              '} catch (e) {}')
+        driver.get('about:blank')
+    except (exceptions.WebDriverException, IOError) as e:
+        logger.warning('failed to reset browser state: %s', e)
+        return False
+    return True
+
+
+def start_span(result, name):
+    """Starts timing a step of a test.
+
+    Args:
+        result: NdtResult instance in which to record the step's timing.
+        name: Name of the step.
+
+    Returns:
+        The Span of the step, which the caller must finish() when the step ends.
+    """
+    span = results.Span(name, datetime.datetime.now(pytz.utc))
+    result.spans.append(span)
+    return span
+
+
+@contextlib.contextmanager
+def record_span(result, name):
+    """Records the time spent in a block as a step of a test.
+
+    The step is recorded even if the block raises an exception.
+
+    Args:
+        result: NdtResult instance in which to record the step's timing.
+        name: Name of the step.
+
+    Yields:
+        The Span of the step.
+    """
+    span = start_span(result, name)
+    try:
+        yield span
+    finally:
+        span.finish()
+
+
+@contextlib.contextmanager
+def record_browser_spans(result, browser):
+    """Uses a browser, recording the time spent opening and closing it.
+
+    Opening the browser is recorded as an 'open_browser' step and closing it
+    as a 'close_browser' step. Each step is recorded even if opening or closing
+    the browser raises an exception.
+
+    Args:
+        result: NdtResult instance in which to record the steps' timing.
+        browser: Context manager that opens a browser on entry, yields its
+            driver, and closes the browser on exit, as returned by
+            create_browser.
+
+    Yields:
+        The driver that the browser context manager yields.
+    """
+    with record_span(result, 'open_browser'):
+        driver = browser.__enter__()
+    try:
+        yield driver
+    except:
+        exc_info = sys.exc_info()
+        with record_span(result, 'close_browser'):
+            if not browser.__exit__(*exc_info):
+                raise exc_info[0], exc_info[1], exc_info[2]
+    else:
+        with record_span(result, 'close_browser'):
+            browser.__exit__(None, None, None)
+
+
 def get_browser_version(driver):
     """Determine the browser version for a Selenium WebDriver instance.
 
@@ -153,6 +792,46 @@ def wait_until_element_is_visible(driver, element, timeout):
     return True
 
 
+def get_element_texts(driver, locators):
+    """Gets the text of several DOM elements in a single WebDriver call.
+
+    Reading each element's text through WebDriver costs two round trips (one
+    to find the element and one to read its text), which adds up against a
+    remote or slow driver. This function instead reads every element's text
+    with a single script.
+
+    Args:
+        driver: An instance of a Selenium webdriver browser class.
+        locators: A dictionary where each key is a name and each value is a
+            (by, value) tuple that locates an element, where by is either
+            By.ID or By.XPATH.
+
+    Returns:
+        A dictionary where each key is a name from locators and each value is
+        the visible text of the corresponding element, with leading and
+        trailing whitespace removed, or None if the element could not be found.
+    """
+    _check_locators(locators)
+    try:
+        texts = driver.execute_script(_GET_ELEMENT_TEXTS_SCRIPT,
+                                      _serialize_locators(locators))
+    except exceptions.WebDriverException as e:
+        logger.error('failed to read element texts: %s', e)
+        texts = None
+    texts = texts or {}
+    return {name: texts.get(name) for name in locators}
+
+
+def _check_locators(locators):
+    for strategy, _ in locators.itervalues():
+        if strategy not in (by.By.ID, by.By.XPATH):
+            raise ValueError('Unsupported locator strategy: %s' % strategy)
+
+
+def _serialize_locators(locators):
+    return {name: list(locator) for name, locator in locators.iteritems()}
+
+
 def find_element_containing_text(driver, text):
     """Finds the element that contains the specified text in the browser DOM.
 
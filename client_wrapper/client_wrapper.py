@@ -15,42 +15,322 @@
 import argparse
 import contextlib
 import logging
+import multiprocessing
 import os
+import Queue
 
 import banjo_driver
-import filename
+import browser_client_common
 import html5_driver
-import http_response
 import http_server
 import names
-import result_encoder
+import replay_cache
+import result_stats
+import result_writer
 import os_metadata
+import scheduler
+import trace_events
 
 logger = logging.getLogger(__name__)
 
+# Name of the trace track that shows each test iteration and its steps.
+_TESTS_TRACK = 'tests'
+
+
+class Error(Exception):
+    pass
+
+
+class WorkerFailedError(Error):
+    """Error raised when one or more worker processes exit abnormally."""
+
+    def __init__(self, worker_ids):
+        super(WorkerFailedError, self).__init__(
+            'Worker(s) exited abnormally: %s' %
+            ', '.join(str(worker_id) for worker_id in worker_ids))
+
 
 def main(args):
     _configure_logging(args.verbose)
+    try:
+        if args.workers > 1:
+            run_stats = _run_workers(args)
+        else:
+            run_stats = _run_worker(args, worker_id=None)
+    finally:
+        # Write the trace even if a worker failed, as the events it recorded
+        # before failing show what it was doing.
+        if args.trace:
+            _write_trace(args)
+    print run_stats.format_summary()
+
+
+def _write_trace(args):
+    """Merges the events files of every worker into the run's trace file.
+
+    Args:
+        args: Parsed command-line arguments.
+    """
+    if args.workers > 1:
+        worker_ids = range(args.workers)
+    else:
+        worker_ids = [None]
+    events_paths = [_get_trace_events_path(args.trace, worker_id)
+                    for worker_id in worker_ids]
+    trace_events.write_trace(args.trace, events_paths)
+    for events_path in events_paths:
+        if os.path.exists(events_path):
+            os.remove(events_path)
+    logger.info('wrote trace of run to %s', args.trace)
+
+
+def _run_workers(args):
+    """Runs independent test workers in parallel, each in its own process.
+
+    Each worker runs the full number of iterations with its own browser (and,
+    for replay-based clients, its own replay server), and saves its results to
+    the shared output directory.
+
+    Args:
+        args: Parsed command-line arguments.
+
+    Returns:
+        ResultStats for the results of all the workers.
+
+    Raises:
+        WorkerFailedError: One or more worker processes exited abnormally.
+    """
+    # Each worker sends back the statistics for its own results, which are
+    # merged into statistics for the whole run.
+    stats_queue = multiprocessing.Queue()
+    workers = []
+    for worker_id in range(args.workers):
+        worker = multiprocessing.Process(target=_run_worker_process,
+                                         args=(args, worker_id, stats_queue))
+        worker.start()
+        workers.append(worker)
+    run_stats = result_stats.ResultStats()
+    # Receive statistics while the workers run, as a worker cannot exit until
+    # the statistics it sent have been read.
+    while any(worker.is_alive() for worker in workers):
+        _merge_queued_stats(stats_queue, run_stats, timeout=1)
+    _merge_queued_stats(stats_queue, run_stats)
+    failed_worker_ids = []
+    for worker_id, worker in enumerate(workers):
+        worker.join()
+        if worker.exitcode != 0:
+            logger.error('worker %d exited with code %d', worker_id,
+                         worker.exitcode)
+            failed_worker_ids.append(worker_id)
+    if failed_worker_ids:
+        raise WorkerFailedError(failed_worker_ids)
+    return run_stats
+
+
+def _merge_queued_stats(stats_queue, run_stats, timeout=None):
+    """Merges every ResultStats on a queue into the run's statistics.
+
+    Args:
+        stats_queue: Queue of ResultStats sent by workers.
+        run_stats: ResultStats into which to merge the queued statistics.
+        timeout: Number of seconds to wait for the first ResultStats to
+            arrive, or None to only merge statistics already on the queue.
+    """
+    try:
+        if timeout is not None:
+            run_stats.merge(stats_queue.get(timeout=timeout))
+        while True:
+            run_stats.merge(stats_queue.get_nowait())
+    except Queue.Empty:
+        pass
+
+
+def _run_worker_process(args, worker_id, stats_queue):
+    """Entry point for a worker's child process."""
+    # On platforms that spawn rather than fork child processes, the child does
+    # not inherit the parent's logging configuration.
+    if not logging.getLogger().handlers:
+        _configure_logging(args.verbose)
+    stats_queue.put(_run_worker(args, worker_id))
+
+
+def _run_worker(args, worker_id):
+    """Runs all test iterations for a single worker.
+
+    Args:
+        args: Parsed command-line arguments.
+        worker_id: Numeric ID of the worker, or None if this is the only
+            worker.
+
+    Returns:
+        ResultStats for the worker's results.
+    """
+    run_stats = result_stats.ResultStats()
+    with _open_trace_recorder(args, worker_id) as trace_recorder:
+        browser_session = _create_browser_session(args)
+        try:
+            with contextlib.closing(_create_result_writer(
+                    args, worker_id, trace_recorder)) as writer:
+                writer.start()
+                _run_client(args, browser_session, writer, run_stats, worker_id,
+                            trace_recorder)
+        finally:
+            if browser_session:
+                browser_session.close()
+    return run_stats
+
+
+@contextlib.contextmanager
+def _open_trace_recorder(args, worker_id):
+    """Opens a recorder for a worker's trace events if args enable tracing.
+
+    The recorder streams the worker's events to the worker's own events file,
+    which _write_trace merges into the trace once the run ends.
+
+    Args:
+        args: Parsed command-line arguments.
+        worker_id: Numeric ID of the worker, or None if this is the only
+            worker.
+
+    Yields:
+        A TraceRecorder, or None if tracing is disabled.
+    """
+    if not args.trace:
+        yield None
+        return
+    with open(
+            _get_trace_events_path(args.trace, worker_id), 'w') as events_file:
+        if worker_id is None:
+            yield trace_events.TraceRecorder(1, 'client_wrapper', events_file)
+        else:
+            # Each worker appears as its own process in the trace.
+            yield trace_events.TraceRecorder(worker_id + 1, 'worker %d' %
+                                             worker_id, events_file)
+
+
+def _get_trace_events_path(trace_path, worker_id):
+    """Returns the path of the file to which a worker streams trace events."""
+    if worker_id is None:
+        return trace_path + '.events'
+    return '%s.w%d.events' % (trace_path, worker_id)
+
+
+def _create_result_writer(args, worker_id, trace_recorder=None):
+    """Creates a writer that saves results in the format set in args.
+
+    Args:
+        args: Parsed command-line arguments.
+        worker_id: Numeric ID of the worker, or None if this is the only
+            worker.
+        trace_recorder: TraceRecorder on which the writer records its saves,
+            or None.
+
+    Returns:
+        A ResultWriter, which the caller must start and close.
+    """
+    if args.output_format == 'jsonl':
+        return result_writer.JsonLinesResultWriter(
+            args.output,
+            worker_id,
+            print_results=True,
+            max_segment_bytes=args.segment_max_bytes,
+            max_segment_age=args.segment_max_age,
+            trace_recorder=trace_recorder)
+    return result_writer.ResultWriter(args.output,
+                                      worker_id,
+                                      print_results=True,
+                                      trace_recorder=trace_recorder)
+
+
+def _create_browser_session(args):
+    """Creates the source of browsers for a worker's tests.
+
+    Args:
+        args: Parsed command-line arguments.
+
+    Returns:
+        A started BrowserPool if the args specify a browser pool, a
+        BrowserSession if they specify browser reuse, or None if each test
+        should launch its own browser.
+
+    Raises:
+        Error: The args specify both a browser pool and browser reuse.
+    """
+    if args.browser_pool_size:
+        if args.reuse_browser:
+            raise Error('--browser_pool_size and --reuse_browser cannot be '
+                        'used together')
+        browser_pool = browser_client_common.BrowserPool(
+            args.browser, args.browser_pool_size, args.headless)
+        browser_pool.start()
+        return browser_pool
+    if args.reuse_browser:
+        return browser_client_common.BrowserSession(args.browser, args.headless)
+    return None
+
+
+def _run_client(args,
+                browser_session,
+                writer,
+                run_stats,
+                worker_id,
+                trace_recorder=None):
+    """Runs all test iterations for the NDT client specified in args.
+
+    Args:
+        args: Parsed command-line arguments.
+        browser_session: A BrowserSession or BrowserPool from which to take
+            the browser for each test, or None to launch a new browser for
+            each test.
+        writer: ResultWriter with which to save each result.
+        run_stats: ResultStats to which to add each result.
+        worker_id: Numeric ID of the worker running the client, or None if this
+            is the only worker.
+        trace_recorder: TraceRecorder on which to record the run's tests and
+            replayed requests, or None.
+    """
     if args.client == names.BANJO:
-        with open(args.client_path) as replay_file:
-            replays = http_response.parse_yaml(replay_file.read())
+        replays = replay_cache.load_replays(args.client_path,
+                                            args.map_replay_bodies)
         with contextlib.closing(http_server.create_replay_server_manager(
-                replays, args.server)) as replay_server_manager:
+                replays, args.server, args.replay_workers,
+                args.replay_keep_alive_timeout,
+                trace_recorder)) as replay_server_manager:
             replay_server_manager.start()
             logger.info('replay server replaying %s on port %d',
                         args.client_path, replay_server_manager.port)
             url = 'http://localhost:%d/banjo' % replay_server_manager.port
             logger.info('starting tests against %s', url)
-            driver = banjo_driver.BanjoDriver(args.browser, url)
-            _run_test_iterations(driver, args.iterations, args.output)
+            driver = banjo_driver.BanjoDriver(
+                args.browser, url, browser_session, args.observe_phases,
+                args.throughput_sample_interval, args.headless)
+            _run_test_iterations(driver, _create_scheduler(args), writer,
+                                 run_stats, worker_id, trace_recorder)
     elif args.client == names.NDT_HTML5:
-        driver = html5_driver.NdtHtml5SeleniumDriver(args.browser,
-                                                     args.client_url)
-        _run_test_iterations(driver, args.iterations, args.output)
+        driver = html5_driver.NdtHtml5SeleniumDriver(
+            args.browser, args.client_url, browser_session, args.observe_phases,
+            args.throughput_sample_interval, args.headless)
+        _run_test_iterations(driver, _create_scheduler(args), writer, run_stats,
+                             worker_id, trace_recorder)
     else:
         raise ValueError('unsupported NDT client: %s' % args.client)
 
 
+def _create_scheduler(args):
+    """Creates the scheduler for a worker's test iterations.
+
+    If the args specify neither a number of iterations nor a duration, the
+    worker runs a single iteration.
+    """
+    iterations = args.iterations
+    if iterations is None and args.duration is None:
+        iterations = 1
+    return scheduler.Scheduler(iterations=iterations,
+                               duration=args.duration,
+                               tests_per_hour=args.tests_per_hour,
+                               jitter=args.schedule_jitter)
+
+
 def _configure_logging(verbose):
     """Configure the root logger for log output."""
     root_logger = logging.getLogger()
@@ -65,46 +345,79 @@ def _configure_logging(verbose):
         root_logger.setLevel(logging.WARNING)
 
 
-def _run_test_iterations(driver, iterations, output_dir):
-    """Use the given client driver to run the specified number of iterations.
+def _run_test_iterations(driver,
+                         test_scheduler,
+                         writer,
+                         run_stats,
+                         worker_id=None,
+                         trace_recorder=None):
+    """Use the given client driver to run test iterations on a schedule.
 
-    Given an NDT client driver, run NDT tests for the given number of
-    iterations. On completion of each test, save the result to disk and print
-    the result to the console.
+    Given an NDT client driver, run an NDT test each time the scheduler
+    releases one. On completion of each test, hand the result to the writer,
+    which saves it to disk and prints it to the console in the background while
+    the next test runs.
 
     Args:
         driver: An NDT client driver that supports the perform_test API.
-        iterations: The total number of test iterations to run.
-        output_dir: Directory in which to result file.
+        test_scheduler: Scheduler that determines when each test starts.
+        writer: ResultWriter with which to save each result.
+        run_stats: ResultStats to which to add each result.
+        worker_id: Numeric ID of the worker running the iterations, or None if
+            this is the only worker.
+        trace_recorder: TraceRecorder on which to record each iteration and
+            the steps of its test, or None.
     """
-    for i in range(iterations):
-        logger.info('starting iteration %d...', (i + 1))
-        print 'starting iteration %d...' % (i + 1)
-        result = driver.perform_test()
+    for scheduled_test in test_scheduler.schedule():
+        if worker_id is None:
+            iteration_label = 'iteration %d' % (scheduled_test.index + 1)
+        else:
+            iteration_label = 'worker %d iteration %d' % (
+                worker_id, scheduled_test.index + 1)
+        logger.info('starting %s (%.3fs behind schedule)...', iteration_label,
+                    scheduled_test.drift)
+        print 'starting %s...' % iteration_label
+        with trace_events.record(trace_recorder,
+                                 'iteration %d' % (scheduled_test.index + 1),
+                                 'iteration', _TESTS_TRACK):
+            result = driver.perform_test()
+        if trace_recorder:
+            _record_test_steps(trace_recorder, result.spans)
         result.os, result.os_version = os_metadata.get_os_metadata()
-        print _jsonify_result(result)
-        _save_result(result, output_dir)
+        result.scheduled_start_time = scheduled_test.scheduled_time
+        logger.info('%s step durations: %s', iteration_label,
+                    _format_span_durations(result.spans))
+        writer.write(result)
+        run_stats.add(result)
+    test_scheduler.log_drift_summary()
 
 
-def _save_result(result, output_dir):
-    """Saves an NdtResult instance to a file in output_dir.
+def _record_test_steps(trace_recorder, spans):
+    for span in spans:
+        if span.end_time is not None:
+            trace_recorder.add_event(span.name, 'test_step', _TESTS_TRACK,
+                                     span.start_time, span.end_time)
 
-    Serializes an NdtResult to JSON format, automatically generates a
-    filename based on the NdtResult metadata, then saves it to output_dir.
 
-    Args:
-        result: NdtResult instance to save.
-        output_dir: Directory in which to result file.
-    """
-    output_filename = filename.create_result_filename(result)
-    output_path = os.path.join(output_dir, output_filename)
-    with open(output_path, 'w') as output_file:
-        output_file.write(_jsonify_result(result))
+def _format_span_durations(spans):
+    return ', '.join('%s=%.3fs' % (span.name, span.duration) for span in spans
+                     if span.duration is not None)
+
 
+def _check_args(parser, args):
+    """Checks for combinations of flags that cannot run.
 
-def _jsonify_result(result):
-    return result_encoder.NdtResultEncoder(indent=2,
-                                           sort_keys=True).encode(result)
+    Reports an error through the parser, which exits, rather than letting each
+    worker fail on the flags once it starts.
+
+    Args:
+        parser: ArgumentParser that parsed the flags.
+        args: Parsed command-line arguments.
+    """
+    if (args.replay_keep_alive_timeout is not None and
+            args.replay_workers < http_server.KEEP_ALIVE_MIN_WORKERS):
+        parser.error('--replay_keep_alive_timeout requires --replay_workers of '
+                     'at least %d' % http_server.KEEP_ALIVE_MIN_WORKERS)
 
 
 if __name__ == '__main__':
@@ -126,13 +439,102 @@ if __name__ == '__main__':
     parser.add_argument('--client_url',
                         help='URL of NDT client (for server-hosted clients)')
     parser.add_argument('--server', help='FQDN of NDT server to test against')
+    parser.add_argument('--replay_workers',
+                        help=('Number of threads the replay server uses to '
+                              'serve requests concurrently (for replay-based '
+                              'clients). If 0, requests are served serially.'),
+                        type=int,
+                        default=0)
+    parser.add_argument('--replay_keep_alive_timeout',
+                        help=('If set, the replay server keeps HTTP/1.1 '
+                              'connections open until they are idle for this '
+                              'many seconds. Each open connection occupies a '
+                              'replay worker until it goes idle, so this '
+                              'requires --replay_workers of at least %d.' %
+                              http_server.KEEP_ALIVE_MIN_WORKERS),
+                        type=float)
+    parser.add_argument('--map_replay_bodies',
+                        help=('Serve replayed response bodies from a '
+                              'memory-mapped cache file rather than from '
+                              'process memory (for replay-based clients)'),
+                        action='store_true')
     parser.add_argument('--output', help='Directory in which to write output')
+    parser.add_argument('--output_format',
+                        help=('Format in which to save results: a JSON file '
+                              'per result, or results appended to rotating '
+                              'JSON Lines segment files'),
+                        choices=('json', 'jsonl'),
+                        default='json')
+    parser.add_argument('--segment_max_bytes',
+                        help=('Size (in bytes) at which to start a new JSON '
+                              'Lines segment (with --output_format=jsonl)'),
+                        type=int,
+                        default=64 * 1024 * 1024)
+    parser.add_argument('--segment_max_age',
+                        help=('Age (in seconds) at which to start a new JSON '
+                              'Lines segment (with --output_format=jsonl)'),
+                        type=float,
+                        default=3600)
+    parser.add_argument('--trace',
+                        help=('If set, write a timeline of the run to this '
+                              'path as a Chrome trace event file, which can '
+                              'be opened in chrome://tracing or Perfetto'))
     parser.add_argument('-v',
                         '--verbose',
                         action='store_true',
                         help='Use verbose logging')
+    parser.add_argument('--headless',
+                        help=('Run the browser without a GUI (Firefox and '
+                              'Chrome only). Headless Firefox requires '
+                              'Firefox 55 or later and Selenium 3 or later '
+                              'with geckodriver, newer than the Selenium '
+                              'version in requirements.txt'),
+                        action='store_true')
+    parser.add_argument('--reuse_browser',
+                        help=('Run every iteration in the same browser '
+                              'instance, resetting its state between tests, '
+                              'rather than launching a new browser each time'),
+                        action='store_true')
+    parser.add_argument('--observe_phases',
+                        help=('Detect the start and end of each test phase '
+                              'with an observer injected into the page, '
+                              'rather than by polling the page through '
+                              'WebDriver, for more precise timestamps'),
+                        action='store_true')
+    parser.add_argument('--throughput_sample_interval',
+                        help=('If set, sample the live throughput shown by '
+                              'the client at this interval (in seconds) and '
+                              'save the samples with each result'),
+                        type=float)
+    parser.add_argument('--browser_pool_size',
+                        help=('If set, keep this many browsers launched '
+                              'ahead of time in the background, so that each '
+                              'test starts in an already-running browser'),
+                        type=int,
+                        default=0)
     parser.add_argument('--iterations',
-                        help='Number of iterations to run',
+                        help=('Number of iterations to run (per worker). '
+                              'Defaults to 1 unless --duration is set.'),
+                        type=int)
+    parser.add_argument('--duration',
+                        help=('If set, stop starting new tests this many '
+                              'seconds after the run begins'),
+                        type=float)
+    parser.add_argument('--tests_per_hour',
+                        help=('If set, start tests at this rate (per worker), '
+                              'evenly spaced, rather than back-to-back'),
+                        type=float)
+    parser.add_argument('--schedule_jitter',
+                        help=('Fraction of the interval between tests by '
+                              'which to randomly shift each scheduled start '
+                              '(with --tests_per_hour)'),
+                        type=float,
+                        default=0.0)
+    parser.add_argument('--workers',
+                        help=('Number of workers to run in parallel, each in '
+                              'its own process with its own browser'),
                         type=int,
                         default=1)
-    main(parser.parse_args())
+    parsed_args = parser.parse_args()
+    _check_args(parser, parsed_args)
+    main(parsed_args)
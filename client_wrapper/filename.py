@@ -12,6 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import datetime
+import re
+
+import pytz
+
 import canonicalize
 
 
@@ -23,19 +29,51 @@ class FilenameCreationError(Error):
     pass
 
 
+class FilenameParseError(Error):
+    pass
+
+# Components of a result filename created by create_result_filename.
+#
+# Attributes:
+#     os: OS shortname (e.g. 'win10').
+#     browser: Canonical browser name (e.g. 'chrome49').
+#     client: Name of the NDT client (e.g. 'ndt_js').
+#     start_time: Start time of the test as a UTC datetime, truncated to the
+#         second.
+#     worker_id: Numeric ID of the worker that produced the result, or None.
+ResultFilename = collections.namedtuple(
+    'ResultFilename', ['os', 'browser', 'client', 'start_time', 'worker_id'])
+
 _FILENAME_FORMAT = ('{os}-{browser}-{client}-{timestamp}-{type}.{extension}')
+_WORKER_FILENAME_FORMAT = (
+    '{os}-{browser}-{client}-{timestamp}-w{worker_id}-{type}.{extension}')
+_TIME_FORMAT = '%Y-%m-%dT%H%M%SZ'
+# Neither the OS shortname nor the browser name contain hyphens, so the client
+# name is everything between the browser name and the timestamp.
+_RESULT_FILENAME_PATTERN = re.compile(
+    r'^(?P<os>[^-]+)-(?P<browser>[^-]+)-(?P<client>.+)-'
+    r'(?P<timestamp>\d{4}-\d{2}-\d{2}T\d{6}Z)(?:-w(?P<worker_id>\d+))?'
+    r'-results\.json$')
 
 
-def create_result_filename(result):
+def create_result_filename(result, worker_id=None):
     """Create an output filename based on an NdtResult.
 
     Args:
         result: NdtResult instance for which to create an output filename.
+        worker_id: Numeric ID of the worker that produced the result, or None
+            if the result came from a single-worker run. Including the worker ID
+            keeps filenames unique when several workers start tests within the
+            same second.
 
     Returns:
         An output filename representing the result, for example:
 
             win10-chrome49-ndt_js-2016-02-26T155423Z-results.json
+
+        or, with a worker ID:
+
+            win10-chrome49-ndt_js-2016-02-26T155423Z-w3-results.json
     """
     if not result.browser:
         raise NotImplementedError(
@@ -49,13 +87,54 @@ def create_result_filename(result):
             'Could not generate filename for NDT result: %s' % e.message)
     client = result.client
     timestamp = _format_time(result.start_time)
-    return _FILENAME_FORMAT.format(os=os,
-                                   browser=browser,
-                                   client=client,
-                                   timestamp=timestamp,
-                                   type='results',
-                                   extension='json')
+    if worker_id is None:
+        return _FILENAME_FORMAT.format(os=os,
+                                       browser=browser,
+                                       client=client,
+                                       timestamp=timestamp,
+                                       type='results',
+                                       extension='json')
+    return _WORKER_FILENAME_FORMAT.format(os=os,
+                                          browser=browser,
+                                          client=client,
+                                          timestamp=timestamp,
+                                          worker_id=worker_id,
+                                          type='results',
+                                          extension='json')
+
+
+def parse_result_filename(result_filename):
+    """Parses a filename created by create_result_filename into its components.
+
+    Args:
+        result_filename: Base name of a result file, for example:
+
+            win10-chrome49-ndt_js-2016-02-26T155423Z-w3-results.json
+
+    Returns:
+        A ResultFilename with the components of the filename.
+
+    Raises:
+        FilenameParseError: The filename is not in result filename format.
+    """
+    match = _RESULT_FILENAME_PATTERN.match(result_filename)
+    if not match:
+        raise FilenameParseError('Not a result filename: %s' % result_filename)
+    try:
+        start_time = datetime.datetime.strptime(
+            match.group('timestamp'), _TIME_FORMAT).replace(tzinfo=pytz.utc)
+    except ValueError as e:
+        raise FilenameParseError('Invalid timestamp in result filename %s: %s' %
+                                 (result_filename, e))
+    worker_id = match.group('worker_id')
+    if worker_id is not None:
+        worker_id = int(worker_id)
+    return ResultFilename(os=match.group('os'),
+                          browser=match.group('browser'),
+                          client=match.group('client'),
+                          start_time=start_time,
+                          worker_id=worker_id)
 
 
 def _format_time(timestamp):
-    return timestamp.strftime('%Y-%m-%dT%H%M%SZ')
+    return timestamp.strftime(_TIME_FORMAT)
@@ -17,6 +17,7 @@ import datetime
 import logging
 
 import pytz
+from selenium.webdriver.common import by
 
 import browser_client_common
 import names
@@ -33,18 +34,61 @@ ERROR_START_BUTTON_NOT_IN_DOM = '"Start Test" button does not appear in DOM.'
 ERROR_TIMED_OUT_WAITING_FOR_START_BUTTON = (
     'Timed out waiting for "Start Test" button to appear.')
 
+_C2S_START_PHASE = browser_client_common.Phase(
+    'c2s_start', '//*[contains(text(), "your upload speed")]', None)
+_S2C_START_PHASE = browser_client_common.Phase(
+    's2c_start', '//*[contains(text(), "your download speed")]', None)
+_RESULTS_PHASE = browser_client_common.Phase('results', '//*[@id="results"]',
+                                             None)
+_PHASES = (_C2S_START_PHASE, _S2C_START_PHASE, _RESULTS_PHASE)
+
+_METRIC_LOCATORS = {
+    'c2s_throughput': (by.By.ID, 'upload-speed'),
+    'c2s_throughput_units': (by.By.ID, 'upload-speed-units'),
+    's2c_throughput': (by.By.ID, 'download-speed'),
+    's2c_throughput_units': (by.By.ID, 'download-speed-units'),
+    'latency': (by.By.ID, 'latency'),
+}
+# The throughput fields update with live readings while each test runs.
+_THROUGHPUT_LOCATORS = {
+    name: locator
+    for name, locator in _METRIC_LOCATORS.iteritems() if name != 'latency'
+}
+
 
 class NdtHtml5SeleniumDriver(object):
 
-    def __init__(self, browser, url):
+    def __init__(self,
+                 browser,
+                 url,
+                 browser_session=None,
+                 observe_phases=False,
+                 throughput_sample_interval=None,
+                 headless=False):
         """Creates a NDT HTML5 client driver for the given URL and browser.
 
         Args:
             url: The URL of an NDT server to test against.
             browser: Can be one of 'firefox', 'chrome', 'edge', or 'safari'.
+            browser_session: A BrowserSession or BrowserPool from which to
+                take the browser for each test, or None to launch a new
+                browser for each test.
+            observe_phases: If True, detect the start and end of each test
+                phase with a PhaseObserver injected into the page instead of
+                polling the page through WebDriver.
+            throughput_sample_interval: Time between samples of the client's
+                live throughput readout (in seconds), or None to record only
+                the final throughput of each test.
+            headless: If True, run the browser without a GUI. When a
+                browser_session is provided, this must match the session's
+                own setting.
         """
         self._browser = browser
         self._url = url
+        self._browser_session = browser_session
+        self._observe_phases = observe_phases
+        self._throughput_sample_interval = throughput_sample_interval
+        self._headless = headless
 
     def perform_test(self):
         """Performs a full NDT test (both s2c and c2s) with the HTML5 client.
@@ -57,19 +101,34 @@ class NdtHtml5SeleniumDriver(object):
         result.start_time = datetime.datetime.now(pytz.utc)
 
         logger.info('starting NDT HTML5 test')
-        with browser_client_common.create_browser(self._browser) as driver:
+        with browser_client_common.record_browser_spans(
+                result, self._open_browser()) as driver:
             result.browser = self._browser
-            result.browser_version = browser_client_common.get_browser_version(
-                driver)
+            result.browser_headless = self._headless
+            with browser_client_common.record_span(result,
+                                                   'get_browser_version'):
+                result.browser_version = (
+                    browser_client_common.get_browser_version(driver))
 
-            _complete_ui_flow(driver, self._url, result)
+            _complete_ui_flow(driver, self._url, result, self._observe_phases,
+                              self._throughput_sample_interval)
 
         result.end_time = datetime.datetime.now(pytz.utc)
         logger.info('NDT HTML5 test ended')
         return result
 
+    def _open_browser(self):
+        if self._browser_session:
+            return self._browser_session.use_browser()
+        return browser_client_common.create_browser(self._browser,
+                                                    self._headless)
+
 
-def _complete_ui_flow(driver, url, result):
+def _complete_ui_flow(driver,
+                      url,
+                      result,
+                      observe_phases=False,
+                      throughput_sample_interval=None):
     """Performs the UI flow for the NDT HTML5 test and records results.
 
     Args:
@@ -77,47 +136,146 @@ def _complete_ui_flow(driver, url, result):
         url: URL to load to start the UI flow.
         result: NdtResult instance to populate with results from proceeding
             through the UI flow.
+        observe_phases: If True, detect test phases with a PhaseObserver
+            instead of polling through WebDriver.
+        throughput_sample_interval: Time between samples of the live throughput
+            readout (in seconds), or None to skip sampling.
     """
     logger.info('loading URL: %s', url)
-    if not browser_client_common.load_url(driver, url, result.errors):
+    with browser_client_common.record_span(result, 'load_url'):
+        url_loaded = browser_client_common.load_url(driver, url, result.errors)
+    if not url_loaded:
         return
     logger.info('page loaded, starting UI flow')
 
-    _click_websocket_button(driver)
+    with browser_client_common.record_span(result, 'click_websocket_button'):
+        _click_websocket_button(driver)
+    phase_observer = None
+    if observe_phases:
+        # The observer must be in place before the test starts so that it sees
+        # every phase transition.
+        phase_observer = browser_client_common.PhaseObserver(driver, _PHASES)
+        with browser_client_common.record_span(result,
+                                               'install_phase_observer'):
+            installed = phase_observer.install()
+        if not installed:
+            logger.warning('falling back to polling for test phases')
+            phase_observer = None
     # If we can't click the start button, nothing left to do, so bail out.
-    if not _click_start_button(driver, result.errors):
+    with browser_client_common.record_span(result, 'click_start_button'):
+        clicked = _click_start_button(driver, result.errors)
+    if not clicked:
         return
     logger.info('clicked "Start Test" button')
     result.c2s_result = results.NdtSingleTestResult()
     result.s2c_result = results.NdtSingleTestResult()
-
-    if _wait_for_c2s_test_to_start(driver):
-        result.c2s_result.start_time = datetime.datetime.now(pytz.utc)
+    throughput_sampler = None
+    if throughput_sample_interval:
+        throughput_sampler = browser_client_common.TextSampler(
+            driver, _THROUGHPUT_LOCATORS, throughput_sample_interval)
+        if not throughput_sampler.start():
+            throughput_sampler = None
+
+    c2s_start_time = _wait_for_phase(
+        driver, result, phase_observer, _C2S_START_PHASE,
+        _wait_for_c2s_test_to_start,
+        browser_client_common.NDT_TEST_NEGOTIATION_TIMEOUT)
+    if c2s_start_time:
+        result.c2s_result.start_time = c2s_start_time
         logger.info('c2s test started')
     else:
         result.errors.append(results.TestError(
             browser_client_common.ERROR_C2S_NEVER_STARTED))
         logger.error(browser_client_common.ERROR_C2S_NEVER_STARTED)
 
-    if _wait_for_s2c_test_to_start(driver):
-        result.c2s_result.end_time = datetime.datetime.now(pytz.utc)
+    s2c_start_time = _wait_for_phase(
+        driver, result, phase_observer, _S2C_START_PHASE,
+        _wait_for_s2c_test_to_start, browser_client_common.NDT_TEST_RUN_TIMEOUT)
+    if s2c_start_time:
+        result.c2s_result.end_time = s2c_start_time
         logger.info('c2s test finished')
-        result.s2c_result.start_time = datetime.datetime.now(pytz.utc)
+        # A phase observer reports the moment in the page at which s2c began,
+        # which is also when c2s ended. When polling, the s2c start time is
+        # read separately, as it is recorded.
+        if not phase_observer:
+            s2c_start_time = datetime.datetime.now(pytz.utc)
+        result.s2c_result.start_time = s2c_start_time
         logger.info('s2c test started')
     else:
         result.errors.append(results.TestError(
             browser_client_common.ERROR_S2C_NEVER_STARTED))
         logger.error(browser_client_common.ERROR_S2C_NEVER_STARTED)
 
-    if _wait_for_results_page_to_appear(driver):
-        result.s2c_result.end_time = datetime.datetime.now(pytz.utc)
+    s2c_end_time = _wait_for_phase(driver, result, phase_observer,
+                                   _RESULTS_PHASE,
+                                   _wait_for_results_page_to_appear,
+                                   browser_client_common.NDT_TEST_RUN_TIMEOUT)
+    if s2c_end_time:
+        result.s2c_result.end_time = s2c_end_time
         logger.info('s2c test finished')
     else:
         result.errors.append(results.TestError(
             browser_client_common.ERROR_S2C_NEVER_ENDED))
         logger.error(browser_client_common.ERROR_S2C_NEVER_ENDED)
 
-    _populate_metric_values(result, driver)
+    if throughput_sampler:
+        with browser_client_common.record_span(result,
+                                               'collect_throughput_samples'):
+            samples = throughput_sampler.stop()
+        _record_throughput_samples(result, samples)
+    with browser_client_common.record_span(result, 'parse_results_page'):
+        _populate_metric_values(result, driver)
+
+
+def _record_throughput_samples(result, samples):
+    """Populates the throughput series of each test from sampled readouts.
+
+    Args:
+        result: An instance of NdtResult.
+        samples: A list of samples, as returned by TextSampler.stop.
+    """
+    result.c2s_result.throughput_samples = (
+        browser_client_common.create_throughput_series(
+            samples, result.c2s_result,
+            lambda texts: _parse_sampled_throughput(texts, 'c2s')))
+    result.s2c_result.throughput_samples = (
+        browser_client_common.create_throughput_series(
+            samples, result.s2c_result,
+            lambda texts: _parse_sampled_throughput(texts, 's2c')))
+
+
+def _parse_sampled_throughput(texts, direction):
+    # A sampled reading may be blank or mid-update, so we discard any errors
+    # rather than report them in the result.
+    return _parse_throughput([], texts[direction + '_throughput'],
+                             texts[direction + '_throughput_units'],
+                             direction + ' throughput')
+
+
+def _wait_for_phase(driver, result, phase_observer, phase, poll_for_phase,
+                    timeout):
+    """Waits for a test phase to begin.
+
+    Args:
+        driver: An instance of a Selenium webdriver browser class.
+        result: NdtResult instance in which to record the time spent waiting.
+        phase_observer: PhaseObserver installed in the page, or None to poll
+            for the phase through WebDriver.
+        phase: The Phase for which to wait.
+        poll_for_phase: Function that takes a driver, polls for the phase, and
+            returns True if the phase began.
+        timeout: Amount of time (in seconds) to wait for the phase.
+
+    Returns:
+        The time at which the phase began, as a datetime in UTC, or None if the
+        phase did not begin within the timeout.
+    """
+    with browser_client_common.record_span(result, 'wait_for_' + phase.name):
+        if phase_observer:
+            return phase_observer.wait_for_phase(phase, timeout)
+        if poll_for_phase(driver):
+            return datetime.datetime.now(pytz.utc)
+        return None
 
 
 def _click_websocket_button(driver):
@@ -187,21 +345,19 @@ def _populate_metric_values(result, driver):
         result: An instance of NdtResult.
         driver: An instance of a Selenium webdriver browser class.
     """
-    c2s_throughput = driver.find_element_by_id('upload-speed').text
-    c2s_throughput_units = driver.find_element_by_id('upload-speed-units').text
+    metric_texts = browser_client_common.get_element_texts(driver,
+                                                           _METRIC_LOCATORS)
 
     result.c2s_result.throughput = _parse_throughput(
-        result.errors, c2s_throughput, c2s_throughput_units, 'c2s throughput')
-
-    s2c_throughput = driver.find_element_by_id('download-speed').text
+        result.errors, metric_texts['c2s_throughput'],
+        metric_texts['c2s_throughput_units'], 'c2s throughput')
 
-    s2c_throughput_units = driver.find_element_by_id(
-        'download-speed-units').text
     result.s2c_result.throughput = _parse_throughput(
-        result.errors, s2c_throughput, s2c_throughput_units, 's2c throughput')
+        result.errors, metric_texts['s2c_throughput'],
+        metric_texts['s2c_throughput_units'], 's2c throughput')
 
-    result.latency = driver.find_element_by_id('latency').text
-    result.latency = _validate_metric(result.errors, result.latency, 'latency')
+    result.latency = _validate_metric(result.errors, metric_texts['latency'],
+                                      'latency')
 
 
 def _parse_throughput(errors, throughput, throughput_units,
@@ -257,7 +413,7 @@ def _convert_metric_to_float(errors, metric, metric_name):
 
     try:
         float(metric)
-    except ValueError:
+    except (TypeError, ValueError):
         errors.append(results.TestError('illegal value shown for %s: %s' % (
             metric_name, metric)))
         return False
@@ -18,19 +18,49 @@ implementations.
 """
 
 import BaseHTTPServer
+import bisect
 import datetime
 import json
 import logging
+import Queue
 import SimpleHTTPServer
 import threading
+import time
 import urllib
 
 import pytz
 
 import http_response
+import replay_cache
+import trace_events
 
 logger = logging.getLogger(__name__)
 
+# Headers that apply to a single connection and so must not be replayed.
+_HOP_BY_HOP_HEADERS = ('connection', 'keep-alive', 'transfer-encoding')
+
+# Minimum number of worker threads for a server with keep-alive. Each open
+# persistent connection occupies a worker until it goes idle for the keep-alive
+# timeout, and browsers open around six connections per host, so with fewer
+# workers new connections queue behind idle ones and page loads stall.
+KEEP_ALIVE_MIN_WORKERS = 8
+
+# Sentinel placed on a thread pool's request queue to tell a worker to stop.
+_STOP_WORKER = object()
+
+# Path at which a replay server serves its request metrics as JSON.
+METRICS_PATH = '/__metrics'
+
+# Upper bounds (in milliseconds) of the buckets of the request latency
+# histograms. Requests slower than the last bound fall in an overflow bucket.
+_LATENCY_BUCKET_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+# Maximum number of distinct paths for which ReplayMetrics keeps separate
+# statistics. Requests for any further paths are counted under _OTHER_PATHS, so
+# that a client requesting many unique URLs cannot grow the metrics unbounded.
+_MAX_METRICS_PATHS = 1000
+_OTHER_PATHS = '(other)'
+
 
 class Error(Exception):
     pass
@@ -45,9 +75,197 @@ class HttpWaitTimeoutError(Error):
             str(port))
 
 
-def create_replay_server_manager(replays, ndt_server_fqdn):
-    """Creates a replay server wrapped in a server manager."""
-    return HttpServerManager(ReplayHTTPServer(replays, ndt_server_fqdn))
+def create_replay_server_manager(replays,
+                                 ndt_server_fqdn,
+                                 worker_count=0,
+                                 keep_alive_timeout=None,
+                                 trace_recorder=None):
+    """Creates a replay server wrapped in a server manager.
+
+    Args:
+        replays: A dictionary of HttpResponse instances, keyed by relative URL.
+        ndt_server_fqdn: FQDN of target NDT server.
+        worker_count: Number of worker threads with which to serve requests
+            concurrently. If zero, the server handles requests serially on a
+            single thread.
+        keep_alive_timeout: If not None, the server speaks HTTP/1.1 and keeps
+            connections open for reuse until they are idle for this many
+            seconds. Requires a worker_count of at least
+            KEEP_ALIVE_MIN_WORKERS, as each open connection occupies a worker
+            thread.
+        trace_recorder: TraceRecorder on which to record each request the
+            server handles, or None.
+
+    Returns:
+        An HttpServerManager wrapping the new replay server.
+
+    Raises:
+        ValueError: keep_alive_timeout was specified without enough worker
+            threads.
+    """
+    if keep_alive_timeout is not None and worker_count < KEEP_ALIVE_MIN_WORKERS:
+        # Idle persistent connections would hold every worker, so that new
+        # connections couldn't be served until the idle ones time out.
+        raise ValueError('keep-alive requires at least %d workers: %d' %
+                         (KEEP_ALIVE_MIN_WORKERS, worker_count))
+    if worker_count:
+        replay_server = ThreadPoolReplayHTTPServer(
+            replays, ndt_server_fqdn, worker_count, keep_alive_timeout,
+            trace_recorder)
+    else:
+        replay_server = ReplayHTTPServer(replays,
+                                         ndt_server_fqdn,
+                                         trace_recorder=trace_recorder)
+    return HttpServerManager(replay_server)
+
+
+class ReplayMetrics(object):
+    """Counts the requests a replay server handles and how long each took.
+
+    Requests are grouped by path and response status code. For each group,
+    ReplayMetrics keeps a count and a histogram of latencies with fixed
+    buckets, so recording a request costs a few arithmetic operations under a
+    lock. ReplayMetrics is safe to use from multiple threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Dictionary of _RequestStats, keyed by (path, status) tuples.
+        self._request_stats = {}
+        self._paths = set()
+
+    def record(self, path, status, latency):
+        """Records a request the server handled.
+
+        Args:
+            path: Path of the request.
+            status: Status code of the response.
+            latency: Time (in seconds) it took to serve the request.
+        """
+        with self._lock:
+            if path not in self._paths:
+                if len(self._paths) < _MAX_METRICS_PATHS:
+                    self._paths.add(path)
+                else:
+                    path = _OTHER_PATHS
+            key = (path, status)
+            if key not in self._request_stats:
+                self._request_stats[key] = _RequestStats()
+            self._request_stats[key].add(latency * 1000.0)
+
+    def snapshot(self):
+        """Returns the metrics as a JSON-serializable dictionary.
+
+        The dictionary has a 'requests' list with an entry for each path and
+        status code, sorted by path and then status code. Each entry has the
+        request count, the mean and maximum latency in milliseconds, and a
+        histogram of latencies as a list of [upper_bound_ms, count] pairs, where
+        the upper bound of the overflow bucket is None.
+        """
+        with self._lock:
+            return {
+                'requests': [
+                    stats.to_dict(path, status)
+                    for (path, status
+                        ), stats in sorted(self._request_stats.iteritems())
+                ]
+            }
+
+    def format_summary(self):
+        """Formats the metrics as human-readable lines, one per path and status.
+
+        Returns:
+            The formatted metrics, or an empty string if there were no
+            requests.
+        """
+        with self._lock:
+            return '\n'.join(
+                stats.format_line(path, status)
+                for (path, status
+                    ), stats in sorted(self._request_stats.iteritems()))
+
+    def missing_paths(self):
+        """Returns a sorted list of the paths that had no stored response.
+
+        Paths beyond the limit on tracked paths are not listed, as their names
+        are not kept. missing_untracked_count counts their requests instead.
+        """
+        with self._lock:
+            return sorted(path for path, status in self._request_stats
+                          if status == 404 and path != _OTHER_PATHS)
+
+    def missing_untracked_count(self):
+        """Counts requests without a stored response for untracked paths.
+
+        These are the requests for paths beyond the limit on tracked paths,
+        which missing_paths cannot list.
+        """
+        with self._lock:
+            other_stats = self._request_stats.get((_OTHER_PATHS, 404))
+            if other_stats is None:
+                return 0
+            return other_stats.count
+
+
+class _RequestStats(object):
+    """Count and latency histogram of the requests for one path and status."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        # The last bucket counts latencies above every bound.
+        self.bucket_counts = [0] * (len(_LATENCY_BUCKET_BOUNDS) + 1)
+
+    def add(self, latency_ms):
+        self.count += 1
+        self.total_latency_ms += latency_ms
+        self.max_latency_ms = max(self.max_latency_ms, latency_ms)
+        self.bucket_counts[bisect.bisect_left(_LATENCY_BUCKET_BOUNDS,
+                                              latency_ms)] += 1
+
+    def percentile_bound(self, percent):
+        """Returns the upper bound of the bucket containing a percentile.
+
+        Returns:
+            The bound in milliseconds, or None if the percentile falls in the
+            overflow bucket.
+        """
+        rank = self.count * percent / 100.0
+        cumulative_count = 0
+        for bound, bucket_count in zip(_LATENCY_BUCKET_BOUNDS,
+                                       self.bucket_counts):
+            cumulative_count += bucket_count
+            if cumulative_count >= rank:
+                return bound
+        return None
+
+    def to_dict(self, path, status):
+        return {
+            'path': path,
+            'status': status,
+            'count': self.count,
+            'mean_ms': self.total_latency_ms / self.count,
+            'max_ms': self.max_latency_ms,
+            'histogram':
+            [list(bucket)
+             for bucket in zip(_LATENCY_BUCKET_BOUNDS + (None,
+                                                        ), self.bucket_counts)]
+        }
+
+    def format_line(self, path, status):
+        percentiles = ' '.join('p%d%s' % (
+            percent, _format_bound(self.percentile_bound(percent)))
+                               for percent in (50, 95))
+        return '%d %s n=%d mean=%.1fms max=%.1fms %s' % (
+            status, path, self.count, self.total_latency_ms / self.count,
+            self.max_latency_ms, percentiles)
+
+
+def _format_bound(bound):
+    if bound is None:
+        return '>%dms' % _LATENCY_BUCKET_BOUNDS[-1]
+    return '<=%dms' % bound
 
 
 class ReplayHTTPServer(BaseHTTPServer.HTTPServer):
@@ -56,21 +274,47 @@ class ReplayHTTPServer(BaseHTTPServer.HTTPServer):
     Attributes:
         port: Port on which the server is listening for connections.
         replays: A dictionary of HttpResponse instances, keyed by relative URL.
+        serialized_replays: A dictionary of HTTP responses as they are
+            written to the wire, keyed by relative URL. Each response is a
+            two-tuple of its status line and a list of chunks (headers and
+            body) to write in order after the status line and Date header.
+        keep_alive_timeout: Number of seconds an idle persistent connection
+            stays open, or None if the server closes each connection after a
+            single response.
+        trace_recorder: TraceRecorder on which to record each request the
+            server handles, or None.
+        metrics: ReplayMetrics of the requests the server has handled.
     """
 
-    def __init__(self, replays, ndt_server_fqdn):
+    def __init__(self,
+                 replays,
+                 ndt_server_fqdn,
+                 keep_alive_timeout=None,
+                 trace_recorder=None):
         """Creates a new ReplayHTTPServer.
 
         Args:
             replays: A dictionary of HttpResponse instances, keyed by relative
                 URL.
             ndt_server_fqdn: FQDN of target NDT server.
+            keep_alive_timeout: If not None, serve HTTP/1.1 persistent
+                connections that close after this many idle seconds.
+            trace_recorder: TraceRecorder on which to record each request the
+                server handles, or None.
         """
-        BaseHTTPServer.HTTPServer.__init__(self, ('', 0), _ReplayRequestHandler)
+        if keep_alive_timeout is None:
+            handler_class = _ReplayRequestHandler
+        else:
+            handler_class = _KeepAliveReplayRequestHandler
+        BaseHTTPServer.HTTPServer.__init__(self, ('', 0), handler_class)
+        self._keep_alive_timeout = keep_alive_timeout
+        self._trace_recorder = trace_recorder
+        self._metrics = ReplayMetrics()
         self._port = self.server_address[1]
         self._replays = replays
         self._rewrite_mlabns_replays(ndt_server_fqdn)
         self._rewrite_localhost_ips()
+        self._serialized_replays = self._serialize_replays()
 
     @property
     def port(self):
@@ -80,6 +324,22 @@ class ReplayHTTPServer(BaseHTTPServer.HTTPServer):
     def replays(self):
         return self._replays
 
+    @property
+    def serialized_replays(self):
+        return self._serialized_replays
+
+    @property
+    def keep_alive_timeout(self):
+        return self._keep_alive_timeout
+
+    @property
+    def trace_recorder(self):
+        return self._trace_recorder
+
+    @property
+    def metrics(self):
+        return self._metrics
+
     def _rewrite_mlabns_replays(self, ndt_server_fqdn):
         """Rewrites mlab-ns responses to point to a custom NDT server.
 
@@ -109,23 +369,132 @@ class ReplayHTTPServer(BaseHTTPServer.HTTPServer):
     def _rewrite_localhost_ips(self):
         for path, original_response in self._replays.iteritems():
             # Replace all instances of 127.0.0.1 with localhost and the port that
-            # our parent server is listening on.
+            # our parent server is listening on. Memory-mapped bodies without
+            # any instances stay in their mapping rather than being copied.
             rewritten_data = original_response.data.replace(
                 '127.0.0.1', 'localhost:%d' % self._port)
             # Update the Content-Length header since we have changed the
-            # content.
-            headers = original_response.headers
+            # content. Drop any differently-cased copy of the header so that
+            # the client does not see two conflicting lengths.
+            headers = {key: value
+                       for key, value in original_response.headers.iteritems()
+                       if key.lower() != 'content-length'}
             headers['content-length'] = len(rewritten_data)
             self._replays[path] = http_response.HttpResponse(
                 original_response.response_code, headers, rewritten_data)
 
+    def _serialize_replays(self):
+        """Serializes each replay to the bytes the server writes on the wire.
+
+        The replays do not change after the server rewrites them, so we build
+        each response once up front instead of on every request.
+
+        Returns:
+            A dictionary of serialized HTTP responses, keyed by relative URL.
+        """
+        handler_class = self.RequestHandlerClass
+        server_version = '%s %s' % (handler_class.server_version,
+                                    handler_class.sys_version)
+        serialized_replays = {}
+        for path, response in self._replays.iteritems():
+            serialized_replays[path] = _serialize_response(
+                response, handler_class.protocol_version, server_version)
+        return serialized_replays
+
+
+class _ThreadPoolMixIn(object):
+    """Mix-in class to handle each request on a fixed pool of worker threads.
+
+    Similar to SocketServer.ThreadingMixIn, but rather than spawning a new
+    thread for each request, hands accepted requests to a fixed number of
+    long-lived worker threads. The worker threads run until server_close()
+    is called.
+    """
+
+    def start_workers(self, worker_count):
+        """Starts the worker threads that process incoming requests.
+
+        Args:
+            worker_count: Number of worker threads to start.
+        """
+        self._request_queue = Queue.Queue()
+        self._workers = []
+        for _ in range(worker_count):
+            worker = threading.Thread(target=self._process_queued_requests)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def stop_workers(self):
+        """Stops the worker threads once they finish the queued requests."""
+        for _ in self._workers:
+            self._request_queue.put(_STOP_WORKER)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def server_close(self):
+        self.stop_workers()
+        super(_ThreadPoolMixIn, self).server_close()
+
+    def process_request(self, request, client_address):
+        self._request_queue.put((request, client_address))
+
+    def _process_queued_requests(self):
+        while True:
+            queued_request = self._request_queue.get()
+            if queued_request is _STOP_WORKER:
+                return
+            request, client_address = queued_request
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+class ThreadPoolReplayHTTPServer(_ThreadPoolMixIn, ReplayHTTPServer):
+    """Replay server that serves requests concurrently on a thread pool.
+
+    Browsers fetch page resources over several parallel connections, so serving
+    requests concurrently prevents a slow response from stalling the rest of
+    the page load.
+    """
+
+    def __init__(self,
+                 replays,
+                 ndt_server_fqdn,
+                 worker_count,
+                 keep_alive_timeout=None,
+                 trace_recorder=None):
+        """Creates a new ThreadPoolReplayHTTPServer.
+
+        Args:
+            replays: A dictionary of HttpResponse instances, keyed by relative
+                URL.
+            ndt_server_fqdn: FQDN of target NDT server.
+            worker_count: Number of worker threads with which to serve
+                requests.
+            keep_alive_timeout: If not None, serve HTTP/1.1 persistent
+                connections that close after this many idle seconds.
+            trace_recorder: TraceRecorder on which to record each request the
+                server handles, or None.
+        """
+        ReplayHTTPServer.__init__(self, replays, ndt_server_fqdn,
+                                  keep_alive_timeout, trace_recorder)
+        self.start_workers(worker_count)
+
 
 class _ReplayRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
     """Request handler for replaying saved HTTP responses."""
 
     def __init__(self, request, client_address, server):
         self._replays = server.replays
+        self._serialized_replays = server.serialized_replays
         self._server_port = server.port
+        self._trace_recorder = server.trace_recorder
+        self._metrics = server.metrics
         SimpleHTTPServer.SimpleHTTPRequestHandler.__init__(
             self, request, client_address, server)
 
@@ -133,26 +502,78 @@ class _ReplayRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
         """Handle an HTTP GET request.
 
         Serve an HTTP GET request by replaying a stored response. If there is
-        no matching response, serve a 404 and log a message.
+        no matching response, serve a 404 and log a message. Requests for
+        METRICS_PATH are answered with the server's request metrics instead.
+        """
+        if self.path == METRICS_PATH:
+            self._send_metrics()
+            return
+        start_time = time.time()
+        # Requests are handled concurrently on the server's threads, so each
+        # thread gets its own track.
+        with trace_events.record(self._trace_recorder, 'GET ' + self.path,
+                                 'replay', 'replay server (%s)' %
+                                 threading.current_thread().name) as args:
+            args['status'] = self._replay_response()
+        self._metrics.record(self.path, args['status'],
+                             time.time() - start_time)
+
+    def _replay_response(self):
+        """Writes the stored response for the request path.
+
+        Returns:
+            The status code of the response.
         """
         try:
-            response = self._replays[self.path]
+            serialized_response = self._serialized_replays[self.path]
         except KeyError:
             logger.info('No stored result for %s', self.path)
             self.send_error(404, 'File not found')
-            return
-
-        self.send_response(response.response_code)
-        for header, value in response.headers.iteritems():
-            self.send_header(header, value)
+            return 404
+
+        status_line, chunks = serialized_response
+        # The Date header has to be current, so unlike the rest of the
+        # response, it is added as the response is sent. It goes in the same
+        # write as the first chunk so that the headers are not split across
+        # packets.
+        self.connection.sendall('%s\r\nDate: %s\r\n%s' % (
+            status_line, self.date_time_string(), chunks[0]))
+        # Write to the socket directly because wfile would copy buffer chunks
+        # into a new string before sending them.
+        for chunk in chunks[1:]:
+            self.connection.sendall(chunk)
+        return self._replays[self.path].response_code
+
+    def _send_metrics(self):
+        body = json.dumps(self._metrics.snapshot())
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        self.wfile.write(response.data)
+        self.wfile.write(body)
 
     def log_message(self, format, *args):
         # Don't log messages because it creates too much logging noise.
         pass
 
 
+class _KeepAliveReplayRequestHandler(_ReplayRequestHandler):
+    """Request handler that keeps HTTP/1.1 connections open between requests.
+
+    BaseHTTPRequestHandler keeps serving requests on the same connection until
+    the client asks to close it or the connection sits idle for longer than the
+    server's keep-alive timeout.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        # StreamRequestHandler applies this timeout to the connection's socket,
+        # so an idle client times out while waiting for its next request.
+        self.timeout = self.server.keep_alive_timeout
+        _ReplayRequestHandler.setup(self)
+
+
 class HttpServerManager(object):
     """A wrapper for HTTP server instances to support asynchronous running.
 
@@ -196,10 +617,74 @@ class HttpServerManager(object):
         self._http_server_thread.start()
 
     def close(self):
-        """Shut down the child HTTP server."""
+        """Shut down the child HTTP server and log its request metrics.
+
+        Stops the server's threads and closes its listening socket.
+        """
         if self._http_server_thread:
             self._http_server.shutdown()
             self._http_server_thread.join()
+            self._http_server_thread = None
+            self._http_server.server_close()
+            _log_metrics(getattr(self._http_server, 'metrics', None))
+
+
+def _log_metrics(metrics):
+    """Logs the request metrics of a server that has shut down.
+
+    Args:
+        metrics: ReplayMetrics of the server, or None if the server does not
+            keep metrics.
+    """
+    if metrics is None:
+        return
+    summary = metrics.format_summary()
+    if summary:
+        logger.info('replay server requests:\n%s', summary)
+    missing_paths = metrics.missing_paths()
+    if missing_paths:
+        logger.warning('replay server had no stored response for: %s',
+                       ', '.join(missing_paths))
+    missing_untracked_count = metrics.missing_untracked_count()
+    if missing_untracked_count:
+        logger.warning('replay server had no stored response for %d requests '
+                       'to paths beyond the first %d', missing_untracked_count,
+                       _MAX_METRICS_PATHS)
+
+
+def _serialize_response(response, protocol_version, server_version):
+    """Serializes an HttpResponse to a complete HTTP response message.
+
+    Args:
+        response: HttpResponse instance to serialize.
+        protocol_version: HTTP version to report in the status line (e.g.
+            "HTTP/1.0").
+        server_version: Value of the Server header.
+
+    Returns:
+        A two-tuple of the response's status line and a list of chunks that
+        together contain the headers and body of the response. The Date header
+        is left out because it must be added when the response is sent. Bodies
+        in memory are joined to the headers to form a single chunk, while
+        memory-mapped bodies are a separate chunk that refers to the mapping
+        rather than a copy of it.
+    """
+    reason = BaseHTTPServer.BaseHTTPRequestHandler.responses.get(
+        response.response_code, ('',))[0]
+    status_line = '%s %d %s' % (protocol_version, response.response_code,
+                                reason)
+    lines = ['Server: %s' % server_version]
+    for header, value in response.headers.iteritems():
+        # Connection management headers describe the connection to the
+        # original server, not to us, so we leave them out of the replay.
+        if header.lower() in _HOP_BY_HOP_HEADERS:
+            continue
+        lines.append('%s: %s' % (header, value))
+    lines.extend(['', ''])
+    head = '\r\n'.join(lines)
+    if isinstance(response.data, replay_cache.MappedBody):
+        return status_line, [head, response.data.as_buffer()]
+    return status_line, [head + response.data]
 
 
 def _wait_for_local_http_response(port):
@@ -211,7 +696,9 @@ def _wait_for_local_http_response(port):
     while (datetime.datetime.now(tz=pytz.utc) - start_time
           ).total_seconds() < max_wait_seconds:
         try:
-            urllib.urlopen('http://localhost:%d/' % port)
+            # Replay servers don't count requests for their metrics, so the
+            # check doesn't show up as a request for a missing replay.
+            urllib.urlopen('http://localhost:%d%s' % (port, METRICS_PATH))
             return
         except IOError:
             pass
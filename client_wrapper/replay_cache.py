@@ -0,0 +1,327 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Caches parsed HTTP replay files in a compiled binary format.
+
+Parsing a large YAML replay file takes several seconds, so the first time we
+load a replay file, we save a compiled copy of its contents next to it. Later
+loads read the compiled copy instead, as long as the YAML file has not changed
+since we compiled it.
+
+The compiled file consists of a fixed-size header that identifies the YAML file
+it was compiled from (by modification time, size, and SHA-1 digest), followed
+by an index of the replays serialized with the marshal module, followed by the
+raw response bodies. Because the bodies are stored contiguously and
+uncompressed, callers can memory-map them rather than read them into memory,
+which lets several replay servers on the same host share a single copy of each
+body through the OS page cache.
+"""
+
+import hashlib
+import logging
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+
+import http_response
+
+logger = logging.getLogger(__name__)
+
+# Suffix appended to a replay file's path to create its cache file's path.
+CACHE_SUFFIX = '.replaycache'
+
+_MAGIC = 'NDTRPLAY'
+# Bump this whenever the layout of the cache file changes.
+_FORMAT_VERSION = 2
+# Magic, format version, marshal version, YAML mtime, YAML size, YAML SHA-1,
+# size of the index.
+_HEADER = struct.Struct('<8sIIdQ20sQ')
+
+
+class MappedBody(object):
+    """An HTTP response body that lives in a memory-mapped cache file.
+
+    Supports the subset of the string interface that the replay server uses, so
+    that it can be used in place of a string as the data of an HttpResponse.
+    The body is only copied into process memory if a caller needs a modified
+    copy of it.
+    """
+
+    def __init__(self, mapping, offset, length):
+        """Creates a new MappedBody.
+
+        Args:
+            mapping: An mmap instance of the cache file.
+            offset: Offset of the body within the mapping.
+            length: Length of the body (in bytes).
+        """
+        self._mapping = mapping
+        self._offset = offset
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __str__(self):
+        return self._mapping[self._offset:self._offset + self._length]
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def find(self, sub):
+        index = self._mapping.find(sub, self._offset,
+                                   self._offset + self._length)
+        if index == -1:
+            return -1
+        return index - self._offset
+
+    def replace(self, old, new):
+        """Returns the body with all occurrences of old replaced by new.
+
+        Returns the MappedBody itself if old does not occur in the body, so
+        that unmodified bodies stay in the mapping.
+        """
+        if self.find(old) == -1:
+            return self
+        return str(self).replace(old, new)
+
+    def as_buffer(self):
+        """Returns a read-only buffer over the body that does not copy it."""
+        return buffer(self._mapping, self._offset, self._length)
+
+
+def load_replays(replay_path, map_bodies=False):
+    """Loads the HTTP replays from a YAML replay file.
+
+    Loads the replays from the replay file's compiled cache if the cache is
+    current. Otherwise, parses the YAML file and refreshes the cache.
+
+    Args:
+        replay_path: Path to a YAML replay file.
+        map_bodies: If True, the data of each replay is a MappedBody backed by
+            the cache file instead of an in-memory string.
+
+    Returns:
+        A dictionary of HttpResponse instances, keyed by relative URL.
+    """
+    cache_path = replay_path + CACHE_SUFFIX
+    replay_stat = os.stat(replay_path)
+    replays = _read_cache_if_fresh(cache_path, replay_path, replay_stat,
+                                   map_bodies)
+    if replays is not None:
+        logger.info('loaded replays from cache file %s', cache_path)
+        return replays
+
+    with open(replay_path, 'rb') as replay_file:
+        replay_contents = replay_file.read()
+    replays = http_response.parse_yaml(replay_contents)
+    _write_cache(cache_path, replays, replay_stat,
+                 hashlib.sha1(replay_contents).digest())
+    if map_bodies:
+        mapped_replays = _read_cache_if_fresh(cache_path, replay_path,
+                                              replay_stat, map_bodies)
+        if mapped_replays is not None:
+            return mapped_replays
+        logger.warning('could not map replay bodies, keeping them in memory')
+    return replays
+
+
+def _read_cache_if_fresh(cache_path, replay_path, replay_stat, map_bodies):
+    """Reads the replays from a cache file if it matches its YAML file.
+
+    The cache is fresh if it was compiled from a YAML file with the same
+    modification time and size as the current one. If those differ (e.g.
+    because the file was copied or touched), the cache is still fresh if the
+    YAML contents have the same SHA-1 digest, in which case the cache's header
+    is updated with the new modification time and size so that later loads
+    can skip hashing the YAML file.
+
+    Args:
+        cache_path: Path to the cache file.
+        replay_path: Path to the YAML replay file.
+        replay_stat: Result of os.stat() on the YAML replay file.
+        map_bodies: If True, memory-map the response bodies instead of reading
+            them into memory.
+
+    Returns:
+        A dictionary of HttpResponse instances, keyed by relative URL, or None
+        if the cache file is missing, stale, or unreadable.
+    """
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            header = _HEADER.unpack(cache_file.read(_HEADER.size))
+            (magic, format_version, marshal_version, mtime, size, digest,
+             index_size) = header
+            if ((magic, format_version, marshal_version) !=
+                (_MAGIC, _FORMAT_VERSION, marshal.version)):
+                return None
+            if (mtime, size) != (replay_stat.st_mtime, replay_stat.st_size):
+                with open(replay_path, 'rb') as replay_file:
+                    if hashlib.sha1(replay_file.read()).digest() != digest:
+                        return None
+                _update_cache_header(cache_path, replay_stat, digest,
+                                     index_size)
+            index = marshal.loads(cache_file.read(index_size))
+            bodies_offset = _HEADER.size + index_size
+            if map_bodies:
+                # The mapping remains valid after we close the file.
+                mapping = mmap.mmap(cache_file.fileno(),
+                                    0,
+                                    access=mmap.ACCESS_READ)
+                return _deserialize_mapped_replays(index, mapping,
+                                                   bodies_offset)
+            return _deserialize_replays(index, cache_file.read())
+    except (EnvironmentError, EOFError, ValueError, TypeError, struct.error):
+        return None
+
+
+def _write_cache(cache_path, replays, replay_stat, digest):
+    """Writes replays to a cache file.
+
+    Writes to a temporary file first and then moves it into place, so that
+    concurrent readers never see a partially written cache.
+
+    Args:
+        cache_path: Path to the cache file.
+        replays: A dictionary of HttpResponse instances, keyed by relative URL.
+        replay_stat: Result of os.stat() on the YAML replay file.
+        digest: SHA-1 digest of the YAML replay file's contents.
+    """
+    if not _is_cacheable(replays):
+        return
+    index, bodies = _serialize_replays(replays)
+    index_data = marshal.dumps(index)
+    header = _HEADER.pack(_MAGIC, _FORMAT_VERSION, marshal.version,
+                          replay_stat.st_mtime, replay_stat.st_size, digest,
+                          len(index_data))
+    try:
+        temp_file = tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(os.path.abspath(cache_path)),
+            delete=False)
+    except (IOError, OSError) as e:
+        logger.warning('failed to write replay cache file %s: %s', cache_path,
+                       e)
+        return
+    replaced = False
+    try:
+        with temp_file:
+            temp_file.write(header)
+            temp_file.write(index_data)
+            for body in bodies:
+                temp_file.write(body)
+        _replace_file(temp_file.name, cache_path)
+        replaced = True
+    except (IOError, OSError) as e:
+        logger.warning('failed to write replay cache file %s: %s', cache_path,
+                       e)
+    finally:
+        # Don't leave a partially written cache behind next to the YAML file.
+        if not replaced:
+            _remove_file_if_exists(temp_file.name)
+
+
+def _update_cache_header(cache_path, replay_stat, digest, index_size):
+    """Updates the YAML modification time and size in a cache's header.
+
+    The header has a fixed size, so it is rewritten in place.
+
+    Args:
+        cache_path: Path to the cache file.
+        replay_stat: Result of os.stat() on the YAML replay file.
+        digest: SHA-1 digest of the YAML replay file's contents.
+        index_size: Size of the cache's index (in bytes).
+    """
+    header = _HEADER.pack(_MAGIC, _FORMAT_VERSION, marshal.version,
+                          replay_stat.st_mtime, replay_stat.st_size, digest,
+                          index_size)
+    try:
+        with open(cache_path, 'r+b') as cache_file:
+            cache_file.write(header)
+    except (IOError, OSError) as e:
+        logger.warning('failed to update replay cache header %s: %s',
+                       cache_path, e)
+
+
+def _remove_file_if_exists(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _is_cacheable(replays):
+    if not isinstance(replays, dict):
+        return False
+    return all(isinstance(response, http_response.HttpResponse)
+               for response in replays.itervalues())
+
+
+def _serialize_replays(replays):
+    """Serializes replays into an index and a list of response bodies.
+
+    Args:
+        replays: A dictionary of HttpResponse instances, keyed by relative URL.
+
+    Returns:
+        A two-tuple of the index and a list of bodies. Each index entry is a
+        tuple of (path, response code, headers, body offset, body length,
+        whether body is unicode), where the offset is relative to the start of
+        the first body.
+    """
+    index = []
+    bodies = []
+    offset = 0
+    for path, response in replays.iteritems():
+        is_unicode = isinstance(response.data, unicode)
+        if is_unicode:
+            body = response.data.encode('utf-8')
+        else:
+            body = response.data
+        index.append((path, response.response_code, response.headers, offset,
+                      len(body), is_unicode))
+        bodies.append(body)
+        offset += len(body)
+    return index, bodies
+
+
+def _deserialize_replays(index, bodies):
+    replays = {}
+    for path, response_code, headers, offset, length, is_unicode in index:
+        data = bodies[offset:offset + length]
+        if is_unicode:
+            data = data.decode('utf-8')
+        replays[path] = http_response.HttpResponse(response_code, headers, data)
+    return replays
+
+
+def _deserialize_mapped_replays(index, mapping, bodies_offset):
+    replays = {}
+    for path, response_code, headers, offset, length, _ in index:
+        data = MappedBody(mapping, bodies_offset + offset, length)
+        replays[path] = http_response.HttpResponse(response_code, headers, data)
+    return replays
+
+
+def _replace_file(source_path, destination_path):
+    """Moves a file to a destination path, replacing any existing file."""
+    try:
+        os.rename(source_path, destination_path)
+    except OSError:
+        # On Windows, os.rename fails if the destination exists.
+        os.remove(destination_path)
+        os.rename(source_path, destination_path)
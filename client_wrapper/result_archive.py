@@ -0,0 +1,380 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Archives NDT results in an indexed SQLite database.
+
+Ingesting an output directory loads each result's metadata and metrics into a
+single table, indexed on the fields that queries commonly filter by, so that
+finding and summarizing results no longer means decoding every result file.
+The archive remembers which result files and how much of each JSON Lines
+segment it has already ingested, so ingesting the same directory again only
+reads what is new.
+
+Usage:
+
+    python result_archive.py --archive results.db --ingest output_dir
+    python result_archive.py --archive results.db --summarize client,browser
+"""
+
+import argparse
+import calendar
+import collections
+import contextlib
+import datetime
+import logging
+import os
+import sqlite3
+
+import pytz
+
+import canonicalize
+import result_decoder
+import result_reader
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    start_time REAL,
+    end_time REAL,
+    client TEXT,
+    client_version TEXT,
+    os TEXT,
+    os_version TEXT,
+    os_shortname TEXT,
+    browser TEXT,
+    browser_version TEXT,
+    browser_canonical_name TEXT,
+    c2s_throughput REAL,
+    s2c_throughput REAL,
+    latency REAL,
+    error_count INTEGER,
+    has_errors INTEGER
+);
+CREATE INDEX IF NOT EXISTS results_client ON results (client);
+CREATE INDEX IF NOT EXISTS results_os ON results (os_shortname);
+CREATE INDEX IF NOT EXISTS results_browser ON results (browser_canonical_name);
+CREATE INDEX IF NOT EXISTS results_start_time ON results (start_time);
+CREATE INDEX IF NOT EXISTS results_has_errors ON results (has_errors);
+CREATE TABLE IF NOT EXISTS ingested_files (
+    directory TEXT,
+    filename TEXT,
+    PRIMARY KEY (directory, filename)
+);
+CREATE TABLE IF NOT EXISTS ingested_segments (
+    directory TEXT,
+    filename TEXT,
+    bytes_read INTEGER,
+    PRIMARY KEY (directory, filename)
+);
+"""
+
+# Columns of the results table, in insertion order.
+_RESULT_COLUMNS = ('start_time', 'end_time', 'client', 'client_version', 'os',
+                   'os_version', 'os_shortname', 'browser', 'browser_version',
+                   'browser_canonical_name', 'c2s_throughput', 's2c_throughput',
+                   'latency', 'error_count', 'has_errors')
+
+# Columns by which queries can filter and group results.
+_FILTER_COLUMNS = ('client', 'client_version', 'os', 'os_version',
+                   'os_shortname', 'browser', 'browser_version',
+                   'browser_canonical_name', 'has_errors')
+
+# Summary of the archived results in a group.
+#
+# Attributes:
+#     group: Dictionary of the values that the group's results share for each
+#         column that the summary was grouped by.
+#     count: Number of results in the group.
+#     error_count: Number of results in the group that had errors.
+#     mean_c2s_throughput: Mean c2s throughput of the group's results (in
+#         Mbps), or None if no result had a c2s throughput.
+#     mean_s2c_throughput: Mean s2c throughput of the group's results (in
+#         Mbps), or None if no result had an s2c throughput.
+#     mean_latency: Mean latency of the group's results (in milliseconds), or
+#         None if no result had a latency.
+#     first_start_time: Start time of the group's earliest result.
+#     last_start_time: Start time of the group's latest result.
+ResultSummary = collections.namedtuple(
+    'ResultSummary', ['group', 'count', 'error_count', 'mean_c2s_throughput',
+                      'mean_s2c_throughput', 'mean_latency', 'first_start_time',
+                      'last_start_time'])
+
+
+class ResultArchive(object):
+    """An SQLite database of NDT result metadata and metrics.
+
+    After creating a ResultArchive, the owner of the instance is responsible
+    for calling close().
+    """
+
+    def __init__(self, archive_path):
+        """Opens an archive, creating it if it does not exist.
+
+        Args:
+            archive_path: Path to the archive's SQLite database file.
+        """
+        self._connection = sqlite3.connect(archive_path)
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def ingest(self, results_dir):
+        """Adds the results in an output directory that are not yet archived.
+
+        Reads every result file that the archive has not already ingested and
+        every line appended to each JSON Lines segment since the last ingest.
+        Files that cannot be read or decoded are logged and skipped, and are
+        retried on the next ingest. The ingest is a single transaction, so an
+        interrupted ingest leaves the archive unchanged.
+
+        Args:
+            results_dir: Directory of result files or segment files, as
+                written by ResultWriter or JsonLinesResultWriter.
+
+        Returns:
+            The number of results added to the archive.
+        """
+        # Separate output directories can hold files with the same names, so
+        # ingested files are tracked by directory as well as by name.
+        results_dir = os.path.abspath(results_dir)
+        with self._connection:
+            ingested_count = self._ingest_result_files(results_dir)
+            ingested_count += self._ingest_segments(results_dir)
+        logger.info('ingested %d new results from %s', ingested_count,
+                    results_dir)
+        return ingested_count
+
+    def count(self, since=None, until=None, **kwargs):
+        """Counts the archived results that match all the given criteria.
+
+        Args:
+            since: If set, only count results whose start time is at or after
+                this datetime.
+            until: If set, only count results whose start time is before this
+                datetime.
+            kwargs: Values that counted results must have for the archive's
+                filter columns, e.g. browser_canonical_name='chrome49'.
+
+        Returns:
+            The number of matching results.
+        """
+        where_clause, parameters = _create_where_clause(since, until, kwargs)
+        return self._connection.execute(
+            'SELECT COUNT(*) FROM results' + where_clause,
+            parameters).fetchone()[0]
+
+    def summarize(self, group_by=(), since=None, until=None, **kwargs):
+        """Summarizes the archived results that match all the given criteria.
+
+        Args:
+            group_by: Filter columns by which to group the results, e.g.
+                ('client', 'browser_canonical_name'), or an empty sequence to
+                summarize all matching results as a single group.
+            since: If set, only summarize results whose start time is at or
+                after this datetime.
+            until: If set, only summarize results whose start time is before
+                this datetime.
+            kwargs: Values that summarized results must have for the
+                archive's filter columns, e.g. os_shortname='win10'.
+
+        Returns:
+            A list of ResultSummary instances, one per group, ordered by the
+            group_by columns. The list is empty if no results match.
+        """
+        for column in group_by:
+            _check_filter_column(column)
+        where_clause, parameters = _create_where_clause(since, until, kwargs)
+        query = ('SELECT %s COUNT(*), SUM(has_errors), AVG(c2s_throughput), '
+                 'AVG(s2c_throughput), AVG(latency), MIN(start_time), '
+                 'MAX(start_time) FROM results%s' %
+                 (''.join(column + ', ' for column in group_by), where_clause))
+        if group_by:
+            group_columns = ', '.join(group_by)
+            query += ' GROUP BY %s ORDER BY %s' % (group_columns, group_columns)
+        summaries = []
+        for row in self._connection.execute(query, parameters):
+            group_values = row[:len(group_by)]
+            (count, error_count, mean_c2s_throughput, mean_s2c_throughput,
+             mean_latency, first_start_time,
+             last_start_time) = row[len(group_by):]
+            if not count:
+                continue
+            summaries.append(ResultSummary(
+                group=dict(zip(group_by, group_values)),
+                count=count,
+                error_count=error_count,
+                mean_c2s_throughput=mean_c2s_throughput,
+                mean_s2c_throughput=mean_s2c_throughput,
+                mean_latency=mean_latency,
+                first_start_time=_from_timestamp(first_start_time),
+                last_start_time=_from_timestamp(last_start_time)))
+        return summaries
+
+    def _ingest_result_files(self, results_dir):
+        ingested_filenames = set(
+            row[0]
+            for row in self._connection.execute(
+                'SELECT filename FROM ingested_files WHERE directory = ?', (
+                    results_dir,)))
+        decoder = result_decoder.NdtResultDecoder()
+        ingested_count = 0
+        for result_filename in sorted(os.listdir(results_dir)):
+            # Other JSON files, such as traces, may share the directory.
+            if (not result_reader.is_result_filename(result_filename) or
+                    result_filename in ingested_filenames):
+                continue
+            result_path = os.path.join(results_dir, result_filename)
+            try:
+                with open(result_path) as result_file:
+                    result = decoder.decode(result_file.read())
+            except (IOError, ValueError, KeyError, TypeError) as e:
+                logger.warning('skipping unreadable result file %s: %s',
+                               result_path, e)
+                continue
+            self._insert_result(result)
+            self._connection.execute(
+                'INSERT INTO ingested_files (directory, filename) VALUES (?, ?)',
+                (results_dir, result_filename))
+            ingested_count += 1
+        return ingested_count
+
+    def _ingest_segments(self, results_dir):
+        offsets = dict(self._connection.execute(
+            'SELECT filename, bytes_read FROM ingested_segments '
+            'WHERE directory = ?', (results_dir,)))
+        tailer = result_reader.SegmentTailer(results_dir, offsets)
+        ingested_count = 0
+        for result in tailer.read_new_results():
+            self._insert_result(result)
+            ingested_count += 1
+        self._connection.executemany(
+            'INSERT OR REPLACE INTO ingested_segments '
+            '(directory, filename, bytes_read) VALUES (?, ?, ?)',
+            [(results_dir, segment_filename, bytes_read)
+             for segment_filename, bytes_read in tailer.offsets.iteritems()])
+        return ingested_count
+
+    def _insert_result(self, result):
+        self._connection.execute(
+            'INSERT INTO results (%s) VALUES (%s)' %
+            (', '.join(_RESULT_COLUMNS), ', '.join('?' * len(_RESULT_COLUMNS))),
+            _get_column_values(result))
+
+
+def _get_column_values(result):
+    """Gets the values of an NdtResult for each column in _RESULT_COLUMNS."""
+    try:
+        os_shortname = canonicalize.os_to_shortname(result.os,
+                                                    result.os_version)
+    except canonicalize.Error:
+        os_shortname = None
+    try:
+        browser_canonical_name = canonicalize.browser_to_canonical_name(
+            result.browser, result.browser_version)
+    except canonicalize.Error:
+        browser_canonical_name = None
+    return (_to_timestamp(result.start_time), _to_timestamp(result.end_time),
+            result.client, result.client_version, result.os, result.os_version,
+            os_shortname, result.browser, result.browser_version,
+            browser_canonical_name, result.c2s_result.throughput,
+            result.s2c_result.throughput, result.latency, len(result.errors),
+            int(bool(result.errors)))
+
+
+def _create_where_clause(since, until, filters):
+    """Creates an SQL WHERE clause that matches the given criteria.
+
+    Returns:
+        A (clause, parameters) tuple, where clause is an empty string if there
+        are no criteria.
+    """
+    conditions = []
+    parameters = []
+    for column, value in sorted(filters.iteritems()):
+        _check_filter_column(column)
+        conditions.append('%s = ?' % column)
+        parameters.append(value)
+    if since is not None:
+        conditions.append('start_time >= ?')
+        parameters.append(_to_timestamp(since))
+    if until is not None:
+        conditions.append('start_time < ?')
+        parameters.append(_to_timestamp(until))
+    if not conditions:
+        return '', parameters
+    return ' WHERE ' + ' AND '.join(conditions), parameters
+
+
+def _check_filter_column(column):
+    # Column names are interpolated into queries, so they must come from the
+    # fixed list rather than from the caller.
+    if column not in _FILTER_COLUMNS:
+        raise ValueError('Unknown filter column: %s' % column)
+
+
+def _to_timestamp(time):
+    if time is None:
+        return None
+    return calendar.timegm(time.utctimetuple()) + time.microsecond / 1e6
+
+
+def _from_timestamp(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, pytz.utc)
+
+
+def main(args):
+    logging.basicConfig(level=logging.INFO)
+    with contextlib.closing(ResultArchive(args.archive)) as archive:
+        if args.ingest:
+            archive.ingest(args.ingest)
+        if args.summarize is not None:
+            group_by = [column for column in args.summarize.split(',')
+                        if column]
+            for summary in archive.summarize(group_by):
+                print('%s: %d results (%d with errors), mean c2s %s Mbps, '
+                      'mean s2c %s Mbps, mean latency %s ms' %
+                      (', '.join('%s=%s' % (column, summary.group[column])
+                                 for column in group_by) or 'all',
+                       summary.count, summary.error_count,
+                       _format_mean(summary.mean_c2s_throughput),
+                       _format_mean(summary.mean_s2c_throughput),
+                       _format_mean(summary.mean_latency)))
+
+
+def _format_mean(mean):
+    if mean is None:
+        return 'n/a'
+    return '%.2f' % mean
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='NDT E2E Result Archive',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--archive',
+                        help='Path to the SQLite archive file',
+                        required=True)
+    parser.add_argument('--ingest',
+                        help=('Output directory from which to add new results '
+                              'to the archive'))
+    parser.add_argument('--summarize',
+                        help=('Print a summary of the archived results, '
+                              'grouped by this comma-separated list of '
+                              'columns (e.g. client,browser_canonical_name), '
+                              'or by nothing if empty'))
+    main(parser.parse_args())
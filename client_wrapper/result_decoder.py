@@ -12,12 +12,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
 import json
+import re
 
 import dateutil.parser
+import pytz
 
 import results
 
+# Matches the fixed time format that NdtResultEncoder writes, e.g.
+# 2016-02-26T15:51:23.452234Z.
+_ENCODED_TIME_PATTERN = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})\.(\d{6})Z$')
+
 
 class NdtResultDecoder(json.JSONDecoder):
     """Decodes a JSON string into an NdtResult instance.
@@ -27,16 +35,13 @@ class NdtResultDecoder(json.JSONDecoder):
     defined fields have legal values).
     """
 
-    def __init__(self):
-        json.JSONDecoder.__init__(self, object_hook=_dict_to_object)
-
+    def decode(self, s):
+        """Decodes a JSON string into an NdtResult instance.
 
-def _dict_to_object(d):
-    """Converts dictionary items in an NdtResult JSON string into objects."""
-    # Check if this is a TestError dict.
-    if ('timestamp' in d) and ('message' in d):
-        return _decode_error(d)
-    return _decode_ndt_result(d)
+        Nested objects are decoded according to the field of the result in
+        which they appear, rather than by guessing their type from their keys.
+        """
+        return _decode_ndt_result(json.JSONDecoder.decode(self, s))
 
 
 def _decode_error(error):
@@ -44,6 +49,12 @@ def _decode_error(error):
     return results.TestError(error['message'], _decode_time(error['timestamp']))
 
 
+def _decode_span(span):
+    """Decodes a dictionary into a Span instance."""
+    return results.Span(span['name'], _decode_time(span['start_time']),
+                        _decode_time(span['end_time']))
+
+
 def _decode_ndt_result(result):
     """Decodes a dictionary into an NdtResult instance."""
     return results.NdtResult(
@@ -55,21 +66,62 @@ def _decode_ndt_result(result):
         os_version=result['os_version'],
         browser=result['browser'],
         browser_version=result['browser_version'],
+        browser_headless=result.get('browser_headless'),
+        scheduled_start_time=_decode_time(result.get('scheduled_start_time')),
         c2s_result=results.NdtSingleTestResult(
             throughput=result['c2s_throughput'],
             start_time=_decode_time(result['c2s_start_time']),
-            end_time=_decode_time(result['c2s_end_time'])),
+            end_time=_decode_time(result['c2s_end_time']),
+            throughput_samples=_decode_throughput_series(result.get(
+                'c2s_throughput_samples'))),
         s2c_result=results.NdtSingleTestResult(
             throughput=result['s2c_throughput'],
             start_time=_decode_time(result['s2c_start_time']),
-            end_time=_decode_time(result['s2c_end_time'])),
+            end_time=_decode_time(result['s2c_end_time']),
+            throughput_samples=_decode_throughput_series(result.get(
+                's2c_throughput_samples'))),
         latency=result['latency'],
-        errors=result['errors'])
+        errors=[_decode_error(error) for error in result['errors']],
+        spans=_decode_spans(result.get('spans')))
+
+
+def _decode_spans(spans):
+    """Decodes a list of span dictionaries into a list of Span instances.
+
+    Args:
+        spans: A list of span dictionaries, or None.
+
+    Returns:
+        A list of Span instances, or None if spans was None (i.e. the result
+        was recorded without timing its steps).
+    """
+    if spans is None:
+        return None
+    return [_decode_span(span) for span in spans]
+
+
+def _decode_throughput_series(samples):
+    """Decodes a list of [offset, throughput] pairs into a ThroughputSeries.
+
+    Args:
+        samples: A list of [offset, throughput] pairs, or None.
+
+    Returns:
+        A ThroughputSeries, or None if samples was None (i.e. the result was
+        recorded without sampling throughput).
+    """
+    if samples is None:
+        return None
+    return results.ThroughputSeries(samples)
 
 
 def _decode_time(time):
     """Decodes a time string
 
+    Times in the format that NdtResultEncoder writes are parsed directly, as
+    dateutil's general-purpose parser is several times slower and dominates
+    decoding time. Any other ISO-8601 time falls back to dateutil.
+
     Args:
         time: A time in ISO-8601 string format.
 
@@ -79,6 +131,15 @@ def _decode_time(time):
     """
     if not time:
         return None
+    match = _ENCODED_TIME_PATTERN.match(time)
+    if match:
+        try:
+            return datetime.datetime(* [int(field) for field in match.groups()],
+                                     tzinfo=pytz.utc)
+        except ValueError:
+            # The time has the right layout but an out of range field, so let
+            # dateutil decide how to handle it.
+            pass
     # We need to use dateutil to parse because datetime.strptime can't parse
     # time zones.
     return dateutil.parser.parse(time)
@@ -14,9 +14,13 @@
 
 import datetime
 import json
+import math
+import operator
 
 import results
 
+_encode_string = json.encoder.encode_basestring_ascii
+
 
 class NdtResultEncoder(json.JSONEncoder):
     """Encodes an NdtResult instance into JSON.
@@ -37,11 +41,38 @@ class NdtResultEncoder(json.JSONEncoder):
             return _encode_ndt_result(obj)
         elif isinstance(obj, results.TestError):
             return _encode_error(obj)
+        elif isinstance(obj, results.Span):
+            return _encode_span(obj)
         elif isinstance(obj, datetime.datetime):
             return _encode_time(obj)
         return json.JSONEncoder.default(self, obj)
 
 
+def encode_compact(result):
+    """Encodes an NdtResult into a single line of compact JSON.
+
+    Produces exactly the same output as encoding the result with
+    NdtResultEncoder(sort_keys=True, separators=(',', ':')), but writes the
+    fields directly from a precompiled field list rather than building an
+    intermediate dictionary and dispatching every datetime and TestError
+    through JSONEncoder.default. Use this when encoding many results, such as
+    when converting a large result archive.
+
+    Args:
+        result: NdtResult instance to encode.
+
+    Returns:
+        The encoded result as a str.
+    """
+    fields = []
+    for key, get_value, encode_value, omit_if_none in _COMPACT_FIELDS:
+        value = get_value(result)
+        if value is None and omit_if_none:
+            continue
+        fields.append(key + encode_value(value))
+    return '{' + ','.join(fields) + '}'
+
+
 def _encode_ndt_result(result):
     result_dict = {
         'start_time': result.start_time,
@@ -58,6 +89,11 @@ def _encode_ndt_result(result):
         result_dict['c2s_start_time'] = result.c2s_result.start_time
         result_dict['c2s_end_time'] = result.c2s_result.end_time
         result_dict['c2s_throughput'] = result.c2s_result.throughput
+        # Omit the samples entirely when throughput was not sampled, so that
+        # results from runs without sampling keep their original format.
+        if result.c2s_result.throughput_samples is not None:
+            result_dict['c2s_throughput_samples'] = _encode_throughput_series(
+                result.c2s_result.throughput_samples)
     else:
         result_dict['c2s_start_time'] = None
         result_dict['c2s_end_time'] = None
@@ -69,6 +105,11 @@ def _encode_ndt_result(result):
         result_dict['s2c_start_time'] = result.s2c_result.start_time
         result_dict['s2c_end_time'] = result.s2c_result.end_time
         result_dict['s2c_throughput'] = result.s2c_result.throughput
+        # Omit the samples entirely when throughput was not sampled, so that
+        # results from runs without sampling keep their original format.
+        if result.s2c_result.throughput_samples is not None:
+            result_dict['s2c_throughput_samples'] = _encode_throughput_series(
+                result.s2c_result.throughput_samples)
     else:
         result_dict['s2c_start_time'] = None
         result_dict['s2c_end_time'] = None
@@ -76,13 +117,156 @@ def _encode_ndt_result(result):
     result_dict['latency'] = result.latency
     result_dict['browser'] = result.browser
     result_dict['browser_version'] = result.browser_version
+    if result.browser_headless is not None:
+        result_dict['browser_headless'] = result.browser_headless
+    if result.scheduled_start_time is not None:
+        result_dict['scheduled_start_time'] = result.scheduled_start_time
+    if result.spans:
+        result_dict['spans'] = result.spans
 
     return result_dict
 
 
+def _encode_throughput_series(series):
+    return [[offset, throughput] for offset, throughput in series]
+
+
 def _encode_error(error):
     return {'timestamp': error.timestamp, 'message': error.message}
 
 
+def _encode_span(span):
+    return {
+        'name': span.name,
+        'start_time': span.start_time,
+        'end_time': span.end_time
+    }
+
+
 def _encode_time(time):
     return datetime.datetime.strftime(time, '%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _encode_compact_value(value):
+    """Encodes a scalar value the same way that JSONEncoder does."""
+    if value is None:
+        return 'null'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if isinstance(value, basestring):
+        return _encode_string(value)
+    if isinstance(value, float) and not (math.isnan(value) or
+                                         math.isinf(value)):
+        return repr(value)
+    if isinstance(value, (int, long)):
+        return str(value)
+    # Leave anything unusual, such as NaN, to the standard encoder.
+    return json.dumps(value)
+
+
+def _encode_compact_time(time):
+    if time is None:
+        return 'null'
+    return '"%04d-%02d-%02dT%02d:%02d:%02d.%06dZ"' % (
+        time.year, time.month, time.day, time.hour, time.minute, time.second,
+        time.microsecond)
+
+
+def _encode_compact_errors(errors):
+    return '[' + ','.join('{"message":%s,"timestamp":%s}' %
+                          (_encode_compact_value(error.message),
+                           _encode_compact_time(error.timestamp))
+                          for error in errors) + ']'
+
+
+def _encode_compact_spans(spans):
+    return '[' + ','.join('{"end_time":%s,"name":%s,"start_time":%s}' % (
+        _encode_compact_time(span.end_time), _encode_compact_value(span.name),
+        _encode_compact_time(span.start_time)) for span in spans) + ']'
+
+
+def _encode_compact_series(series):
+    return '[' + ','.join('[%s,%s]' % (_encode_compact_value(offset),
+                                       _encode_compact_value(throughput))
+                          for offset, throughput in series) + ']'
+
+
+def _get_c2s_field(name):
+    return lambda r: getattr(r.c2s_result, name) if r.c2s_result else None
+
+
+def _get_s2c_field(name):
+    return lambda r: getattr(r.s2c_result, name) if r.s2c_result else None
+
+
+def _compact_field(key, get_value, encode_value, omit_if_none=False):
+    """Creates an entry for the encode_compact field list.
+
+    Args:
+        key: Name of the field in the encoded result.
+        get_value: Function that gets the field's value from an NdtResult.
+        encode_value: Function that encodes the field's value.
+        omit_if_none: Whether to omit the field when its value is None.
+
+    Returns:
+        A tuple of the field's encoded key (followed by a colon), get_value,
+        encode_value, and omit_if_none.
+    """
+    return _encode_string(key) + ':', get_value, encode_value, omit_if_none
+
+# Fields of an encoded NdtResult, in sorted key order.
+_COMPACT_FIELDS = (
+    _compact_field('browser', operator.attrgetter('browser'),
+                   _encode_compact_value),
+    _compact_field('browser_headless',
+                   operator.attrgetter('browser_headless'),
+                   _encode_compact_value,
+                   omit_if_none=True),
+    _compact_field('browser_version', operator.attrgetter('browser_version'),
+                   _encode_compact_value),
+    _compact_field('c2s_end_time', _get_c2s_field('end_time'),
+                   _encode_compact_time),
+    _compact_field('c2s_start_time', _get_c2s_field('start_time'),
+                   _encode_compact_time),
+    _compact_field('c2s_throughput', _get_c2s_field('throughput'),
+                   _encode_compact_value),
+    _compact_field('c2s_throughput_samples',
+                   _get_c2s_field('throughput_samples'),
+                   _encode_compact_series,
+                   omit_if_none=True),
+    _compact_field('client', operator.attrgetter('client'),
+                   _encode_compact_value),
+    _compact_field('client_version', operator.attrgetter('client_version'),
+                   _encode_compact_value),
+    _compact_field('end_time', operator.attrgetter('end_time'),
+                   _encode_compact_time),
+    _compact_field('errors', operator.attrgetter('errors'),
+                   _encode_compact_errors),
+    _compact_field('latency', operator.attrgetter('latency'),
+                   _encode_compact_value),
+    _compact_field('os', operator.attrgetter('os'), _encode_compact_value),
+    _compact_field('os_version', operator.attrgetter('os_version'),
+                   _encode_compact_value),
+    _compact_field('s2c_end_time', _get_s2c_field('end_time'),
+                   _encode_compact_time),
+    _compact_field('s2c_start_time', _get_s2c_field('start_time'),
+                   _encode_compact_time),
+    _compact_field('s2c_throughput', _get_s2c_field('throughput'),
+                   _encode_compact_value),
+    _compact_field('s2c_throughput_samples',
+                   _get_s2c_field('throughput_samples'),
+                   _encode_compact_series,
+                   omit_if_none=True),
+    _compact_field('scheduled_start_time',
+                   operator.attrgetter('scheduled_start_time'),
+                   _encode_compact_time,
+                   omit_if_none=True),
+    # Like the standard encoder, omit the spans when there are none.
+    _compact_field('spans',
+                   lambda r: r.spans or None,
+                   _encode_compact_spans,
+                   omit_if_none=True),
+    _compact_field('start_time', operator.attrgetter('start_time'),
+                   _encode_compact_time),)
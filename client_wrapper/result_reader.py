@@ -0,0 +1,362 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Reads saved NDT results back as a stream of NdtResult instances.
+
+Results are decoded one at a time as the caller iterates, so reading a large
+output directory never holds more than a few results in memory. When reading
+a directory, files whose names do not match a FilenameFilter are skipped
+without being opened, and file reads can be spread across a pool of threads
+so that decoding one result overlaps with reading the next.
+
+SegmentTailer follows the JSON Lines segments that JsonLinesResultWriter
+appends to, returning only the results added since it last checked.
+"""
+
+import itertools
+import logging
+import os
+import Queue
+import threading
+
+import filename
+import result_decoder
+import result_writer
+
+logger = logging.getLogger(__name__)
+
+# Sentinel that a reader thread places on the queue when it has no more files
+# to read.
+_DONE = object()
+
+
+class FilenameFilter(object):
+    """Selects result files by the components of their filenames."""
+
+    def __init__(self,
+                 os_name=None,
+                 browser=None,
+                 client=None,
+                 since=None,
+                 until=None):
+        """Creates a new FilenameFilter.
+
+        The os_name and browser filters match a filename component either
+        exactly or when the component is the filter value followed by a
+        version, so browser='chrome' matches 'chrome49' as well as 'chrome'.
+
+        Args:
+            os_name: OS shortname to select (e.g. 'win10' or 'ubuntu'), or None
+                to select any OS.
+            browser: Browser name to select (e.g. 'chrome49' or 'chrome'), or
+                None to select any browser.
+            client: Name of the NDT client to select, or None to select any
+                client.
+            since: If set, only select results that started at or after this
+                datetime.
+            until: If set, only select results that started before this
+                datetime.
+        """
+        self._os_name = os_name
+        self._browser = browser
+        self._client = client
+        self._since = since
+        self._until = until
+
+    def matches(self, result_filename):
+        """Indicates whether a parsed ResultFilename passes the filter."""
+        if not _component_matches(result_filename.os, self._os_name):
+            return False
+        if not _component_matches(result_filename.browser, self._browser):
+            return False
+        if self._client is not None and result_filename.client != self._client:
+            return False
+        if self._since is not None and result_filename.start_time < self._since:
+            return False
+        if self._until is not None and result_filename.start_time >= self._until:
+            return False
+        return True
+
+# Filter that selects every file whose name is in result filename format.
+_ANY_RESULT_FILTER = FilenameFilter()
+
+
+class SegmentTailer(object):
+    """Incrementally reads results as they are appended to segment files.
+
+    The tailer remembers how far it has read into each JSON Lines segment in a
+    directory, so each call to read_new_results() returns only the results
+    appended since the previous call. A line is only consumed once its
+    trailing newline is written, so a result that a writer is still in the
+    middle of appending is returned by a later call rather than skipped.
+    """
+
+    def __init__(self, segments_dir, offsets=None):
+        """Creates a new SegmentTailer.
+
+        Args:
+            segments_dir: Directory containing segment files, as written by
+                JsonLinesResultWriter.
+            offsets: Dictionary of the offset (in bytes) at which to resume
+                reading each segment, keyed by segment filename, as returned
+                by the offsets property of an earlier tailer. Segments that
+                are not in the dictionary are read from the beginning.
+        """
+        self._segments_dir = segments_dir
+        self._decoder = result_decoder.NdtResultDecoder()
+        # Offset (in bytes) of the first unread line of each segment.
+        self._offsets = dict(offsets or {})
+
+    @property
+    def offsets(self):
+        """Dictionary of how far the tailer has read into each segment."""
+        return dict(self._offsets)
+
+    def read_new_results(self):
+        """Reads the results appended to segments since the last call.
+
+        Lines that cannot be decoded are logged and skipped.
+
+        Yields:
+            An NdtResult for each complete line appended since the last call,
+            in segment filename order.
+        """
+        for segment_filename in sorted(os.listdir(self._segments_dir)):
+            if not segment_filename.endswith(result_writer.SEGMENT_EXTENSION):
+                continue
+            for result in self._read_segment(segment_filename):
+                yield result
+
+    def _read_segment(self, segment_filename):
+        segment_path = os.path.join(self._segments_dir, segment_filename)
+        offset = self._offsets.get(segment_filename, 0)
+        try:
+            segment_file = open(segment_path)
+        except IOError as e:
+            logger.warning('failed to open segment %s: %s', segment_path, e)
+            return
+        with segment_file:
+            segment_file.seek(offset)
+            while True:
+                line = segment_file.readline()
+                if not line.endswith('\n'):
+                    # Either the end of the segment or a partially written line.
+                    break
+                offset += len(line)
+                self._offsets[segment_filename] = offset
+                if not line.strip():
+                    continue
+                try:
+                    yield self._decoder.decode(line)
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.warning('skipping undecodable result in %s: %s',
+                                   segment_path, e)
+
+
+def read_results(path, filename_filter=None, threads=1):
+    """Reads the results in an output directory or a JSON Lines file.
+
+    For an output directory, reads both the result files and the JSON Lines
+    segments in the directory.
+
+    Args:
+        path: Path to an output directory, as written by ResultWriter or
+            JsonLinesResultWriter, or to a file with one encoded result per
+            line.
+        filename_filter: FilenameFilter that selects which result files to
+            read from a directory, or None to read every result file. Ignored
+            for JSON Lines files and segments.
+        threads: Number of threads with which to read result files from a
+            directory.
+
+    Returns:
+        An iterator of NdtResult instances.
+    """
+    if os.path.isdir(path):
+        return itertools.chain(
+            read_directory(path, filename_filter, threads),
+            SegmentTailer(path).read_new_results())
+    return read_json_lines(path)
+
+
+def read_directory(results_dir, filename_filter=None, threads=1):
+    """Reads the result files in an output directory.
+
+    Files that cannot be read or decoded are logged and skipped. With a
+    filename filter, files whose names are not in result filename format are
+    skipped as well.
+
+    Args:
+        results_dir: Directory containing result files, as written by
+            ResultWriter.
+        filename_filter: FilenameFilter that selects which files to read, or
+            None to read every .json file in the directory.
+        threads: Number of threads with which to read files. With more than
+            one thread, results are yielded in the order that their files
+            finish reading rather than in filename order.
+
+    Returns:
+        An iterator of NdtResult instances, one for each selected result file.
+
+    Raises:
+        ValueError: threads is less than one.
+    """
+    if threads < 1:
+        raise ValueError('Thread count must be at least one: %s' % threads)
+    paths = [os.path.join(results_dir, result_filename)
+             for result_filename in sorted(os.listdir(results_dir))
+             if _is_selected(result_filename, filename_filter)]
+    if threads == 1:
+        file_contents = (_read_file(path) for path in paths)
+    else:
+        file_contents = _read_files_in_parallel(paths, threads)
+    return _decode_files(file_contents)
+
+
+def is_result_filename(result_filename):
+    """Indicates whether a filename is in the format of a result file.
+
+    Args:
+        result_filename: Name of a file in an output directory.
+
+    Returns:
+        True if the name is in the format of filename.create_result_filename.
+    """
+    return _is_selected(result_filename, _ANY_RESULT_FILTER)
+
+
+def read_json_lines(results_path):
+    """Reads a file with one encoded result per line.
+
+    Blank lines are ignored, and lines that cannot be decoded are logged and
+    skipped.
+
+    Args:
+        results_path: Path to the JSON Lines file.
+
+    Yields:
+        An NdtResult for each line of the file.
+    """
+    decoder = result_decoder.NdtResultDecoder()
+    with open(results_path) as results_file:
+        for line_number, line in enumerate(results_file, 1):
+            if not line.strip():
+                continue
+            try:
+                yield decoder.decode(line)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning('skipping undecodable result on line %d of %s: '
+                               '%s', line_number, results_path, e)
+
+
+def _decode_files(file_contents):
+    """Decodes the contents of result files.
+
+    Args:
+        file_contents: Iterable of (path, contents) tuples, as returned by
+            _read_file.
+
+    Yields:
+        An NdtResult for each file that was read and decoded successfully.
+    """
+    decoder = result_decoder.NdtResultDecoder()
+    for path, contents in file_contents:
+        if contents is None:
+            continue
+        try:
+            yield decoder.decode(contents)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning('skipping undecodable result file %s: %s', path, e)
+
+
+def _component_matches(component, value):
+    if value is None or component == value:
+        return True
+    # Allow the filter value to omit the version that follows the name.
+    return component.startswith(value) and component[len(value):][:1].isdigit()
+
+
+def _is_selected(result_filename, filename_filter):
+    if not result_filename.endswith('.json'):
+        return False
+    if filename_filter is None:
+        return True
+    try:
+        parsed_filename = filename.parse_result_filename(result_filename)
+    except filename.FilenameParseError:
+        return False
+    return filename_filter.matches(parsed_filename)
+
+
+def _read_file(path):
+    """Reads the contents of a file.
+
+    Returns:
+        A (path, contents) tuple, where contents is None if the file could not
+        be read.
+    """
+    try:
+        with open(path) as result_file:
+            return path, result_file.read()
+    except IOError as e:
+        logger.warning('skipping unreadable result file %s: %s', path, e)
+        return path, None
+
+
+def _read_files_in_parallel(paths, threads):
+    """Reads files on a pool of threads.
+
+    At most a few files per thread are held in memory at once: the threads
+    block until the caller consumes the files they have already read.
+
+    Args:
+        paths: List of paths of files to read.
+        threads: Number of threads with which to read files.
+
+    Yields:
+        A (path, contents) tuple for each file, as returned by _read_file.
+    """
+    path_queue = Queue.Queue()
+    for path in paths:
+        path_queue.put(path)
+    contents_queue = Queue.Queue(maxsize=threads * 2)
+    stopped = threading.Event()
+
+    def read_queued_files():
+        while not stopped.is_set():
+            try:
+                path = path_queue.get_nowait()
+            except Queue.Empty:
+                break
+            contents_queue.put(_read_file(path))
+        contents_queue.put(_DONE)
+
+    for _ in range(threads):
+        reader_thread = threading.Thread(target=read_queued_files)
+        reader_thread.daemon = True
+        reader_thread.start()
+    running_threads = threads
+    try:
+        while running_threads:
+            item = contents_queue.get()
+            if item is _DONE:
+                running_threads -= 1
+            else:
+                yield item
+    finally:
+        # If the caller stopped iterating early, unblock the reader threads so
+        # that they can exit.
+        stopped.set()
+        while running_threads:
+            if contents_queue.get() is _DONE:
+                running_threads -= 1
@@ -0,0 +1,214 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Computes summary statistics over the results of NDT test runs.
+
+Statistics are computed in a single pass without keeping every value: each
+metric keeps a running mean and variance and a t-digest for percentiles. The
+statistics for separate sets of results, such as those of each worker in a
+run, can be merged into statistics for all of the results.
+
+Usage:
+
+    python result_stats.py output_dir [output_dir ...]
+"""
+
+import argparse
+import collections
+import math
+
+import result_reader
+import tdigest
+
+# Percentiles included in summaries.
+SUMMARY_PERCENTILES = (5, 50, 95, 99)
+
+# Metrics that ResultStats computes statistics for. Each has a name, the unit
+# of its values, and a function that gets the metric's value from an
+# NdtResult (or None if the result has no value for the metric).
+_METRICS = (
+    ('c2s_throughput', 'Mbps', lambda r: r.c2s_result.throughput),
+    ('s2c_throughput', 'Mbps', lambda r: r.s2c_result.throughput),
+    ('latency', 'ms', lambda r: r.latency),
+    ('c2s_duration', 's',
+     lambda r: _get_duration(r.c2s_result.start_time, r.c2s_result.end_time)),
+    ('s2c_duration', 's',
+     lambda r: _get_duration(r.s2c_result.start_time, r.s2c_result.end_time)),
+    ('total_duration', 's', lambda r: _get_duration(r.start_time, r.end_time)),)
+
+# The client, browser and OS of a group of results.
+ResultGroup = collections.namedtuple('ResultGroup', ['client', 'browser', 'os'])
+
+
+class MetricStats(object):
+    """Running statistics for the values of a single metric."""
+
+    def __init__(self, compression=100):
+        """Creates an empty MetricStats.
+
+        Args:
+            compression: Compression of the t-digest that estimates
+                percentiles.
+        """
+        self._count = 0
+        self._mean = 0.0
+        # Sum of squared differences from the mean.
+        self._squared_deviations = 0.0
+        self._digest = tdigest.TDigest(compression)
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def mean(self):
+        """Mean of the values, or None if there are no values."""
+        if not self._count:
+            return None
+        return self._mean
+
+    @property
+    def stddev(self):
+        """Population standard deviation of the values, or None if empty."""
+        if not self._count:
+            return None
+        return math.sqrt(self._squared_deviations / self._count)
+
+    def add(self, value):
+        """Adds a value, updating the statistics with Welford's method."""
+        self._count += 1
+        delta = value - self._mean
+        self._mean += delta / self._count
+        self._squared_deviations += delta * (value - self._mean)
+        self._digest.add(value)
+
+    def merge(self, other):
+        """Adds all of the values summarized by another MetricStats."""
+        if not other._count:
+            return
+        count = self._count + other._count
+        delta = other._mean - self._mean
+        self._squared_deviations += (other._squared_deviations + delta * delta *
+                                     self._count * other._count / count)
+        self._mean += delta * other._count / count
+        self._count = count
+        self._digest.merge(other._digest)
+
+    def percentile(self, percent):
+        """Estimates a percentile (between 0 and 100) of the values.
+
+        Returns:
+            The estimated percentile, or None if there are no values.
+        """
+        return self._digest.percentile(percent)
+
+
+class ResultStats(object):
+    """Statistics of NDT result metrics, grouped by client, browser and OS."""
+
+    def __init__(self):
+        # Dictionary of metric name to MetricStats for each ResultGroup.
+        self._groups = {}
+        self._result_counts = collections.Counter()
+
+    def add(self, result):
+        """Adds an NdtResult's metrics to the statistics for its group."""
+        group = ResultGroup(client=result.client,
+                            browser=result.browser,
+                            os=result.os)
+        group_stats = self._get_group_stats(group)
+        self._result_counts[group] += 1
+        for name, _, get_value in _METRICS:
+            value = get_value(result)
+            if value is not None:
+                group_stats[name].add(value)
+
+    def merge(self, other):
+        """Adds all of the results summarized by another ResultStats."""
+        for group, other_group_stats in other._groups.iteritems():
+            group_stats = self._get_group_stats(group)
+            self._result_counts[group] += other._result_counts[group]
+            for name, metric_stats in other_group_stats.iteritems():
+                group_stats[name].merge(metric_stats)
+
+    def groups(self):
+        """Returns a sorted list of the ResultGroups with statistics."""
+        return sorted(self._groups)
+
+    def get(self, group, metric):
+        """Returns the MetricStats of a metric for a ResultGroup."""
+        return self._groups[group][metric]
+
+    def format_summary(self):
+        """Formats the statistics as a human-readable table.
+
+        Returns:
+            A string with a section for each group, and a line in each section
+            for each metric that has values.
+        """
+        lines = []
+        for group in self.groups():
+            lines.append('client=%s browser=%s os=%s (%d results)' %
+                         (group.client, group.browser, group.os,
+                          self._result_counts[group]))
+            for name, unit, _ in _METRICS:
+                metric_stats = self.get(group, name)
+                if metric_stats.count:
+                    label = '%s (%s)' % (name, unit)
+                    lines.append('  ' + _format_metric_stats(label,
+                                                             metric_stats))
+        return '\n'.join(lines)
+
+    def _get_group_stats(self, group):
+        if group not in self._groups:
+            self._groups[group] = {name: MetricStats()
+                                   for name, _, _ in _METRICS}
+        return self._groups[group]
+
+
+def _format_metric_stats(label, metric_stats):
+    percentiles = ' '.join('p%d=%.3f' % (percent,
+                                         metric_stats.percentile(percent))
+                           for percent in SUMMARY_PERCENTILES)
+    return '%-22s n=%-5d mean=%.3f stddev=%.3f %s' % (
+        label, metric_stats.count, metric_stats.mean, metric_stats.stddev,
+        percentiles)
+
+
+def _get_duration(start_time, end_time):
+    if start_time is None or end_time is None:
+        return None
+    return (end_time - start_time).total_seconds()
+
+
+def main(args):
+    stats = ResultStats()
+    for path in args.paths:
+        for result in result_reader.read_results(path, threads=args.threads):
+            stats.add(result)
+    print stats.format_summary()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='NDT E2E Result Statistics',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('paths',
+                        help=('Output directories or JSON Lines files of '
+                              'results to summarize'),
+                        nargs='+')
+    parser.add_argument('--threads',
+                        help='Number of threads with which to read files',
+                        type=int,
+                        default=4)
+    main(parser.parse_args())
@@ -0,0 +1,263 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Stores collections of NDT results in columns for fast aggregate queries.
+
+Analyzing many results as a list of NdtResult objects means walking a graph
+of several objects per result for every query. A ResultStore instead keeps
+one flat array per field. Numeric fields and timestamps are arrays of doubles
+(with timestamps in seconds since the epoch), and missing values are NaN.
+String fields such as the browser name are small integer codes into a table
+of the distinct values. Queries then scan only the columns they need.
+
+This is a columnar layout only: queries are not vectorized. Without NumPy,
+each scan is still a Python loop over the rows of a column, and it is faster
+than querying NdtResult objects because each row is one flat array lookup
+rather than several attribute lookups across objects.
+"""
+
+import array
+import calendar
+import itertools
+import math
+
+import result_reader
+
+# Columns of doubles, each with a function that extracts the column's value
+# from an NdtResult.
+_NUMERIC_COLUMNS = (
+    ('start_time', lambda r: _to_timestamp(r.start_time)),
+    ('end_time', lambda r: _to_timestamp(r.end_time)),
+    ('c2s_start_time', lambda r: _to_timestamp(r.c2s_result.start_time)),
+    ('c2s_end_time', lambda r: _to_timestamp(r.c2s_result.end_time)),
+    ('c2s_throughput', lambda r: _to_float(r.c2s_result.throughput)),
+    ('s2c_start_time', lambda r: _to_timestamp(r.s2c_result.start_time)),
+    ('s2c_end_time', lambda r: _to_timestamp(r.s2c_result.end_time)),
+    ('s2c_throughput', lambda r: _to_float(r.s2c_result.throughput)),
+    ('latency', lambda r: _to_float(r.latency)),
+    ('error_count', lambda r: float(len(r.errors))),)
+
+_CATEGORICAL_COLUMNS = ('os', 'os_version', 'client', 'client_version',
+                        'browser', 'browser_version')
+
+_NAN = float('nan')
+
+
+class ResultStore(object):
+    """A columnar collection of NDT results.
+
+    Each result occupies one row. Query methods that take a rows argument
+    accept an array of row indices, as returned by select(), to restrict the
+    query to those rows.
+    """
+
+    def __init__(self):
+        self._numeric_columns = {name: array.array('d')
+                                 for name, _ in _NUMERIC_COLUMNS}
+        self._code_columns = {name: array.array('i')
+                              for name in _CATEGORICAL_COLUMNS}
+        # For each categorical column, the list of distinct values (indexed by
+        # code) and a dictionary mapping each value back to its code.
+        self._categories = {name: [] for name in _CATEGORICAL_COLUMNS}
+        self._category_codes = {name: {} for name in _CATEGORICAL_COLUMNS}
+        self._row_count = 0
+
+    @classmethod
+    def from_results(cls, results):
+        """Creates a ResultStore from an iterable of NdtResult instances."""
+        store = cls()
+        for result in results:
+            store.add(result)
+        return store
+
+    @classmethod
+    def from_directory(cls, results_dir):
+        """Creates a ResultStore from the JSON result files in a directory.
+
+        Files that are not valid JSON results are logged and skipped.
+
+        Args:
+            results_dir: Directory containing result files, as written by
+                ResultWriter.
+
+        Returns:
+            A ResultStore with one row per valid result file.
+        """
+        return cls.from_results(result_reader.read_directory(results_dir))
+
+    def add(self, result):
+        """Appends an NdtResult to the store as a new row."""
+        for name, get_value in _NUMERIC_COLUMNS:
+            self._numeric_columns[name].append(get_value(result))
+        for name in _CATEGORICAL_COLUMNS:
+            self._code_columns[name].append(self._get_code(name, getattr(result,
+                                                                         name)))
+        self._row_count += 1
+
+    def __len__(self):
+        return self._row_count
+
+    def column(self, name):
+        """Returns the array of values for a numeric column.
+
+        Args:
+            name: Name of a numeric column, such as 's2c_throughput' or
+                'start_time'.
+
+        Returns:
+            The store's array of doubles for the column, with NaN in place of
+            missing values. Callers must not modify the array.
+        """
+        return self._numeric_columns[name]
+
+    def categories(self, name):
+        """Returns the distinct values of a categorical column."""
+        return list(self._categories[name])
+
+    def select(self, since=None, until=None, **kwargs):
+        """Selects the rows that match all the given criteria.
+
+        Args:
+            since: If set, only select results whose start time is at or after
+                this datetime.
+            until: If set, only select results whose start time is before this
+                datetime.
+            kwargs: Values that selected rows must have for categorical
+                columns, e.g. browser='firefox'.
+
+        Returns:
+            An array of the indices of the selected rows, in row order.
+        """
+        rows = xrange(self._row_count)
+        for name, value in kwargs.iteritems():
+            if name not in self._code_columns:
+                raise ValueError('Unknown categorical column: %s' % name)
+            code = self._category_codes[name].get(value)
+            if code is None:
+                return array.array('l')
+            codes = self._code_columns[name]
+            rows = [row for row in rows if codes[row] == code]
+        start_times = self._numeric_columns['start_time']
+        if since is not None:
+            since_timestamp = _to_timestamp(since)
+            rows = [row for row in rows if start_times[row] >= since_timestamp]
+        if until is not None:
+            until_timestamp = _to_timestamp(until)
+            rows = [row for row in rows if start_times[row] < until_timestamp]
+        return array.array('l', rows)
+
+    def values(self, name, rows=None):
+        """Returns the non-missing values of a numeric column.
+
+        Args:
+            name: Name of a numeric column.
+            rows: Array of row indices to restrict the values to, or None for
+                all rows.
+
+        Returns:
+            A list of the column's values in row order, excluding missing
+            values.
+        """
+        column = self._numeric_columns[name]
+        if rows is None:
+            selected = column
+        else:
+            selected = (column[row] for row in rows)
+        # NaN is the only value that is not equal to itself.
+        return [value for value in selected if value == value]
+
+    def percentiles(self, name, percents, rows=None):
+        """Computes percentiles of a numeric column.
+
+        Interpolates linearly between the two nearest values when a percentile
+        falls between them.
+
+        Args:
+            name: Name of a numeric column.
+            percents: List of percentiles to compute, each between 0 and 100.
+            rows: Array of row indices to restrict the query to, or None for
+                all rows.
+
+        Returns:
+            A list of the requested percentiles, in the same order as
+            percents, or a list of None if the column has no values in the
+            given rows.
+        """
+        values = sorted(self.values(name, rows))
+        return [_percentile(values, percent) for percent in percents]
+
+    def percentile(self, name, percent, rows=None):
+        """Computes a single percentile of a numeric column.
+
+        See percentiles() for details.
+        """
+        return self.percentiles(name, [percent], rows)[0]
+
+    def count_by(self, name, rows=None):
+        """Counts the rows with each value of a categorical column.
+
+        Args:
+            name: Name of a categorical column.
+            rows: Array of row indices to restrict the counts to, or None for
+                all rows.
+
+        Returns:
+            A dictionary of the number of rows with each value.
+        """
+        codes = self._code_columns[name]
+        if rows is None:
+            selected = codes
+        else:
+            selected = (codes[row] for row in rows)
+        counts = [0] * len(self._categories[name])
+        for code in selected:
+            counts[code] += 1
+        return {
+            value: count
+            for value, count in itertools.izip(self._categories[name], counts)
+            if count
+        }
+
+    def _get_code(self, name, value):
+        codes = self._category_codes[name]
+        code = codes.get(value)
+        if code is None:
+            code = len(self._categories[name])
+            self._categories[name].append(value)
+            codes[value] = code
+        return code
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    if not 0 <= percent <= 100:
+        raise ValueError('Percentile must be between 0 and 100: %s' % percent)
+    position = (len(sorted_values) - 1) * (percent / 100.0)
+    lower_index = int(math.floor(position))
+    upper_index = int(math.ceil(position))
+    lower = sorted_values[lower_index]
+    upper = sorted_values[upper_index]
+    return lower + (upper - lower) * (position - lower_index)
+
+
+def _to_timestamp(time):
+    if time is None:
+        return _NAN
+    return calendar.timegm(time.utctimetuple()) + time.microsecond / 1e6
+
+
+def _to_float(value):
+    if value is None:
+        return _NAN
+    return float(value)
@@ -0,0 +1,332 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Saves NDT results to disk in the background.
+
+Encoding and syncing a result to disk on the test thread delays the start of
+the next test, so the ResultWriter hands results to a background thread that
+encodes and saves them while the next test runs.
+
+ResultWriter saves each result to its own file. Long-running workers can
+instead use JsonLinesResultWriter, which appends results as single lines to a
+series of segment files so that the output directory does not fill up with
+many small files.
+"""
+
+import datetime
+import logging
+import os
+import Queue
+import threading
+import time
+
+import pytz
+
+import filename
+import result_encoder
+import trace_events
+
+logger = logging.getLogger(__name__)
+
+# Sentinel placed on the queue to tell the writer thread to stop.
+_STOP = object()
+
+# Extension of JSON Lines segment files.
+SEGMENT_EXTENSION = '.jsonl'
+
+
+class ResultWriter(object):
+    """Saves NdtResult instances to an output directory on a background thread.
+
+    Each result is saved as a JSON file in the output directory, named
+    according to filename.create_result_filename. Results queued in quick
+    succession are saved together as a batch: every file in the batch is
+    written before any of them is synced, though each file still needs its own
+    fsync call. A result that fails to save is logged and skipped, so that it
+    does not stop the results queued after it from being saved.
+
+    After calling start(), the owner of the instance is responsible for calling
+    close(), which blocks until every queued result is saved.
+    """
+
+    def __init__(self,
+                 output_dir,
+                 worker_id=None,
+                 print_results=False,
+                 max_batch_size=16,
+                 trace_recorder=None):
+        """Creates a new ResultWriter.
+
+        Args:
+            output_dir: Directory in which to save result files.
+            worker_id: Numeric ID of the worker that produces the results, or
+                None if this is the only worker.
+            print_results: If True, print each encoded result to the console
+                as it is saved.
+            max_batch_size: Maximum number of results to save before syncing
+                them to disk.
+            trace_recorder: TraceRecorder on which to record the saving of
+                each batch of results, or None.
+        """
+        self._output_dir = output_dir
+        self._worker_id = worker_id
+        self._print_results = print_results
+        self._max_batch_size = max_batch_size
+        self._trace_recorder = trace_recorder
+        self._queue = Queue.Queue()
+        self._writer_thread = None
+
+    def start(self):
+        """Starts the background thread that saves results."""
+        self._writer_thread = threading.Thread(target=self._save_queued_results)
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
+    def write(self, result):
+        """Queues an NdtResult to be saved.
+
+        Args:
+            result: NdtResult instance to save. The caller must not modify the
+                result after queueing it.
+        """
+        self._queue.put(result)
+
+    def close(self):
+        """Saves all queued results, then stops the background thread."""
+        if self._writer_thread:
+            self._queue.put(_STOP)
+            self._writer_thread.join()
+            self._writer_thread = None
+
+    def _save_queued_results(self):
+        while True:
+            batch = self._dequeue_batch()
+            # The stop sentinel can only be the last item in a batch.
+            if batch[-1] is _STOP:
+                self._save_traced_batch(batch[:-1])
+                return
+            self._save_traced_batch(batch)
+
+    def _save_traced_batch(self, batch):
+        if not batch:
+            return
+        # Any error that escapes here would silently end the writer thread, and
+        # every result queued after it would be lost.
+        try:
+            with trace_events.record(self._trace_recorder, 'save_results',
+                                     'result_writer', 'result writer') as args:
+                args['results'] = len(batch)
+                self._save_batch(batch)
+        except Exception:
+            logger.exception('failed to save batch of %d results', len(batch))
+
+    def _dequeue_batch(self):
+        """Blocks until a result is queued, then dequeues up to a full batch."""
+        batch = [self._queue.get()]
+        while len(batch) < self._max_batch_size and batch[-1] is not _STOP:
+            try:
+                batch.append(self._queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def _save_batch(self, batch):
+        """Writes a batch of results to disk, then syncs them all to disk."""
+        output_files = []
+        try:
+            for result in batch:
+                output_file = self._write_result(result)
+                if output_file:
+                    output_files.append(output_file)
+        finally:
+            for output_file in output_files:
+                try:
+                    os.fsync(output_file.fileno())
+                except OSError as e:
+                    logger.error('failed to sync result file %s: %s',
+                                 output_file.name, e)
+                finally:
+                    output_file.close()
+
+    def _write_result(self, result):
+        """Encodes a result and writes it to its output file.
+
+        Args:
+            result: NdtResult instance to write.
+
+        Returns:
+            The open output file, which the caller must sync and close, or None
+            if the result could not be written.
+        """
+        try:
+            encoded_result = result_encoder.NdtResultEncoder(
+                indent=2, sort_keys=True).encode(result)
+        except Exception:
+            logger.exception('failed to encode result')
+            return None
+        if self._print_results:
+            print encoded_result
+        try:
+            output_filename = filename.create_result_filename(result,
+                                                              self._worker_id)
+            output_path = os.path.join(self._output_dir, output_filename)
+            output_file = open(output_path, 'w')
+        except (filename.Error, IOError) as e:
+            logger.error('failed to save result: %s', e)
+            return None
+        except Exception:
+            # A result with missing fields cannot be named, but that should
+            # only lose this result, not the rest of its batch.
+            logger.exception('failed to name result file')
+            return None
+        try:
+            output_file.write(encoded_result)
+            output_file.flush()
+        except IOError as e:
+            logger.error('failed to save result to %s: %s', output_path, e)
+            output_file.close()
+            return None
+        return output_file
+
+
+class JsonLinesResultWriter(ResultWriter):
+    """Appends NdtResult instances to rotating JSON Lines segment files.
+
+    Each result is encoded as a single line of compact JSON and appended to
+    the current segment file in the output directory. The writer starts a new
+    segment when the current one reaches a maximum size or age, so that
+    finished segments can be archived or deleted while the writer runs.
+
+    Segment files are named with the worker ID (if any), the time at which the
+    segment started, and a sequence number, for example:
+
+        results-w3-2016-02-26T155423Z-0001.jsonl
+
+    Each batch of results is synced to disk with a single fsync call. A result
+    that fails to encode is logged and skipped.
+    """
+
+    def __init__(self,
+                 output_dir,
+                 worker_id=None,
+                 print_results=False,
+                 max_batch_size=16,
+                 max_segment_bytes=64 * 1024 * 1024,
+                 max_segment_age=3600,
+                 trace_recorder=None):
+        """Creates a new JsonLinesResultWriter.
+
+        Args:
+            output_dir: Directory in which to save segment files.
+            worker_id: Numeric ID of the worker that produces the results, or
+                None if this is the only worker.
+            print_results: If True, print each encoded result to the console
+                as it is saved.
+            max_batch_size: Maximum number of results to save before syncing
+                them to disk.
+            max_segment_bytes: Size (in bytes) at which to start a new segment,
+                or None for no size limit.
+            max_segment_age: Age (in seconds) at which to start a new segment,
+                or None for no age limit.
+            trace_recorder: TraceRecorder on which to record the saving of
+                each batch of results, or None.
+        """
+        super(JsonLinesResultWriter, self).__init__(
+            output_dir, worker_id, print_results, max_batch_size,
+            trace_recorder)
+        self._max_segment_bytes = max_segment_bytes
+        self._max_segment_age = max_segment_age
+        self._segment_file = None
+        self._segment_bytes = 0
+        self._segment_start_time = None
+        self._segment_count = 0
+
+    def close(self):
+        """Saves all queued results, then closes the current segment."""
+        super(JsonLinesResultWriter, self).close()
+        self._close_segment()
+
+    def _save_batch(self, batch):
+        """Appends a batch of results to segments, then syncs them to disk."""
+        for result in batch:
+            try:
+                encoded_result = result_encoder.encode_compact(result)
+            except Exception:
+                logger.exception('failed to encode result')
+                continue
+            if self._print_results:
+                print encoded_result
+            self._append_line(encoded_result + '\n')
+        self._sync_segment()
+
+    def _append_line(self, line):
+        if self._should_rotate():
+            self._close_segment()
+        try:
+            if not self._segment_file:
+                self._open_segment()
+            self._segment_file.write(line)
+        except IOError as e:
+            logger.error('failed to append result to segment: %s', e)
+            # Start a fresh segment for the next result rather than appending
+            # after a partially written line.
+            self._close_segment()
+            return
+        self._segment_bytes += len(line)
+
+    def _should_rotate(self):
+        if not self._segment_file:
+            return False
+        if (self._max_segment_bytes is not None and
+                self._segment_bytes >= self._max_segment_bytes):
+            return True
+        return (self._max_segment_age is not None and
+                time.time() - self._segment_start_time >= self._max_segment_age)
+
+    def _open_segment(self):
+        self._segment_start_time = time.time()
+        self._segment_count += 1
+        segment_path = os.path.join(self._output_dir,
+                                    self._create_segment_filename())
+        self._segment_file = open(segment_path, 'a')
+        self._segment_bytes = self._segment_file.tell()
+
+    def _create_segment_filename(self):
+        parts = ['results']
+        if self._worker_id is not None:
+            parts.append('w%d' % self._worker_id)
+        parts.append(datetime.datetime.fromtimestamp(
+            self._segment_start_time, pytz.utc).strftime('%Y-%m-%dT%H%M%SZ'))
+        parts.append('%04d' % self._segment_count)
+        return '-'.join(parts) + SEGMENT_EXTENSION
+
+    def _sync_segment(self):
+        if not self._segment_file:
+            return
+        try:
+            self._segment_file.flush()
+            os.fsync(self._segment_file.fileno())
+        except (IOError, OSError) as e:
+            logger.error('failed to sync segment %s: %s',
+                         self._segment_file.name, e)
+
+    def _close_segment(self):
+        if not self._segment_file:
+            return
+        self._sync_segment()
+        try:
+            self._segment_file.close()
+        except IOError as e:
+            logger.error('failed to close segment %s: %s',
+                         self._segment_file.name, e)
+        self._segment_file = None
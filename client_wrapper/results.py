@@ -12,11 +12,60 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import array
 import datetime
+import itertools
 
 import pytz
 
 
+class ThroughputSeries(object):
+    """Throughput readings sampled over the course of a single NDT test.
+
+    Stores the samples in two parallel arrays of doubles, so that each sample
+    costs 16 bytes rather than the size of a tuple of two float objects.
+
+    Attributes:
+        offsets: Array of times at which each sample was taken (in seconds
+            since the start of the test).
+        throughputs: Array of throughput readings (in Mbps), in the same order
+            as offsets.
+    """
+
+    def __init__(self, samples=()):
+        """Creates a new ThroughputSeries.
+
+        Args:
+            samples: An iterable of (offset, throughput) pairs.
+        """
+        self.offsets = array.array('d')
+        self.throughputs = array.array('d')
+        for offset, throughput in samples:
+            self.append(offset, throughput)
+
+    def append(self, offset, throughput):
+        self.offsets.append(offset)
+        self.throughputs.append(throughput)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return itertools.izip(self.offsets, self.throughputs)
+
+    def __eq__(self, other):
+        if not isinstance(other, ThroughputSeries):
+            return False
+        return ((self.offsets == other.offsets) and
+                (self.throughputs == other.throughputs))
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __str__(self):
+        return str(list(self))
+
+
 class NdtSingleTestResult(object):
     """Result of a single NDT test.
 
@@ -27,17 +76,26 @@ class NdtSingleTestResult(object):
             never began).
         end_time: The datetime when the test competed (or None if the test
             never completed).
+        throughput_samples: A ThroughputSeries of the throughput readings that
+            the client displayed while the test ran (or None if throughput was
+            not sampled).
     """
 
-    def __init__(self, throughput=None, start_time=None, end_time=None):
+    def __init__(self,
+                 throughput=None,
+                 start_time=None,
+                 end_time=None,
+                 throughput_samples=None):
         self.throughput = throughput
         self.start_time = start_time
         self.end_time = end_time
+        self.throughput_samples = throughput_samples
 
     def __eq__(self, other):
         return all(((self.throughput == other.throughput),
                     (self.start_time == other.start_time),
-                    (self.end_time == other.end_time)))
+                    (self.end_time == other.end_time),
+                    (self.throughput_samples == other.throughput_samples)))
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -45,9 +103,12 @@ class NdtSingleTestResult(object):
     def __str__(self):
         return ('[throughput={throughput}, '
                 'start_time={start_time}, '
-                'end_time={end_time}]').format(throughput=self.throughput,
-                                               start_time=self.start_time,
-                                               end_time=self.end_time)
+                'end_time={end_time}, '
+                'throughput_samples={throughput_samples}]').format(
+                    throughput=self.throughput,
+                    start_time=self.start_time,
+                    end_time=self.end_time,
+                    throughput_samples=self.throughput_samples)
 
 
 class TestError(object):
@@ -85,6 +146,47 @@ class TestError(object):
         return self._timestamp
 
 
+class Span(object):
+    """Timing of a single step of a test, such as loading the client's page.
+
+    Attributes:
+        name: Name of the step (e.g. 'load_url').
+        start_time: Datetime at which the step started.
+        end_time: Datetime at which the step ended (or None if the step has not
+            ended).
+    """
+
+    def __init__(self, name, start_time, end_time=None):
+        self.name = name
+        self.start_time = start_time
+        self.end_time = end_time
+
+    def __eq__(self, other):
+        return all(((self.name == other.name),
+                    (self.start_time == other.start_time),
+                    (self.end_time == other.end_time)))
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __str__(self):
+        return ('[name={name}, start_time={start_time}, '
+                'end_time={end_time}]').format(name=self.name,
+                                               start_time=self.start_time,
+                                               end_time=self.end_time)
+
+    @property
+    def duration(self):
+        """Length of the step in seconds, or None if the step has not ended."""
+        if self.end_time is None:
+            return None
+        return (self.end_time - self.start_time).total_seconds()
+
+    def finish(self):
+        """Marks the step as ended at the current time."""
+        self.end_time = datetime.datetime.now(pytz.utc)
+
+
 class NdtResult(object):
     """Represents the results of a complete NDT HTML5 client test.
 
@@ -110,6 +212,13 @@ class NdtResult(object):
             for a non-browser test).
         browser_version: Browser's version string (or None for a non-browser
             test).
+        browser_headless: True if the browser ran without a GUI, False if it
+            ran with one (or None for a non-browser test or if unknown).
+        scheduled_start_time: The datetime at which the test was scheduled to
+            start (or None if the test was not run on a schedule).
+        spans: A list of Span objects recording how long each step of the test
+            took, in the order that the steps started (or an empty list if the
+            steps were not timed).
     """
 
     def __init__(self,
@@ -124,7 +233,10 @@ class NdtResult(object):
                  client=None,
                  client_version=None,
                  browser=None,
-                 browser_version=None):
+                 browser_version=None,
+                 browser_headless=None,
+                 scheduled_start_time=None,
+                 spans=None):
         self.start_time = start_time
         self.end_time = end_time
         self.c2s_result = c2s_result if c2s_result else NdtSingleTestResult()
@@ -137,6 +249,9 @@ class NdtResult(object):
         self.client_version = client_version
         self.browser = browser
         self.browser_version = browser_version
+        self.browser_headless = browser_headless
+        self.scheduled_start_time = scheduled_start_time
+        self.spans = spans if spans else []
 
     def __eq__(self, other):
         return all(((self.start_time == other.start_time),
@@ -148,7 +263,10 @@ class NdtResult(object):
                     (self.client == other.client),
                     (self.client_version == other.client_version),
                     (self.browser == other.browser),
-                    (self.browser_version == other.browser_version)))
+                    (self.browser_version == other.browser_version),
+                    (self.browser_headless == other.browser_headless),
+                    (self.scheduled_start_time == other.scheduled_start_time),
+                    (self.spans == other.spans)))
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -165,7 +283,10 @@ class NdtResult(object):
                 'client={client}, '
                 'client_version={client_version}, '
                 'browser={browser}, '
-                'browser_version={browser_version}]').format(
+                'browser_version={browser_version}, '
+                'browser_headless={browser_headless}, '
+                'scheduled_start_time={scheduled_start_time}, '
+                'spans={spans}]').format(
                     start_time=self.start_time,
                     end_time=self.end_time,
                     errors=[str(e) for e in self.errors],
@@ -177,4 +298,7 @@ class NdtResult(object):
                     client=self.client,
                     client_version=self.client_version,
                     browser=self.browser,
-                    browser_version=self.browser_version)
+                    browser_version=self.browser_version,
+                    browser_headless=self.browser_headless,
+                    scheduled_start_time=self.scheduled_start_time,
+                    spans=[str(span) for span in self.spans])
@@ -0,0 +1,170 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Schedules when each NDT test iteration starts.
+
+A run can be bounded by a number of iterations, by a time budget, or both.
+Within the run, tests either start back-to-back or at a target rate. With a
+target rate, each test's start time is fixed relative to the start of the run
+rather than to the end of the previous test, so slow tests do not push back
+the rest of the schedule. If a test overruns the start of the tests after it,
+the scheduler skips the start times that have already passed and resumes at
+the most recent one, rather than starting the missed tests back-to-back.
+"""
+
+import collections
+import datetime
+import logging
+import random
+import time
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+# A test that the scheduler has released to run.
+#
+# Attributes:
+#     index: Zero-based index of the test within the run.
+#     scheduled_time: The datetime at which the test was scheduled to start.
+#     drift: Number of seconds between the scheduled start time and the time at
+#         which the scheduler released the test.
+ScheduledTest = collections.namedtuple('ScheduledTest',
+                                       ['index', 'scheduled_time', 'drift'])
+
+
+class Scheduler(object):
+    """Releases NDT test iterations according to a schedule."""
+
+    def __init__(self,
+                 iterations=None,
+                 duration=None,
+                 tests_per_hour=None,
+                 jitter=0.0):
+        """Creates a new Scheduler.
+
+        Args:
+            iterations: Maximum number of tests to run, or None for no limit.
+            duration: Time budget for the run (in seconds), or None for no
+                limit. No test is scheduled to start after the budget ends,
+                but a test that started within the budget runs to completion.
+            tests_per_hour: Target rate at which to start tests, or None to
+                start each test as soon as the previous one ends.
+            jitter: Amount by which to randomly shift each scheduled start
+                time, as a fraction of the interval between tests. A jitter of
+                0.5 shifts each start by up to a quarter of the interval in
+                either direction. Only applies with a target rate.
+
+        Raises:
+            ValueError: The arguments do not bound the run or are out of range.
+        """
+        if iterations is None and duration is None:
+            raise ValueError('Either iterations or duration must be specified')
+        if tests_per_hour is not None and tests_per_hour <= 0:
+            raise ValueError('Test rate must be positive: %s' % tests_per_hour)
+        if not 0.0 <= jitter < 1.0:
+            raise ValueError('Jitter must be in the range [0, 1): %s' % jitter)
+        self._iterations = iterations
+        self._duration = duration
+        self._interval = None
+        if tests_per_hour:
+            self._interval = 3600.0 / tests_per_hour
+        self._jitter = jitter
+        self._drifts = []
+        self._missed_slots = 0
+
+    @property
+    def drifts(self):
+        """List of the drift (in seconds) of each test released so far."""
+        return self._drifts
+
+    @property
+    def missed_slots(self):
+        """Number of scheduled start times skipped because tests overran."""
+        return self._missed_slots
+
+    def schedule(self):
+        """Releases each test in the run at its scheduled start time.
+
+        Blocks before yielding each test until the test's scheduled start time.
+        If the previous test overran the scheduled start, yields the test
+        immediately and records how late it started as its drift. If the
+        previous test overran more than one start time, skips all but the most
+        recent of them and counts the rest as missed slots.
+
+        Yields:
+            A ScheduledTest for each test in the run.
+        """
+        run_start = time.time()
+        deadline = None
+        if self._duration is not None:
+            deadline = run_start + self._duration
+        index = 0
+        # Index of the next start time in the schedule. It runs ahead of the
+        # test index when tests overrun their slots.
+        slot = 0
+        while self._iterations is None or index < self._iterations:
+            slot = self._skip_missed_slots(run_start, slot)
+            scheduled_start = self._get_scheduled_start(run_start, slot)
+            if deadline is not None and scheduled_start >= deadline:
+                return
+            now = time.time()
+            if scheduled_start > now:
+                time.sleep(scheduled_start - now)
+            drift = time.time() - scheduled_start
+            self._drifts.append(drift)
+            yield ScheduledTest(index=index,
+                                scheduled_time=datetime.datetime.fromtimestamp(
+                                    scheduled_start, pytz.utc),
+                                drift=drift)
+            index += 1
+            slot += 1
+
+    def log_drift_summary(self):
+        """Logs statistics about how far tests drifted from the schedule."""
+        if self._drifts:
+            logger.info('%d tests drifted from schedule by %.3fs on average, '
+                        '%.3fs at most', len(self._drifts), sum(self._drifts) /
+                        len(self._drifts), max(self._drifts))
+        if self._missed_slots:
+            logger.warning('skipped %d scheduled tests because earlier tests '
+                           'overran them', self._missed_slots)
+
+    def _skip_missed_slots(self, run_start, slot):
+        """Skips past slots whose start time passed before the next slot's did.
+
+        Args:
+            run_start: Time at which the run started, in seconds since the
+                epoch.
+            slot: Index of the next slot in the schedule.
+
+        Returns:
+            The index of the slot in which to start the next test.
+        """
+        if self._interval is None:
+            return slot
+        due_slot = int((time.time() - run_start) // self._interval)
+        if due_slot <= slot:
+            return slot
+        self._missed_slots += due_slot - slot
+        return due_slot
+
+    def _get_scheduled_start(self, run_start, slot):
+        if self._interval is None:
+            return time.time()
+        scheduled_start = run_start + slot * self._interval
+        if self._jitter:
+            scheduled_start += (random.random() - 0.5) * (self._jitter *
+                                                          self._interval)
+        # The first test never starts before the run does.
+        return max(scheduled_start, run_start)
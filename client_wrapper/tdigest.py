@@ -0,0 +1,183 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A t-digest sketch for estimating percentiles of a stream of values.
+
+A t-digest summarizes a distribution as a sorted list of centroids, each the
+mean of a cluster of nearby values and the number of values in the cluster.
+Clusters are kept small near the tails of the distribution and allowed to grow
+near the median, so extreme percentiles stay accurate while the digest's size
+is bounded by its compression parameter rather than by the number of values.
+Two digests can be merged into one that summarizes both streams, which lets
+separate workers each summarize their own results.
+
+This is the merging variant of the t-digest described in Dunning and Ertl,
+"Computing Extremely Accurate Quantiles Using t-Digests": values are buffered
+and periodically merged into the centroids in a single sorted pass.
+"""
+
+import math
+
+
+class TDigest(object):
+    """Estimates percentiles of a stream of values in bounded memory."""
+
+    def __init__(self, compression=100):
+        """Creates an empty TDigest.
+
+        Args:
+            compression: Controls the tradeoff between accuracy and size. The
+                digest keeps on the order of this many centroids.
+
+        Raises:
+            ValueError: compression is not positive.
+        """
+        if compression <= 0:
+            raise ValueError('Compression must be positive: %s' % compression)
+        self._compression = compression
+        self._means = []
+        self._weights = []
+        # Values (and their weights) added since the last compression.
+        self._buffer = []
+        self._buffer_limit = 5 * compression
+        self._total_weight = 0
+        self._min = None
+        self._max = None
+
+    @property
+    def count(self):
+        """Total weight of the values in the digest."""
+        return self._total_weight
+
+    @property
+    def min(self):
+        """Smallest value in the digest, or None if the digest is empty."""
+        return self._min
+
+    @property
+    def max(self):
+        """Largest value in the digest, or None if the digest is empty."""
+        return self._max
+
+    def add(self, value, weight=1):
+        """Adds a value to the digest.
+
+        Args:
+            value: Value to add.
+            weight: Number of times to count the value.
+        """
+        self._buffer.append((value, weight))
+        self._total_weight += weight
+        if self._min is None or value < self._min:
+            self._min = value
+        if self._max is None or value > self._max:
+            self._max = value
+        if len(self._buffer) >= self._buffer_limit:
+            self._compress()
+
+    def merge(self, other):
+        """Adds all of the values summarized by another TDigest to this one."""
+        if not other.count:
+            return
+        other._compress()
+        self._buffer.extend(zip(other._means, other._weights))
+        self._total_weight += other._total_weight
+        if self._min is None or other._min < self._min:
+            self._min = other._min
+        if self._max is None or other._max > self._max:
+            self._max = other._max
+        self._compress()
+
+    def percentile(self, percent):
+        """Estimates a percentile of the values in the digest.
+
+        Args:
+            percent: Percentile to estimate, between 0 and 100.
+
+        Returns:
+            The estimated percentile, or None if the digest is empty.
+
+        Raises:
+            ValueError: percent is outside the range [0, 100].
+        """
+        if not 0 <= percent <= 100:
+            raise ValueError('Percentile must be between 0 and 100: %s' %
+                             percent)
+        if not self._total_weight:
+            return None
+        self._compress()
+        if len(self._means) == 1:
+            return self._means[0]
+        # Treat each centroid's mean as the value at the middle of its weight,
+        # and interpolate linearly between neighboring centroids (or between
+        # the outermost centroids and the minimum and maximum).
+        target = self._total_weight * percent / 100.0
+        previous_mean = self._min
+        previous_position = 0.0
+        position = 0.0
+        for mean, weight in zip(self._means, self._weights):
+            center = position + weight / 2.0
+            if target < center:
+                return _interpolate(previous_mean, previous_position, mean,
+                                    center, target)
+            previous_mean = mean
+            previous_position = center
+            position += weight
+        return _interpolate(previous_mean, previous_position, self._max,
+                            self._total_weight, target)
+
+    def _compress(self):
+        """Merges buffered values into the centroids."""
+        if not self._buffer:
+            return
+        centroids = sorted(zip(self._means, self._weights) + self._buffer)
+        self._buffer = []
+        total_weight = float(self._total_weight)
+        self._means = []
+        self._weights = []
+        current_mean, current_weight = centroids[0]
+        weight_before = 0
+        limit = self._get_quantile_limit(0.0)
+        for mean, weight in centroids[1:]:
+            merged_quantile = (
+                weight_before + current_weight + weight) / total_weight
+            if merged_quantile <= limit:
+                current_weight += weight
+                current_mean += (mean - current_mean) * weight / current_weight
+            else:
+                self._means.append(current_mean)
+                self._weights.append(current_weight)
+                weight_before += current_weight
+                limit = self._get_quantile_limit(weight_before / total_weight)
+                current_mean, current_weight = mean, weight
+        self._means.append(current_mean)
+        self._weights.append(current_weight)
+
+    def _get_quantile_limit(self, quantile):
+        """Returns the largest quantile that a centroid starting here can reach.
+
+        Uses the k1 scale function, k(q) = compression / (2 pi) * asin(2q - 1),
+        under which each centroid may span at most one unit of k.
+        """
+        scale = self._compression / (2 * math.pi)
+        k = scale * math.asin(2 * quantile - 1) + 1
+        if k >= scale * math.pi / 2:
+            return 1.0
+        return (math.sin(k / scale) + 1) / 2
+
+
+def _interpolate(x0, position0, x1, position1, target):
+    if position1 <= position0:
+        return x1
+    fraction = (target - position0) / (position1 - position0)
+    return x0 + (x1 - x0) * fraction
@@ -0,0 +1,222 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Records timelines of client_wrapper runs as Chrome trace events.
+
+A trace is a JSON file in the Chrome trace event format, which can be opened in
+chrome://tracing or the Perfetto UI to show what each worker was doing at any
+moment of a run. Each worker is a separate process in the trace, and each
+activity within a worker (running tests, serving replayed responses, saving
+results) is a separate track, so that overlapping activities are easy to tell
+apart.
+
+Each worker streams its events to its own events file as they are recorded,
+one JSON event per line, so that a long run does not hold its events in memory
+and a worker that crashes keeps the events it recorded before the crash.
+write_trace then merges the events files of every worker into the trace.
+"""
+
+import calendar
+import contextlib
+import datetime
+import json
+import logging
+import os
+import threading
+
+import pytz
+
+logger = logging.getLogger(__name__)
+
+
+class TraceRecorder(object):
+    """Writes the trace events of a single worker to an events file.
+
+    A TraceRecorder is safe to use from multiple threads. Events are recorded
+    as complete events, each with a start time and a duration, on named tracks
+    that appear as threads in the trace viewer. Each event is written and
+    flushed to the events file as soon as it is recorded.
+    """
+
+    def __init__(self, process_id, process_name, events_file):
+        """Creates a new TraceRecorder.
+
+        Args:
+            process_id: Numeric ID of the process under which the worker's
+                events appear in the trace. Must be unique among the
+                recorders whose events are written to the same trace.
+            process_name: Name of the process in the trace viewer (e.g.
+                'worker 0').
+            events_file: File to which to write each event, as a line of
+                JSON. The caller is responsible for closing the file.
+        """
+        self._process_id = process_id
+        self._events_file = events_file
+        self._lock = threading.Lock()
+        # Dictionary of track name to the thread ID of the track's events.
+        self._track_ids = {}
+        self._write_event(_create_metadata_event('process_name', process_id, 0,
+                                                 process_name))
+
+    def add_event(self, name, category, track, start_time, end_time, args=None):
+        """Adds a complete event to the trace.
+
+        Args:
+            name: Name of the event (e.g. 'load_url').
+            category: Category of the event (e.g. 'test_step'), by which the
+                trace viewer can filter events.
+            track: Name of the track on which to show the event.
+            start_time: Datetime at which the event started.
+            end_time: Datetime at which the event ended.
+            args: Dictionary of additional details to show with the event, or
+                None.
+        """
+        start_micros = _to_microseconds(start_time)
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start_micros,
+            'dur': _to_microseconds(end_time) - start_micros,
+            'pid': self._process_id,
+        }
+        if args:
+            event['args'] = args
+        with self._lock:
+            event['tid'] = self._get_track_id(track)
+            self._write_event(event)
+
+    @contextlib.contextmanager
+    def record(self, name, category, track):
+        """Records the time spent in a block as a complete event.
+
+        The event is recorded even if the block raises an exception.
+
+        Args:
+            name: Name of the event.
+            category: Category of the event.
+            track: Name of the track on which to show the event.
+
+        Yields:
+            A dictionary to which the block can add details to show with the
+            event.
+        """
+        args = {}
+        start_time = datetime.datetime.now(pytz.utc)
+        try:
+            yield args
+        finally:
+            self.add_event(name, category, track, start_time,
+                           datetime.datetime.now(pytz.utc), args)
+
+    def _get_track_id(self, track):
+        if track not in self._track_ids:
+            track_id = len(self._track_ids) + 1
+            self._track_ids[track] = track_id
+            self._write_event(_create_metadata_event(
+                'thread_name', self._process_id, track_id, track))
+        return self._track_ids[track]
+
+    def _write_event(self, event):
+        """Writes an event to the events file. The caller must hold the lock."""
+        self._events_file.write(json.dumps(event) + '\n')
+        self._events_file.flush()
+
+
+def record(recorder, name, category, track):
+    """Records the time spent in a block on a recorder, if there is one.
+
+    Args:
+        recorder: TraceRecorder on which to record the event, or None to record
+            nothing.
+        name: Name of the event.
+        category: Category of the event.
+        track: Name of the track on which to show the event.
+
+    Returns:
+        A context manager that yields a dictionary to which the block can add
+        details to show with the event.
+    """
+    if recorder is None:
+        return _record_nothing()
+    return recorder.record(name, category, track)
+
+
+@contextlib.contextmanager
+def _record_nothing():
+    yield {}
+
+
+def read_events(events_file):
+    """Reads the events that a TraceRecorder wrote to an events file.
+
+    A worker that crashes may leave a partially written event at the end of
+    its events file, so a last line without a trailing newline is skipped.
+
+    Args:
+        events_file: Open events file, as written by a TraceRecorder.
+
+    Yields:
+        Each complete event in the file, as a dictionary.
+    """
+    for line in events_file:
+        if not line.endswith('\n'):
+            logger.warning('skipping partially written trace event in %s',
+                           getattr(events_file, 'name', 'events file'))
+            continue
+        yield json.loads(line)
+
+
+def write_trace(trace_path, events_paths):
+    """Merges events files into a file in the Chrome trace event format.
+
+    Events are copied one at a time, so merging does not hold every event in
+    memory.
+
+    Args:
+        trace_path: Path of the trace file to write.
+        events_paths: List of paths of events files, as written by
+            TraceRecorders. Paths of events files that do not exist (e.g.
+            because a worker failed before it started recording) are skipped.
+    """
+    with open(trace_path, 'w') as trace_file:
+        trace_file.write('{"displayTimeUnit": "ms", "traceEvents": [')
+        separator = ''
+        for events_path in events_paths:
+            if not os.path.exists(events_path):
+                logger.warning('trace events file is missing: %s', events_path)
+                continue
+            with open(events_path) as events_file:
+                for event in read_events(events_file):
+                    trace_file.write(separator + json.dumps(event))
+                    separator = ',\n'
+        trace_file.write(']}\n')
+
+
+def _create_metadata_event(name, process_id, thread_id, value):
+    return {
+        'name': name,
+        'ph': 'M',
+        'pid': process_id,
+        'tid': thread_id,
+        'args': {'name': value}
+    }
+
+
+def _to_microseconds(time):
+    """Converts a datetime to microseconds since the epoch.
+
+    Trace viewers align events by timestamp, so using the epoch rather than the
+    start of each worker lines up the events of workers in separate processes.
+    """
+    return calendar.timegm(time.utctimetuple()) * 1000000 + time.microsecond
@@ -39,7 +39,7 @@ class NdtClientTestCase(unittest.TestCase):
         self.mock_driver.capabilities = {'version': 'mock_version'}
 
         @contextlib.contextmanager
-        def mock_create_browser(browser):
+        def mock_create_browser(browser, headless=False):
             yield self.mock_driver
 
         # Patch the call to create the browser driver to return our mock driver.
@@ -48,3 +48,30 @@ class NdtClientTestCase(unittest.TestCase):
         self.addCleanup(create_browser_patcher.stop)
         create_browser_patcher.start()
         browser_client_common.create_browser.side_effect = mock_create_browser
+
+    def create_mock_browser_session(self):
+        """Creates a mock BrowserSession that yields the mock driver."""
+
+        @contextlib.contextmanager
+        def mock_use_browser():
+            yield self.mock_driver
+
+        mock_session = mock.Mock(spec=browser_client_common.BrowserSession)
+        mock_session.use_browser.side_effect = mock_use_browser
+        return mock_session
+
+    def patch_span_recording(self):
+        """Set up patches so that timing a test's steps records no spans."""
+
+        @contextlib.contextmanager
+        def mock_record_span(unused_result, unused_name):
+            yield mock.Mock()
+
+        for name, side_effect in (
+            ('start_span', lambda unused_result, unused_name: mock.Mock()),
+            ('record_span', mock_record_span)):
+            span_patcher = mock.patch.object(browser_client_common,
+                                             name,
+                                             side_effect=side_effect)
+            self.addCleanup(span_patcher.stop)
+            span_patcher.start()
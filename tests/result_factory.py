@@ -0,0 +1,58 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Creates NdtResult instances for unit tests of result processing."""
+
+import datetime
+
+import pytz
+
+from client_wrapper import names
+from client_wrapper import results
+
+
+def create_result(hour=0, s2c_throughput=None, **kwargs):
+    """Creates an NdtResult for a test that ran for one minute.
+
+    By default, the result is of an NDT HTML5 test in Chrome 49 on Windows 10
+    that started at the given hour of January 1, 2016. If s2c_throughput is
+    set, the result has an s2c test that ran from 10 to 20 seconds into the
+    test.
+
+    Args:
+        hour: Hour of the day at which the test started.
+        s2c_throughput: Throughput of the s2c test, or None if the result has
+            no s2c test.
+        kwargs: Values of other NdtResult fields, which override the defaults
+            (including start_time and end_time).
+
+    Returns:
+        The NdtResult.
+    """
+    start_time = datetime.datetime(2016, 1, 1, hour, 0, 0, 0, pytz.utc)
+    fields = {
+        'start_time': start_time,
+        'end_time': start_time + datetime.timedelta(minutes=1),
+        'client': names.NDT_HTML5,
+        'os': 'Windows',
+        'os_version': '10',
+        'browser': names.CHROME,
+        'browser_version': '49.0.2623',
+    }
+    if s2c_throughput is not None:
+        fields['s2c_result'] = results.NdtSingleTestResult(
+            throughput=s2c_throughput,
+            start_time=start_time + datetime.timedelta(seconds=10),
+            end_time=start_time + datetime.timedelta(seconds=20))
+    fields.update(kwargs)
+    return results.NdtResult(**fields)
@@ -32,7 +32,7 @@ class BanjoDriverTest(ndt_client_testcase.NdtClientTestCase):
     def setUp(self):
         self.apply_patches_for_create_browser()
         self.define_mock_behavior_for_find_element_by_id()
-        self.define_mock_behavior_for_find_element_by_xpath()
+        self.apply_patches_for_get_element_texts()
         self.apply_patches_for_wait_until_element_is_visible()
         self.apply_patches_for_waiting_on_status_banner_text()
 
@@ -50,8 +50,8 @@ class BanjoDriverTest(ndt_client_testcase.NdtClientTestCase):
         self.mock_driver.find_element_by_id.side_effect = (
             lambda id: self.mock_elements_by_id[id])
 
-    def define_mock_behavior_for_find_element_by_xpath(self):
-        """Defines the behavior for driver's find_element_by_xpath method."""
+    def apply_patches_for_get_element_texts(self):
+        """Set up patches to read element texts from mock DOM elements."""
         self.mock_elements_by_xpath = {
             '//div[@id="lrfactory-internetspeed__latency"]/*[2]':
             mock.Mock(text='1.23 ms'),
@@ -60,8 +60,20 @@ class BanjoDriverTest(ndt_client_testcase.NdtClientTestCase):
             '//div[@id="lrfactory-internetspeed__upload"]/*[1]':
             mock.Mock(text='7.89'),
         }
-        self.mock_driver.find_element_by_xpath.side_effect = (
-            lambda xpath: self.mock_elements_by_xpath[xpath])
+
+        def mock_get_element_texts(unused_driver, locators):
+            texts = {}
+            for name, (_, xpath) in locators.iteritems():
+                element = self.mock_elements_by_xpath[xpath]
+                texts[name] = element.text if element else None
+            return texts
+
+        get_element_texts_patcher = mock.patch.object(
+            browser_client_common,
+            'get_element_texts',
+            side_effect=mock_get_element_texts)
+        self.addCleanup(get_element_texts_patcher.stop)
+        get_element_texts_patcher.start()
 
     def apply_patches_for_wait_until_element_is_visible(self):
         """Set up patches for wait_until_element_is_visible."""
@@ -116,6 +128,32 @@ class BanjoDriverTest(ndt_client_testcase.NdtClientTestCase):
         self.assertEqual(7.89, result.c2s_result.throughput)
         self.assertErrorMessagesEqual([], result.errors)
 
+    def test_test_records_whether_browser_ran_headless(self):
+        self.assertFalse(self.banjo.perform_test().browser_headless)
+
+        banjo = banjo_driver.BanjoDriver(names.FIREFOX,
+                                         'http://fakelocalhost:1234/foo',
+                                         headless=True)
+        result = banjo.perform_test()
+
+        self.assertTrue(result.browser_headless)
+        browser_client_common.create_browser.assert_called_with(names.FIREFOX,
+                                                                True)
+
+    def test_test_runs_in_browser_session_when_one_is_provided(self):
+        mock_session = self.create_mock_browser_session()
+        banjo = banjo_driver.BanjoDriver(names.FIREFOX,
+                                         'http://fakelocalhost:1234/foo',
+                                         browser_session=mock_session)
+
+        banjo.perform_test()
+        result = banjo.perform_test()
+
+        self.assertEqual(2, mock_session.use_browser.call_count)
+        self.assertFalse(browser_client_common.create_browser.called)
+        self.assertEqual(4.56, result.s2c_result.throughput)
+        self.assertErrorMessagesEqual([], result.errors)
+
     def test_test_records_error_when_url_does_not_load(self):
         """If the URL fails to load, return a valid NdtResult with an error."""
 
@@ -189,6 +227,8 @@ class BanjoDriverTest(ndt_client_testcase.NdtClientTestCase):
         for i in range(7):
             times.append(datetime.datetime(2016, 1, 1, 0, 0, i))
 
+        # Timing spans also read the clock, so keep them out of the sequence.
+        self.patch_span_recording()
         with mock.patch.object(banjo_driver.datetime,
                                'datetime',
                                autospec=True) as mocked_datetime:
@@ -200,7 +240,7 @@ class BanjoDriverTest(ndt_client_testcase.NdtClientTestCase):
             # call so we can verify that the browser is created after
             # result.start_time.
             @contextlib.contextmanager
-            def mock_create_browser(unused_browser_name):
+            def mock_create_browser(unused_browser_name, unused_headless=False):
                 datetime.datetime.now(pytz.utc)
                 yield self.mock_driver
 
@@ -218,6 +258,132 @@ class BanjoDriverTest(ndt_client_testcase.NdtClientTestCase):
         self.assertEqual(times[5], result.c2s_result.end_time)
         self.assertEqual(times[6], result.end_time)
 
+    def test_driver_records_event_times_from_phase_observer(self):
+        # Milliseconds since the epoch at which each phase began in the page.
+        phase_times = {
+            's2c_start': 1451606401000.0,
+            's2c_end': 1451606411000.0,
+            'c2s_start': 1451606412000.0,
+            'c2s_end': 1451606422500.0,
+        }
+        self.mock_driver.execute_async_script.side_effect = (
+            lambda unused_script, phase_name: phase_times[phase_name])
+        banjo = banjo_driver.BanjoDriver(names.FIREFOX,
+                                         'http://fakelocalhost:1234/foo',
+                                         observe_phases=True)
+
+        result = banjo.perform_test()
+
+        self.assertEqual(
+            datetime.datetime(2016, 1, 1, 0,
+                              0, 1, tzinfo=pytz.utc),
+            result.s2c_result.start_time)
+        self.assertEqual(
+            datetime.datetime(2016, 1, 1, 0,
+                              0, 11, tzinfo=pytz.utc),
+            result.s2c_result.end_time)
+        self.assertEqual(
+            datetime.datetime(2016, 1, 1, 0,
+                              0, 12, tzinfo=pytz.utc),
+            result.c2s_result.start_time)
+        self.assertEqual(
+            datetime.datetime(2016, 1, 1, 0, 0, 22, 500000, pytz.utc),
+            result.c2s_result.end_time)
+        self.assertTrue(self.mock_driver.execute_script.called)
+        self.assertFalse(
+            banjo_driver.expected_conditions.text_to_be_present_in_element.
+            called)
+        self.assertErrorMessagesEqual([], result.errors)
+
+    def test_driver_adds_errors_when_phase_observer_never_sees_phases(self):
+        self.mock_driver.execute_async_script.side_effect = (
+            exceptions.TimeoutException('mock timeout'))
+        banjo = banjo_driver.BanjoDriver(names.FIREFOX,
+                                         'http://fakelocalhost:1234/foo',
+                                         observe_phases=True)
+
+        result = banjo.perform_test()
+
+        self.assertErrorMessagesEqual(
+            [browser_client_common.ERROR_S2C_NEVER_STARTED,
+             browser_client_common.ERROR_S2C_NEVER_ENDED,
+             browser_client_common.ERROR_C2S_NEVER_STARTED,
+             browser_client_common.ERROR_C2S_NEVER_ENDED], result.errors)
+
+    def test_driver_polls_for_phases_when_phase_observer_fails_to_install(self):
+        self.mock_driver.execute_script.side_effect = (
+            exceptions.WebDriverException('mock script error'))
+        banjo = banjo_driver.BanjoDriver(names.FIREFOX,
+                                         'http://fakelocalhost:1234/foo',
+                                         observe_phases=True)
+
+        result = banjo.perform_test()
+
+        self.assertFalse(self.mock_driver.execute_async_script.called)
+        self.assertIsNotNone(result.s2c_result.start_time)
+        self.assertErrorMessagesEqual([], result.errors)
+
+    def test_driver_records_sampled_throughput_during_each_test(self):
+
+        def time_at(seconds):
+            return datetime.datetime(2016, 1, 1, tzinfo=pytz.utc) + (
+                datetime.timedelta(seconds=seconds))
+
+        def sample(seconds, download, upload):
+            return (time_at(seconds), {'download': download, 'upload': upload})
+
+        # Mock times to be returned by datetime.now(), ten seconds apart.
+        times = [time_at(i) for i in range(0, 60, 10)]
+        self.patch_span_recording()
+
+        with mock.patch.object(browser_client_common,
+                               'TextSampler') as mock_sampler_class:
+            mock_sampler_class.return_value.stop.return_value = [
+                sample(12, '1.5', ''), sample(15, '3.25', ''),
+                sample(25, '4.5', ''), sample(32, '4.56', '2.0'),
+                sample(35, '4.56', 'banana')
+            ]
+            with mock.patch.object(banjo_driver.datetime,
+                                   'datetime',
+                                   autospec=True) as mocked_datetime:
+                mocked_datetime.now.side_effect = times
+                banjo = banjo_driver.BanjoDriver(
+                    names.FIREFOX,
+                    'http://fakelocalhost:1234/foo',
+                    throughput_sample_interval=0.5)
+
+                result = banjo.perform_test()
+
+        mock_sampler_class.assert_called_once_with(self.mock_driver, mock.ANY,
+                                                   0.5)
+        self.assertEqual(
+            results.ThroughputSeries([(2.0, 1.5), (5.0, 3.25)]),
+            result.s2c_result.throughput_samples)
+        self.assertEqual(
+            results.ThroughputSeries([(2.0, 2.0)]),
+            result.c2s_result.throughput_samples)
+        self.assertErrorMessagesEqual([], result.errors)
+
+    def test_driver_records_span_for_each_step(self):
+        result = self.banjo.perform_test()
+
+        self.assertListEqual(
+            ['open_browser', 'get_browser_version', 'load_url',
+             'click_run_test_button', 'wait_for_s2c_start', 'wait_for_s2c_end',
+             'wait_for_c2s_start', 'wait_for_c2s_end', 'parse_results_page',
+             'close_browser'], [span.name for span in result.spans])
+        for span in result.spans:
+            self.assertLessEqual(span.start_time, span.end_time)
+
+    def test_driver_does_not_sample_throughput_by_default(self):
+        with mock.patch.object(browser_client_common,
+                               'TextSampler') as mock_sampler_class:
+            result = self.banjo.perform_test()
+
+        self.assertFalse(mock_sampler_class.called)
+        self.assertIsNone(result.s2c_result.throughput_samples)
+        self.assertIsNone(result.c2s_result.throughput_samples)
+
     def test_errors_occur_when_results_page_displays_blank_latency(self):
         self.mock_elements_by_xpath[
             '//div[@id="lrfactory-internetspeed__latency"]/*[2]'] = mock.Mock(
@@ -12,13 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from __future__ import absolute_import
+import contextlib
+import datetime
 import unittest
 
 import mock
+import pytz
 from selenium.common import exceptions
+from selenium.webdriver.common import by
 
 from client_wrapper import browser_client_common
 from client_wrapper import names
+from client_wrapper import results
 from tests import ndt_client_testcase
 
 
@@ -89,12 +94,271 @@ class CreateBrowserTest(unittest.TestCase):
 
         self.assertTrue(mock_browser_driver.quit.called)
 
+    @mock.patch.object(browser_client_common.firefox_binary, 'FirefoxBinary')
+    @mock.patch.object(browser_client_common.webdriver, 'Firefox')
+    def test_create_headless_firefox_browser_passes_headless_flag(
+            self, mock_firefox, mock_firefox_binary):
+        with browser_client_common.create_browser(names.FIREFOX, headless=True):
+            pass
+
+        mock_firefox_binary.return_value.add_command_line_options.assert_called_once_with(
+            '-headless')
+        mock_firefox.assert_called_once_with(
+            firefox_binary=mock_firefox_binary.return_value)
+
+    @mock.patch.object(browser_client_common.webdriver, 'Chrome')
+    def test_create_headless_chrome_browser_passes_headless_flag(self,
+                                                                 mock_chrome):
+        with browser_client_common.create_browser(names.CHROME, headless=True):
+            pass
+
+        chrome_options = mock_chrome.call_args[1]['chrome_options']
+        self.assertIn('--headless', chrome_options.arguments)
+
+    @mock.patch.object(browser_client_common.webdriver, 'Edge')
+    def test_create_headless_edge_browser_raises_error(self, mock_edge):
+        with self.assertRaises(ValueError):
+            with browser_client_common.create_browser(names.EDGE,
+                                                      headless=True):
+                pass
+        self.assertFalse(mock_edge.called)
+
     def test_create_unrecognized_browser_raises_error(self):
         with self.assertRaises(ValueError):
             with browser_client_common.create_browser('foo'):
                 pass
 
 
+class BrowserSessionTest(unittest.TestCase):
+    """Tests for the BrowserSession class."""
+
+    def setUp(self):
+        self.mock_drivers = []
+
+        @contextlib.contextmanager
+        def mock_create_browser(browser, headless=False):
+            self.assertEqual(names.FIREFOX, browser)
+            mock_driver = mock.Mock()
+            mock_driver.window_handles = ['mock window handle']
+            self.mock_drivers.append(mock_driver)
+            yield mock_driver
+            mock_driver.quit()
+
+        create_browser_patcher = mock.patch.object(
+            browser_client_common,
+            'create_browser',
+            side_effect=mock_create_browser)
+        self.addCleanup(create_browser_patcher.stop)
+        create_browser_patcher.start()
+
+        self.session = browser_client_common.BrowserSession(names.FIREFOX)
+
+    def test_session_reuses_browser_and_resets_state_between_tests(self):
+        with self.session.use_browser() as driver:
+            first_driver = driver
+        with self.session.use_browser() as driver:
+            second_driver = driver
+
+        self.assertEqual(1, len(self.mock_drivers))
+        self.assertIs(first_driver, second_driver)
+        self.assertFalse(first_driver.quit.called)
+        first_driver.delete_all_cookies.assert_called_once_with()
+        first_driver.get.assert_called_once_with('about:blank')
+
+    def test_session_closes_extra_windows_between_tests(self):
+        with self.session.use_browser() as driver:
+            driver.window_handles = ['window 1', 'window 2', 'window 3']
+        with self.session.use_browser() as driver:
+            self.assertEqual(2, driver.close.call_count)
+            driver.switch_to.window.assert_called_with('window 1')
+
+    def test_session_relaunches_browser_when_it_stops_responding(self):
+        with self.session.use_browser() as driver:
+            driver.delete_all_cookies.side_effect = (
+                exceptions.WebDriverException('mock session died'))
+            driver.quit.side_effect = IOError('mock connection refused')
+        with self.session.use_browser() as driver:
+            relaunched_driver = driver
+
+        self.assertEqual(2, len(self.mock_drivers))
+        self.assertIs(self.mock_drivers[1], relaunched_driver)
+        self.assertTrue(self.mock_drivers[0].quit.called)
+
+    def test_session_launches_headless_browser_when_requested(self):
+        session = browser_client_common.BrowserSession(names.FIREFOX,
+                                                       headless=True)
+        with session.use_browser():
+            pass
+
+        browser_client_common.create_browser.assert_called_once_with(
+            names.FIREFOX, True)
+
+    def test_close_quits_browser(self):
+        with self.session.use_browser():
+            pass
+        self.session.close()
+
+        self.assertTrue(self.mock_drivers[0].quit.called)
+
+    def test_close_does_nothing_when_browser_never_launched(self):
+        self.session.close()
+
+        self.assertListEqual([], self.mock_drivers)
+
+
+class PhaseObserverTest(unittest.TestCase):
+    """Tests for the PhaseObserver class."""
+
+    def setUp(self):
+        self.mock_driver = mock.Mock()
+        self.phase = browser_client_common.Phase('mock_phase', '//div', 'foo')
+        self.observer = browser_client_common.PhaseObserver(self.mock_driver,
+                                                            [self.phase])
+
+    def test_install_injects_phases_into_page(self):
+        self.assertTrue(self.observer.install())
+
+        script, phases = self.mock_driver.execute_script.call_args[0]
+        self.assertIn('MutationObserver', script)
+        self.assertListEqual([['mock_phase', '//div', 'foo']], phases)
+
+    def test_install_returns_false_when_script_fails(self):
+        self.mock_driver.execute_script.side_effect = (
+            exceptions.WebDriverException('mock script error'))
+
+        self.assertFalse(self.observer.install())
+
+    def test_wait_for_phase_returns_time_recorded_in_page(self):
+        self.mock_driver.execute_async_script.return_value = 1451606400123.5
+
+        start_time = self.observer.wait_for_phase(self.phase, 8)
+
+        self.assertEqual(
+            datetime.datetime(2016, 1, 1, 0, 0, 0, 123500, pytz.utc),
+            start_time)
+        self.assertEqual('mock_phase',
+                         self.mock_driver.execute_async_script.call_args[0][1])
+
+    def test_wait_for_phase_restores_script_timeout(self):
+        self.mock_driver.execute_async_script.return_value = 1451606400123.5
+
+        self.observer.wait_for_phase(self.phase, 8)
+
+        self.assertListEqual(
+            [mock.call(8),
+             mock.call(browser_client_common.DEFAULT_SCRIPT_TIMEOUT)],
+            self.mock_driver.set_script_timeout.call_args_list)
+
+    def test_wait_for_phase_restores_script_timeout_when_wait_times_out(self):
+        observer = browser_client_common.PhaseObserver(self.mock_driver,
+                                                       [self.phase],
+                                                       script_timeout=5)
+        self.mock_driver.execute_async_script.side_effect = (
+            exceptions.TimeoutException('mock timeout'))
+
+        observer.wait_for_phase(self.phase, 8)
+
+        self.assertListEqual([mock.call(8), mock.call(5)],
+                             self.mock_driver.set_script_timeout.call_args_list)
+
+    def test_wait_for_phase_returns_None_when_wait_times_out(self):
+        self.mock_driver.execute_async_script.side_effect = (
+            exceptions.TimeoutException('mock timeout'))
+
+        self.assertIsNone(self.observer.wait_for_phase(self.phase, 8))
+
+    def test_wait_for_phase_returns_None_when_observer_is_missing(self):
+        self.mock_driver.execute_async_script.return_value = None
+
+        self.assertIsNone(self.observer.wait_for_phase(self.phase, 8))
+
+
+class BrowserPoolTest(unittest.TestCase):
+    """Tests for the BrowserPool class."""
+
+    def setUp(self):
+        self.mock_drivers = []
+        self.launch_errors = []
+        self.unresponsive_launches = 0
+
+        @contextlib.contextmanager
+        def mock_create_browser(browser, headless=False):
+            self.assertEqual(names.FIREFOX, browser)
+            if self.launch_errors:
+                raise self.launch_errors.pop(0)
+            mock_driver = mock.Mock()
+            if self.unresponsive_launches:
+                self.unresponsive_launches -= 1
+                type(mock_driver).window_handles = mock.PropertyMock(
+                    side_effect=exceptions.WebDriverException(
+                        'mock browser died'))
+            self.mock_drivers.append(mock_driver)
+            yield mock_driver
+            mock_driver.quit()
+
+        create_browser_patcher = mock.patch.object(
+            browser_client_common,
+            'create_browser',
+            side_effect=mock_create_browser)
+        self.addCleanup(create_browser_patcher.stop)
+        create_browser_patcher.start()
+
+    def test_pool_replaces_each_browser_after_its_test(self):
+        pool = browser_client_common.BrowserPool(names.FIREFOX, 2)
+        pool.start()
+        with pool.use_browser() as driver:
+            first_driver = driver
+            self.assertFalse(first_driver.quit.called)
+        with pool.use_browser() as driver:
+            second_driver = driver
+        pool.close()
+
+        self.assertIsNot(first_driver, second_driver)
+        # Two browsers launched up front, plus one replacement per test.
+        self.assertEqual(4, len(self.mock_drivers))
+        for mock_driver in self.mock_drivers:
+            self.assertTrue(mock_driver.quit.called)
+
+    def test_pool_skips_browsers_that_stopped_responding(self):
+        self.unresponsive_launches = 1
+        pool = browser_client_common.BrowserPool(names.FIREFOX, 1)
+        pool.start()
+
+        with pool.use_browser() as driver:
+            self.assertIs(self.mock_drivers[1], driver)
+        pool.close()
+
+        self.assertTrue(self.mock_drivers[0].quit.called)
+
+    def test_pool_raises_launch_error_and_launches_replacement(self):
+        self.launch_errors.append(exceptions.WebDriverException(
+            'mock launch error'))
+        pool = browser_client_common.BrowserPool(names.FIREFOX, 1)
+        pool.start()
+
+        with self.assertRaises(exceptions.WebDriverException):
+            with pool.use_browser():
+                pass
+        with pool.use_browser() as driver:
+            self.assertIs(self.mock_drivers[0], driver)
+        pool.close()
+
+    def test_pool_closes_after_a_launch_fails(self):
+        self.launch_errors.append(exceptions.WebDriverException(
+            'mock launch error'))
+        pool = browser_client_common.BrowserPool(names.FIREFOX, 2)
+        pool.start()
+
+        pool.close()
+
+        self.assertEqual(1, len(self.mock_drivers))
+        self.assertTrue(self.mock_drivers[0].quit.called)
+
+    def test_pool_rejects_non_positive_size(self):
+        with self.assertRaises(ValueError):
+            browser_client_common.BrowserPool(names.FIREFOX, 0)
+
+
 class GetBrowserVersionTest(unittest.TestCase):
 
     def test_get_version_returns_successfully_when_driver_has_standard_version(
@@ -123,6 +387,101 @@ class GetBrowserVersionTest(unittest.TestCase):
             browser_client_common.get_browser_version(mock_driver)
 
 
+class RecordSpanTest(unittest.TestCase):
+
+    def setUp(self):
+        # Create the mock times before patching datetime.
+        self.times = [datetime.datetime(2016, 1, 1, 0, 0, i, 0, pytz.utc)
+                      for i in range(4)]
+        datetime_patcher = mock.patch.object(browser_client_common.datetime,
+                                             'datetime',
+                                             autospec=True)
+        self.addCleanup(datetime_patcher.stop)
+        datetime_patcher.start()
+        browser_client_common.datetime.datetime.now.side_effect = self.times
+
+    def test_records_spans_in_the_order_they_start(self):
+        result = results.NdtResult()
+
+        with browser_client_common.record_span(result, 'outer'):
+            with browser_client_common.record_span(result, 'inner'):
+                pass
+
+        self.assertListEqual(
+            [results.Span('outer', self.times[0], self.times[3]),
+             results.Span('inner', self.times[1], self.times[2])], result.spans)
+
+    def test_finishes_span_when_block_raises_exception(self):
+        result = results.NdtResult()
+
+        with self.assertRaises(ValueError):
+            with browser_client_common.record_span(result, 'load_url'):
+                raise ValueError('mock error')
+
+        self.assertListEqual(
+            [results.Span('load_url', self.times[0], self.times[1])],
+            result.spans)
+
+
+class RecordBrowserSpansTest(unittest.TestCase):
+
+    def setUp(self):
+        # Create the mock times before patching datetime.
+        self.times = [datetime.datetime(2016, 1, 1, 0, 0, i, 0, pytz.utc)
+                      for i in range(4)]
+        datetime_patcher = mock.patch.object(browser_client_common.datetime,
+                                             'datetime',
+                                             autospec=True)
+        self.addCleanup(datetime_patcher.stop)
+        datetime_patcher.start()
+        browser_client_common.datetime.datetime.now.side_effect = self.times
+        self.mock_driver = mock.Mock()
+        self.mock_browser = mock.MagicMock()
+        self.mock_browser.__enter__.return_value = self.mock_driver
+        self.mock_browser.__exit__.return_value = False
+
+    def test_records_opening_and_closing_browser(self):
+        result = results.NdtResult()
+
+        with browser_client_common.record_browser_spans(
+                result, self.mock_browser) as driver:
+            self.assertIs(self.mock_driver, driver)
+
+        self.mock_browser.__exit__.assert_called_once_with(None, None, None)
+        self.assertListEqual(
+            [results.Span('open_browser', self.times[0], self.times[1]),
+             results.Span('close_browser', self.times[2], self.times[3])],
+            result.spans)
+
+    def test_finishes_span_when_browser_fails_to_open(self):
+        self.mock_browser.__enter__.side_effect = ValueError('mock error')
+        result = results.NdtResult()
+
+        with self.assertRaises(ValueError):
+            with browser_client_common.record_browser_spans(result,
+                                                            self.mock_browser):
+                self.fail('block should not run')
+
+        self.assertFalse(self.mock_browser.__exit__.called)
+        self.assertListEqual(
+            [results.Span('open_browser', self.times[0], self.times[1])],
+            result.spans)
+
+    def test_closes_browser_when_block_raises_exception(self):
+        result = results.NdtResult()
+
+        with self.assertRaises(ValueError):
+            with browser_client_common.record_browser_spans(result,
+                                                            self.mock_browser):
+                raise ValueError('mock error')
+
+        self.assertIs(ValueError, self.mock_browser.__exit__.call_args[0][0])
+        self.assertListEqual(
+            [results.Span('open_browser', self.times[0], self.times[1]),
+             results.Span('close_browser', self.times[2], self.times[3])],
+            result.spans)
+
+
 class LoadUrlTest(ndt_client_testcase.NdtClientTestCase):
     """Tests for load_url function."""
 
@@ -203,6 +562,118 @@ class WaitUntilElementIsVisibleTest(unittest.TestCase):
             mock_driver, mock_element, 20))
 
 
+class GetElementTextsTest(unittest.TestCase):
+    """Tests for get_element_texts function."""
+
+    def setUp(self):
+        self.mock_driver = mock.Mock()
+        self.locators = {
+            'foo': (by.By.ID, 'foo-id'),
+            'bar': (by.By.XPATH, '//div[@id="bar-id"]/*[1]'),
+        }
+
+    def test_get_element_texts_reads_all_elements_in_one_call(self):
+        self.mock_driver.execute_script.return_value = {
+            'foo': '1.23',
+            'bar': None,
+        }
+
+        texts = browser_client_common.get_element_texts(self.mock_driver,
+                                                        self.locators)
+
+        self.assertDictEqual({'foo': '1.23', 'bar': None}, texts)
+        self.mock_driver.execute_script.assert_called_once_with(
+            mock.ANY, {'foo': ['id', 'foo-id'],
+                       'bar': ['xpath', '//div[@id="bar-id"]/*[1]']})
+
+    def test_get_element_texts_returns_None_for_all_when_script_fails(self):
+        self.mock_driver.execute_script.side_effect = (
+            exceptions.WebDriverException('mock script error'))
+
+        texts = browser_client_common.get_element_texts(self.mock_driver,
+                                                        self.locators)
+
+        self.assertDictEqual({'foo': None, 'bar': None}, texts)
+
+    def test_get_element_texts_rejects_unsupported_locator_strategy(self):
+        with self.assertRaises(ValueError):
+            browser_client_common.get_element_texts(
+                self.mock_driver, {'foo': (by.By.CSS_SELECTOR, '#foo')})
+
+
+class TextSamplerTest(unittest.TestCase):
+    """Tests for the TextSampler class."""
+
+    def setUp(self):
+        self.mock_driver = mock.Mock()
+        self.sampler = browser_client_common.TextSampler(
+            self.mock_driver, {'foo': (by.By.ID, 'foo-id')}, 0.25)
+
+    def test_start_passes_locators_and_interval_to_page(self):
+        self.assertTrue(self.sampler.start())
+
+        _, locators, interval_ms = self.mock_driver.execute_script.call_args[0]
+        self.assertDictEqual({'foo': ['id', 'foo-id']}, locators)
+        self.assertEqual(250, interval_ms)
+
+    def test_start_returns_false_when_script_fails(self):
+        self.mock_driver.execute_script.side_effect = (
+            exceptions.WebDriverException('mock script error'))
+
+        self.assertFalse(self.sampler.start())
+
+    def test_stop_returns_samples_recorded_in_page(self):
+        self.mock_driver.execute_script.return_value = [
+            [1451606400000.0, {'foo': '1.5'}],
+            [1451606400250.0, {'foo': None}],
+        ]
+
+        samples = self.sampler.stop()
+
+        self.assertListEqual(
+            [(datetime.datetime(2016, 1, 1, tzinfo=pytz.utc), {'foo': '1.5'}),
+             (datetime.datetime(2016, 1, 1, 0, 0, 0, 250000, pytz.utc),
+              {'foo': None})],
+            samples)
+
+    def test_stop_returns_empty_list_when_sampler_is_not_running(self):
+        self.mock_driver.execute_script.return_value = None
+
+        self.assertListEqual([], self.sampler.stop())
+
+
+class CreateThroughputSeriesTest(unittest.TestCase):
+    """Tests for create_throughput_series function."""
+
+    def test_series_contains_valid_samples_taken_during_test(self):
+
+        def time_at(seconds):
+            return datetime.datetime(2016, 1, 1, tzinfo=pytz.utc) + (
+                datetime.timedelta(seconds=seconds))
+
+        test_result = results.NdtSingleTestResult(start_time=time_at(1),
+                                                  end_time=time_at(3))
+        samples = [(time_at(0), {'foo': '1.0'}), (time_at(1.5), {'foo': '2.0'}),
+                   (time_at(2), {'foo': ''}), (time_at(3), {'foo': '4.0'}),
+                   (time_at(4), {'foo': '5.0'})]
+
+        def parse_throughput(texts):
+            return float(texts['foo']) if texts['foo'] else None
+
+        series = browser_client_common.create_throughput_series(
+            samples, test_result, parse_throughput)
+
+        self.assertEqual(
+            results.ThroughputSeries([(0.5, 2.0), (2.0, 4.0)]), series)
+
+    def test_series_is_None_when_test_never_ended(self):
+        test_result = results.NdtSingleTestResult(
+            start_time=datetime.datetime(2016, 1, 1, tzinfo=pytz.utc))
+
+        self.assertIsNone(browser_client_common.create_throughput_series(
+            [], test_result, lambda texts: None))
+
+
 class GetElementContainingTextTest(unittest.TestCase):
     """Tests for get_element_containing_text function."""
 
@@ -0,0 +1,197 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+import argparse
+import datetime
+import json
+import os
+import Queue
+import shutil
+import tempfile
+import unittest
+
+import mock
+import pytz
+
+from client_wrapper import client_wrapper
+from client_wrapper import http_server
+from client_wrapper import names
+from client_wrapper import result_stats
+from client_wrapper import results
+
+
+def _create_worker_stats(client, s2c_throughput):
+    start_time = datetime.datetime(2016, 1, 1, 0, 0, 0, 0, pytz.utc)
+    stats = result_stats.ResultStats()
+    stats.add(results.NdtResult(start_time=start_time,
+                                end_time=start_time,
+                                client=client,
+                                os='Windows',
+                                browser=names.CHROME,
+                                s2c_result=results.NdtSingleTestResult(
+                                    throughput=s2c_throughput)))
+    return stats
+
+
+class RunWorkersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.args = argparse.Namespace(workers=3)
+        # Output and exit code of each fake worker process, by worker ID.
+        self.worker_outputs = {}
+        self.worker_exitcodes = {}
+        self.created_processes = []
+
+        process_patcher = mock.patch.object(client_wrapper.multiprocessing,
+                                            'Process',
+                                            side_effect=self._create_process)
+        self.addCleanup(process_patcher.stop)
+        process_patcher.start()
+
+        # Queues between processes are unnecessary when the workers are fake.
+        queue_patcher = mock.patch.object(client_wrapper.multiprocessing,
+                                          'Queue',
+                                          side_effect=Queue.Queue)
+        self.addCleanup(queue_patcher.stop)
+        queue_patcher.start()
+
+    def _create_process(self, target, args):
+        _, worker_id, output_queue = args
+
+        def start():
+            if worker_id in self.worker_outputs:
+                output_queue.put(self.worker_outputs[worker_id])
+
+        process = mock.Mock()
+        process.target = target
+        process.args = args
+        process.start.side_effect = start
+        process.is_alive.return_value = False
+        process.exitcode = self.worker_exitcodes.get(worker_id, 0)
+        self.created_processes.append(process)
+        return process
+
+    def test_starts_a_process_for_each_worker(self):
+        client_wrapper._run_workers(self.args)
+
+        self.assertEqual(3, len(self.created_processes))
+        for worker_id, process in enumerate(self.created_processes):
+            self.assertEqual(client_wrapper._run_worker_process, process.target)
+            self.assertIs(self.args, process.args[0])
+            self.assertEqual(worker_id, process.args[1])
+            process.start.assert_called_once_with()
+            process.join.assert_called_once_with()
+
+    def test_merges_output_of_every_worker(self):
+        self.worker_outputs = {
+            0: _create_worker_stats(names.NDT_HTML5, 10.0),
+            1: _create_worker_stats(names.NDT_HTML5, 20.0),
+            2: _create_worker_stats(names.BANJO, 30.0),
+        }
+
+        run_stats = client_wrapper._run_workers(self.args)
+
+        html5_throughput = run_stats.get(
+            result_stats.ResultGroup(names.NDT_HTML5, names.CHROME, 'Windows'),
+            's2c_throughput')
+        self.assertEqual(2, html5_throughput.count)
+        self.assertAlmostEqual(15.0, html5_throughput.mean)
+        banjo_throughput = run_stats.get(
+            result_stats.ResultGroup(names.BANJO, names.CHROME, 'Windows'),
+            's2c_throughput')
+        self.assertEqual(1, banjo_throughput.count)
+
+    def test_raises_error_listing_workers_that_failed(self):
+        self.worker_outputs = {1: _create_worker_stats(names.NDT_HTML5, 20.0),}
+        self.worker_exitcodes = {0: 1, 2: -9}
+
+        with self.assertRaises(client_wrapper.WorkerFailedError) as context:
+            client_wrapper._run_workers(self.args)
+
+        self.assertIn('0, 2', str(context.exception))
+        self.assertNotIn('1', str(context.exception))
+        for process in self.created_processes:
+            process.join.assert_called_once_with()
+
+
+class TraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.trace_path = os.path.join(self.temp_dir, 'trace.json')
+        self.args = argparse.Namespace(workers=2, trace=self.trace_path)
+        self.start_time = datetime.datetime(2016, 1, 1, 0, 0, 0, 0, pytz.utc)
+
+    def test_merges_trace_events_of_every_worker(self):
+        for worker_id in range(2):
+            with client_wrapper._open_trace_recorder(
+                    self.args, worker_id) as trace_recorder:
+                trace_recorder.add_event('iteration 1', 'iteration', 'tests',
+                                         self.start_time, self.start_time)
+
+        client_wrapper._write_trace(self.args)
+
+        with open(self.trace_path) as trace_file:
+            trace = json.load(trace_file)
+        self.assertListEqual([1, 2], [e['pid'] for e in trace['traceEvents']
+                                      if e['ph'] == 'X'])
+        # Only the merged trace remains once the workers' events are merged.
+        self.assertListEqual(['trace.json'], os.listdir(self.temp_dir))
+
+    def test_records_nothing_when_tracing_is_disabled(self):
+        self.args.trace = None
+
+        with client_wrapper._open_trace_recorder(self.args,
+                                                 0) as trace_recorder:
+            self.assertIsNone(trace_recorder)
+
+        self.assertListEqual([], os.listdir(self.temp_dir))
+
+
+class CheckArgsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = mock.Mock()
+
+    def test_rejects_keep_alive_without_enough_replay_workers(self):
+        args = argparse.Namespace(
+            replay_keep_alive_timeout=5,
+            replay_workers=http_server.KEEP_ALIVE_MIN_WORKERS - 1)
+
+        client_wrapper._check_args(self.parser, args)
+
+        self.assertEqual(1, self.parser.error.call_count)
+        self.assertIn('--replay_workers', self.parser.error.call_args[0][0])
+
+    def test_accepts_keep_alive_with_enough_replay_workers(self):
+        args = argparse.Namespace(
+            replay_keep_alive_timeout=5,
+            replay_workers=http_server.KEEP_ALIVE_MIN_WORKERS)
+
+        client_wrapper._check_args(self.parser, args)
+
+        self.assertFalse(self.parser.error.called)
+
+    def test_accepts_replay_workers_without_keep_alive(self):
+        args = argparse.Namespace(replay_keep_alive_timeout=None,
+                                  replay_workers=0)
+
+        client_wrapper._check_args(self.parser, args)
+
+        self.assertFalse(self.parser.error.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -76,6 +76,21 @@ class FilenamesTest(unittest.TestCase):
                                 start_time=datetime.datetime(2015, 9, 17, 8, 9,
                                                              49, 0, pytz.utc)))
 
+    def test_creates_distinct_result_filenames_for_each_worker(self):
+        result = results.NdtResult(start_time=datetime.datetime(
+            2016, 2, 26, 15, 54, 23, 0, pytz.utc),
+                                   os='Windows',
+                                   os_version='10',
+                                   client=names.NDT_HTML5,
+                                   browser=names.CHROME,
+                                   browser_version='49.0.2623')
+        self.assertEqual(
+            'win10-chrome49-ndt_js-2016-02-26T155423Z-w0-results.json',
+            filename.create_result_filename(result, worker_id=0))
+        self.assertEqual(
+            'win10-chrome49-ndt_js-2016-02-26T155423Z-w3-results.json',
+            filename.create_result_filename(result, worker_id=3))
+
     def test_creates_correct_result_filename_for_valid_non_browser_tests(self):
         with self.assertRaises(NotImplementedError):
             get_result_filename(os='Ubuntu',
@@ -21,6 +21,7 @@ import pytz
 
 from client_wrapper import browser_client_common
 from client_wrapper import html5_driver
+from client_wrapper import results
 from tests import ndt_client_testcase
 
 
@@ -49,6 +50,17 @@ class NdtHtml5SeleniumDriverTest(ndt_client_testcase.NdtClientTestCase):
         self.mock_driver.find_element_by_id.side_effect = (
             lambda id: self.mock_page_elements[id])
 
+        def mock_get_element_texts(unused_driver, locators):
+            return {name: self.mock_page_elements[id].text
+                    for name, (_, id) in locators.iteritems()}
+
+        get_element_texts_patcher = mock.patch.object(
+            browser_client_common,
+            'get_element_texts',
+            side_effect=mock_get_element_texts)
+        self.addCleanup(get_element_texts_patcher.stop)
+        get_element_texts_patcher.start()
+
         # Create mock DOM elements that are returned by calls to
         # find_elements_containing_text.
         self.mock_elements_by_text = {
@@ -74,6 +86,21 @@ class NdtHtml5SeleniumDriverTest(ndt_client_testcase.NdtClientTestCase):
         self.assertEqual(3.0, result.latency)
         self.assertErrorMessagesEqual([], result.errors)
 
+    def test_test_runs_in_browser_session_when_one_is_provided(self):
+        mock_session = self.create_mock_browser_session()
+        driver = html5_driver.NdtHtml5SeleniumDriver(
+            browser='firefox',
+            url='http://ndt.mock-server.com:7123/',
+            browser_session=mock_session)
+
+        driver.perform_test()
+        result = driver.perform_test()
+
+        self.assertEqual(2, mock_session.use_browser.call_count)
+        self.assertFalse(browser_client_common.create_browser.called)
+        self.assertEqual(1.0, result.c2s_result.throughput)
+        self.assertErrorMessagesEqual([], result.errors)
+
     def test_fails_gracefully_when_start_button_not_in_dom(self):
         self.mock_elements_by_text['Start Test'] = None
 
@@ -204,6 +231,68 @@ class NdtHtml5SeleniumDriverTest(ndt_client_testcase.NdtClientTestCase):
              'illegal value shown for latency: Non-numeric value'],
             result.errors)
 
+    def test_results_page_reads_all_metrics_in_one_call(self):
+        html5_driver.NdtHtml5SeleniumDriver(
+            browser='firefox',
+            url='http://ndt.mock-server.com:7123/').perform_test()
+
+        browser_client_common.get_element_texts.assert_called_once_with(
+            self.mock_driver, mock.ANY)
+
+    def test_results_page_missing_latency_field_yields_error(self):
+        self.mock_page_elements['latency'] = mock.Mock(text=None)
+
+        result = html5_driver.NdtHtml5SeleniumDriver(
+            browser='firefox',
+            url='http://ndt.mock-server.com:7123/').perform_test()
+
+        self.assertIsNone(result.latency)
+        self.assertEqual(1.0, result.c2s_result.throughput)
+        self.assertErrorMessagesEqual(['illegal value shown for latency: None'],
+                                      result.errors)
+
+    def test_results_record_sampled_throughput_converted_to_mbps(self):
+        self.mock_driver.execute_async_script.side_effect = (
+            lambda unused_script, phase_name: {
+                'c2s_start': 1451606401000.0,
+                's2c_start': 1451606411000.0,
+                'results': 1451606421000.0,
+            }[phase_name])
+
+        def sample(seconds, c2s, c2s_units, s2c, s2c_units):
+            return (datetime.datetime(2016,
+                                      1,
+                                      1,
+                                      0,
+                                      0,
+                                      seconds,
+                                      tzinfo=pytz.utc),
+                    {'c2s_throughput': c2s,
+                     'c2s_throughput_units': c2s_units,
+                     's2c_throughput': s2c,
+                     's2c_throughput_units': s2c_units})
+
+        with mock.patch.object(browser_client_common,
+                               'TextSampler') as mock_sampler_class:
+            mock_sampler_class.return_value.stop.return_value = [
+                sample(2, '500', 'kb/s', '', ''),
+                sample(6, '1.5', 'Mb/s', '', ''),
+                sample(16, '1.5', 'Mb/s', '2', 'Gb/s'),
+            ]
+            result = html5_driver.NdtHtml5SeleniumDriver(
+                browser='firefox',
+                url='http://ndt.mock-server.com:7123/',
+                observe_phases=True,
+                throughput_sample_interval=0.5).perform_test()
+
+        self.assertEqual(
+            results.ThroughputSeries([(1.0, 0.5), (5.0, 1.5)]),
+            result.c2s_result.throughput_samples)
+        self.assertEqual(
+            results.ThroughputSeries([(5.0, 2000.0)]),
+            result.s2c_result.throughput_samples)
+        self.assertErrorMessagesEqual([], result.errors)
+
     def test_s2c_gbps_speed_conversion(self):
         """Test s2c speed converts from Gb/s to Mb/s correctly."""
         # If s2c speed is 72 Gb/s and c2s is speed is 34 in the browser
@@ -260,6 +349,8 @@ class NdtHtml5SeleniumDriverTest(ndt_client_testcase.NdtClientTestCase):
         for i in range(11):
             times.append(datetime.datetime(2016, 1, 1, 0, 0, i))
 
+        # Timing spans also read the clock, so keep them out of the sequence.
+        self.patch_span_recording()
         with mock.patch.object(html5_driver.datetime,
                                'datetime',
                                autospec=True) as mocked_datetime:
@@ -270,7 +361,7 @@ class NdtHtml5SeleniumDriverTest(ndt_client_testcase.NdtClientTestCase):
             # Modify the create_browser mock to increment the clock forward one
             # call.
             @contextlib.contextmanager
-            def mock_create_browser(unused_browser_name):
+            def mock_create_browser(unused_browser_name, unused_headless=False):
                 datetime.datetime.now(pytz.utc)
                 yield self.mock_driver
 
@@ -305,6 +396,55 @@ class NdtHtml5SeleniumDriverTest(ndt_client_testcase.NdtClientTestCase):
         self.assertEqual(times[9], result.s2c_result.end_time)
         self.assertEqual(times[10], result.end_time)
 
+    def test_ndt_result_records_span_for_each_step(self):
+        result = html5_driver.NdtHtml5SeleniumDriver(
+            browser='firefox',
+            url='http://ndt.mock-server.com:7123/').perform_test()
+
+        self.assertListEqual(['open_browser', 'get_browser_version', 'load_url',
+                              'click_websocket_button', 'click_start_button',
+                              'wait_for_c2s_start', 'wait_for_s2c_start',
+                              'wait_for_results', 'parse_results_page',
+                              'close_browser'],
+                             [span.name for span in result.spans])
+        for span in result.spans:
+            self.assertLessEqual(span.start_time, span.end_time)
+
+    def test_ndt_result_records_times_from_phase_observer(self):
+        # Milliseconds since the epoch at which each phase began in the page.
+        phase_times = {
+            'c2s_start': 1451606401000.0,
+            's2c_start': 1451606411250.0,
+            'results': 1451606421500.0,
+        }
+        self.mock_driver.execute_async_script.side_effect = (
+            lambda unused_script, phase_name: phase_times[phase_name])
+
+        result = html5_driver.NdtHtml5SeleniumDriver(
+            browser='firefox',
+            url='http://ndt.mock-server.com:7123/',
+            observe_phases=True).perform_test()
+
+        self.assertEqual(
+            datetime.datetime(2016, 1, 1, 0,
+                              0, 1, tzinfo=pytz.utc),
+            result.c2s_result.start_time)
+        self.assertEqual(
+            datetime.datetime(2016, 1, 1, 0, 0, 11, 250000, pytz.utc),
+            result.c2s_result.end_time)
+        self.assertEqual(
+            datetime.datetime(2016, 1, 1, 0, 0, 11, 250000, pytz.utc),
+            result.s2c_result.start_time)
+        self.assertEqual(
+            datetime.datetime(2016, 1, 1, 0, 0, 21, 500000, pytz.utc),
+            result.s2c_result.end_time)
+        # Only the "Start Test" button is polled for visibility.
+        self.assertEqual(
+            1, html5_driver.browser_client_common.wait_until_element_is_visible.
+            call_count)
+        self.assertEqual(1.0, result.c2s_result.throughput)
+        self.assertErrorMessagesEqual([], result.errors)
+
 
 if __name__ == '__main__':
     unittest.main()
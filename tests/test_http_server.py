@@ -13,13 +13,24 @@
 # limitations under the License.
 from __future__ import absolute_import
 import contextlib
+import datetime
+import email.utils
+import httplib
 import json
+import mmap
 import socket
+import StringIO
+import threading
+import time
 import unittest
 import urllib2
 
+import mock
+
 from client_wrapper import http_response
 from client_wrapper import http_server
+from client_wrapper import replay_cache
+from client_wrapper import trace_events
 
 
 class ReplayHTTPServerTest(unittest.TestCase):
@@ -40,6 +51,51 @@ class ReplayHTTPServerTest(unittest.TestCase):
                                  parse_headers(response.info().items()))
             self.assertEqual(response_data, response.read())
 
+    def test_server_replays_non_200_response_code(self):
+        stored_response = http_response.HttpResponse(204, {}, '')
+        with contextlib.closing(http_server.create_replay_server_manager(
+            {'/foo': stored_response}, 'ndt.mock-lab.org')) as server_manager:
+            server_manager.start()
+
+            response = urllib2.urlopen('http://localhost:%d/foo' %
+                                       server_manager.port)
+            self.assertEqual(204, response.getcode())
+
+    def test_server_serializes_replays_ahead_of_requests(self):
+        stored_response = http_response.HttpResponse(200, {'Mock-Header': 'OK'},
+                                                     'mock response')
+        replay_server = http_server.ReplayHTTPServer({'/foo': stored_response},
+                                                     'ndt.mock-lab.org')
+        self.addCleanup(replay_server.server_close)
+
+        status_line, chunks = replay_server.serialized_replays['/foo']
+        head, body = ''.join(chunks).split('\r\n\r\n', 1)
+        head_lines = head.split('\r\n')
+        self.assertEqual('HTTP/1.0 200 OK', status_line)
+        self.assertIn('Mock-Header: OK', head_lines)
+        self.assertIn('content-length: 13', head_lines)
+        self.assertEqual('mock response', body)
+
+    def test_server_replays_memory_mapped_bodies(self):
+        mapping = mmap.mmap(-1, 64)
+        mapping.write('mapped response<a href="http://127.0.0.1/foo">')
+        replays = {
+            '/plain': http_response.HttpResponse(
+                200, {}, replay_cache.MappedBody(mapping, 0, 15)),
+            '/link': http_response.HttpResponse(
+                200, {}, replay_cache.MappedBody(mapping, 15, 31)),
+        }
+        with contextlib.closing(http_server.create_replay_server_manager(
+                replays, 'ndt.mock-lab.org')) as server_manager:
+            server_manager.start()
+
+            server_url = 'http://localhost:%d' % server_manager.port
+            response = urllib2.urlopen('%s/plain' % server_url)
+            self.assertEqual('15', response.info()['content-length'])
+            self.assertEqual('mapped response', response.read())
+            response = urllib2.urlopen('%s/link' % server_url)
+            self.assertEqual('<a href="%s/foo">' % server_url, response.read())
+
     def test_server_rewrites_localhost_ips_in_responses(self):
         stored_response = http_response.HttpResponse(
             200, {}, '<a href="http://127.0.0.1/foo>Click here for foo</a>')
@@ -79,11 +135,273 @@ class ReplayHTTPServerTest(unittest.TestCase):
             url = 'http://localhost:%d/foo' % server_manager.port
             response = urllib2.urlopen(url)
             self.assertEqual(200, response.getcode())
-        # Attempting to query the same URL should time out because the child
-        # server should be shut down.
-        with self.assertRaises(socket.timeout):
+        # Attempting to query the same URL should fail because the child
+        # server should be shut down and its socket closed.
+        with self.assertRaises(urllib2.URLError):
             urllib2.urlopen(url, timeout=0.025).getcode()
 
+    def test_server_records_each_request_on_trace_recorder(self):
+        events_file = StringIO.StringIO()
+        recorder = trace_events.TraceRecorder(1, 'mock worker', events_file)
+        stored_response = http_response.HttpResponse(200, {}, 'mock response')
+        with contextlib.closing(http_server.create_replay_server_manager(
+            {'/foo': stored_response},
+                'ndt.mock-lab.org',
+                trace_recorder=recorder)) as server_manager:
+            server_manager.start()
+            urllib2.urlopen('http://localhost:%d/foo' %
+                            server_manager.port).read()
+
+        # Closing the manager waits for the request in progress to finish.
+        events_file.seek(0)
+        self.assertListEqual([('GET /foo', 200)],
+                             [(e['name'], e['args']['status'])
+                              for e in trace_events.read_events(events_file)
+                              if e['ph'] == 'X'])
+
+    def test_thread_pool_server_replays_response_accurately(self):
+        stored_response = http_response.HttpResponse(200, {}, 'mock response')
+        with contextlib.closing(http_server.create_replay_server_manager(
+            {'/foo': stored_response},
+                'ndt.mock-lab.org',
+                worker_count=4)) as server_manager:
+            server_manager.start()
+
+            response = urllib2.urlopen('http://localhost:%d/foo' %
+                                       server_manager.port)
+            self.assertEqual(200, response.getcode())
+            self.assertEqual('mock response', response.read())
+
+    def test_server_manager_stops_thread_pool_on_close(self):
+        thread_count = threading.active_count()
+        server_manager = http_server.create_replay_server_manager(
+            {}, 'ndt.mock-lab.org', worker_count=4)
+        server_manager.start()
+        self.assertGreater(threading.active_count(), thread_count)
+
+        server_manager.close()
+
+        self.assertEqual(thread_count, threading.active_count())
+        with self.assertRaises(socket.error):
+            socket.create_connection(('localhost', server_manager.port), 1)
+
+    def test_thread_pool_server_serves_parallel_fetches_faster(self):
+        """A pooled server should not serialize parallel page resource loads."""
+        paths = ['/resource%d' % i for i in range(6)]
+        replays = {path: http_response.HttpResponse(200, {}, 'mock response')
+                   for path in paths}
+        serial_duration = _measure_parallel_fetch_duration(replays,
+                                                           paths,
+                                                           worker_count=0)
+        pooled_duration = _measure_parallel_fetch_duration(replays,
+                                                           paths,
+                                                           worker_count=6)
+        # Each response takes 0.1s to serve, so serial serving takes at least
+        # 0.6s while pooled serving should take roughly 0.1s.
+        self.assertGreaterEqual(serial_duration, 0.6)
+        self.assertLess(pooled_duration, serial_duration / 2)
+
+
+class KeepAliveReplayHTTPServerTest(unittest.TestCase):
+
+    def setUp(self):
+        replays = {
+            '/foo': http_response.HttpResponse(200, {'connection': 'close'},
+                                               'foo response'),
+            '/bar': http_response.HttpResponse(200, {}, 'bar response'),
+        }
+        server_manager = http_server.create_replay_server_manager(
+            replays,
+            'ndt.mock-lab.org',
+            worker_count=http_server.KEEP_ALIVE_MIN_WORKERS,
+            keep_alive_timeout=0.1)
+        self.addCleanup(server_manager.close)
+        server_manager.start()
+        self.connection = httplib.HTTPConnection('localhost',
+                                                 server_manager.port)
+        self.addCleanup(self.connection.close)
+
+    def test_server_reuses_connection_across_requests(self):
+        self.connection.request('GET', '/foo')
+        foo_response = self.connection.getresponse()
+        self.assertEqual(11, foo_response.version)
+        self.assertEqual('foo response', foo_response.read())
+        # The replayed "Connection: close" header should not be passed on.
+        self.assertFalse(foo_response.will_close)
+        # Responses are serialized ahead of time, but each should still carry
+        # the date it was sent.
+        self.assertIsNotNone(email.utils.parsedate(foo_response.getheader(
+            'date')))
+        connection_socket = self.connection.sock
+
+        self.connection.request('GET', '/bar')
+        bar_response = self.connection.getresponse()
+        self.assertEqual('bar response', bar_response.read())
+        self.assertIs(connection_socket, self.connection.sock)
+
+    def test_server_closes_idle_connection_after_timeout(self):
+        self.connection.request('GET', '/foo')
+        self.connection.getresponse().read()
+        self.connection.sock.settimeout(1)
+
+        # The server should close the connection once it is idle for longer
+        # than the keep-alive timeout, so the client reads end-of-stream.
+        self.assertEqual('', self.connection.sock.recv(1))
+
+    def test_keep_alive_requires_worker_threads(self):
+        with self.assertRaises(ValueError):
+            http_server.create_replay_server_manager({},
+                                                     'ndt.mock-lab.org',
+                                                     keep_alive_timeout=5)
+
+    def test_keep_alive_requires_minimum_worker_count(self):
+        with self.assertRaises(ValueError):
+            http_server.create_replay_server_manager(
+                {},
+                'ndt.mock-lab.org',
+                worker_count=http_server.KEEP_ALIVE_MIN_WORKERS - 1,
+                keep_alive_timeout=5)
+
+
+class ReplayMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = http_server.ReplayMetrics()
+
+    def test_groups_requests_by_path_and_status(self):
+        self.metrics.record('/foo', 200, 0.0005)
+        self.metrics.record('/foo', 200, 0.0035)
+        self.metrics.record('/foo', 304, 0.001)
+        self.metrics.record('/bar', 404, 7.5)
+
+        requests = self.metrics.snapshot()['requests']
+
+        self.assertListEqual([('/bar', 404, 1), ('/foo', 200, 2),
+                              ('/foo', 304, 1)],
+                             [(r['path'], r['status'], r['count'])
+                              for r in requests])
+        self.assertEqual(2.0, requests[1]['mean_ms'])
+        self.assertEqual(3.5, requests[1]['max_ms'])
+        # Latencies of 0.5ms and 3.5ms fall in the <=1ms and <=5ms buckets.
+        self.assertListEqual([[1, 1], [2, 0], [5, 1]],
+                             requests[1]['histogram'][:3])
+        # A latency of 7.5s falls in the overflow bucket.
+        self.assertEqual([None, 1], requests[0]['histogram'][-1])
+
+    def test_snapshot_is_json_serializable(self):
+        self.metrics.record('/foo', 200, 0.01)
+
+        self.assertEqual(self.metrics.snapshot(),
+                         json.loads(json.dumps(self.metrics.snapshot())))
+
+    def test_format_summary_shows_percentile_buckets(self):
+        for _ in range(19):
+            self.metrics.record('/foo', 200, 0.0015)
+        self.metrics.record('/foo', 200, 0.3)
+
+        self.assertEqual('200 /foo n=20 mean=16.4ms max=300.0ms p50<=2ms '
+                         'p95<=2ms', self.metrics.format_summary())
+
+    def test_lists_missing_paths(self):
+        self.metrics.record('/foo', 200, 0.001)
+        self.metrics.record('/missing', 404, 0.001)
+
+        self.assertListEqual(['/missing'], self.metrics.missing_paths())
+        self.assertEqual(0, self.metrics.missing_untracked_count())
+
+    def test_counts_missing_paths_beyond_limit_instead_of_listing_them(self):
+        with mock.patch.object(http_server, '_MAX_METRICS_PATHS', 2):
+            for path in ('/a', '/b', '/c', '/d', '/e'):
+                self.metrics.record(path, 404 if path != '/c' else 200, 0.001)
+
+        self.assertListEqual(['/a', '/b'], self.metrics.missing_paths())
+        self.assertEqual(2, self.metrics.missing_untracked_count())
+
+    def test_counts_paths_beyond_limit_together(self):
+        with mock.patch.object(http_server, '_MAX_METRICS_PATHS', 2):
+            for path in ('/a', '/b', '/c', '/d', '/a'):
+                self.metrics.record(path, 200, 0.001)
+
+        self.assertListEqual([('(other)', 2), ('/a', 2), ('/b', 1)],
+                             [(r['path'], r['count'])
+                              for r in self.metrics.snapshot()['requests']])
+
+
+class ReplayServerMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server_manager = http_server.create_replay_server_manager(
+            {'/foo': http_response.HttpResponse(200, {}, 'foo response')},
+            'ndt.mock-lab.org')
+        self.addCleanup(self.server_manager.close)
+        self.server_manager.start()
+
+    def fetch(self, path):
+        try:
+            return urllib2.urlopen('http://localhost:%d%s' %
+                                   (self.server_manager.port, path)).read()
+        except urllib2.HTTPError as e:
+            return e.code
+
+    def test_server_serves_request_metrics(self):
+        self.fetch('/foo')
+        self.fetch('/foo')
+        self.assertEqual(404, self.fetch('/missing'))
+
+        metrics = json.loads(self.fetch(http_server.METRICS_PATH))
+
+        self.assertListEqual([('/foo', 200, 2), ('/missing', 404, 1)],
+                             [(r['path'], r['status'], r['count'])
+                              for r in metrics['requests']])
+
+    def test_close_logs_missing_replays(self):
+        self.fetch('/foo')
+        self.fetch('/missing')
+
+        with mock.patch.object(http_server, 'logger') as mock_logger:
+            self.server_manager.close()
+
+        mock_logger.warning.assert_called_once_with(
+            'replay server had no stored response for: %s', '/missing')
+        self.assertIn('404 /missing n=1', mock_logger.info.call_args[0][1])
+
+
+def _measure_parallel_fetch_duration(replays, paths, worker_count):
+    """Measures the time to fetch a set of paths in parallel from a server.
+
+    Args:
+        replays: A dictionary of HttpResponse instances, keyed by relative URL.
+        paths: A list of paths to fetch, each on its own thread.
+        worker_count: Number of worker threads in the replay server.
+
+    Returns:
+        Number of seconds it took until all the fetches completed.
+    """
+    original_do_get = http_server._ReplayRequestHandler.do_GET
+
+    def slow_do_get(handler):
+        # Simulate a response that is slow to produce.
+        if handler.path in replays:
+            time.sleep(0.1)
+        original_do_get(handler)
+
+    with mock.patch.object(http_server._ReplayRequestHandler, 'do_GET',
+                           slow_do_get):
+        with contextlib.closing(http_server.create_replay_server_manager(
+                dict(replays), 'ndt.mock-lab.org',
+                worker_count)) as server_manager:
+            server_manager.start()
+            urls = ['http://localhost:%d%s' % (server_manager.port, path)
+                    for path in paths]
+            fetch_threads = [threading.Thread(
+                target=lambda u=url: urllib2.urlopen(u).read()) for url in urls]
+            start_time = datetime.datetime.now()
+            for fetch_thread in fetch_threads:
+                fetch_thread.start()
+            for fetch_thread in fetch_threads:
+                fetch_thread.join()
+            return (datetime.datetime.now() - start_time).total_seconds()
+
 
 def parse_headers(header_items):
     """Parses headers from a list of header two-tuples.
@@ -0,0 +1,191 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+import mmap
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+import yaml
+
+from client_wrapper import http_response
+from client_wrapper import replay_cache
+
+
+class ReplayCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.replay_path = os.path.join(self.temp_dir, 'replay.yaml')
+        self.cache_path = self.replay_path + replay_cache.CACHE_SUFFIX
+        self.replays = {
+            '/foo': http_response.HttpResponse(200, {'Mock-Header': 'OK',
+                                                     'content-length': 12},
+                                               'foo response'),
+            '/bar': http_response.HttpResponse(500, {}, 'bar response'),
+        }
+        self.write_replay_file(self.replays)
+
+    def write_replay_file(self, replays):
+        with open(self.replay_path, 'w') as replay_file:
+            replay_file.write(yaml.dump(replays))
+
+    def test_first_load_parses_yaml_and_creates_cache(self):
+        self.assertEqual(self.replays,
+                         replay_cache.load_replays(self.replay_path))
+        self.assertTrue(os.path.exists(self.cache_path))
+
+    def test_load_with_fresh_cache_does_not_parse_yaml(self):
+        replay_cache.load_replays(self.replay_path)
+
+        with mock.patch.object(http_response, 'parse_yaml') as mock_parse:
+            self.assertEqual(self.replays,
+                             replay_cache.load_replays(self.replay_path))
+            self.assertFalse(mock_parse.called)
+
+    def test_load_with_touched_but_unchanged_yaml_uses_cache(self):
+        replay_cache.load_replays(self.replay_path)
+        replay_stat = os.stat(self.replay_path)
+        os.utime(self.replay_path,
+                 (replay_stat.st_atime, replay_stat.st_mtime + 60))
+
+        with mock.patch.object(http_response, 'parse_yaml') as mock_parse:
+            self.assertEqual(self.replays,
+                             replay_cache.load_replays(self.replay_path))
+            self.assertFalse(mock_parse.called)
+
+    def test_load_with_touched_yaml_updates_cache_to_skip_hashing(self):
+        replay_cache.load_replays(self.replay_path)
+        replay_stat = os.stat(self.replay_path)
+        os.utime(self.replay_path,
+                 (replay_stat.st_atime, replay_stat.st_mtime + 60))
+        replay_cache.load_replays(self.replay_path)
+
+        with mock.patch.object(replay_cache.hashlib, 'sha1') as mock_sha1:
+            self.assertEqual(self.replays,
+                             replay_cache.load_replays(self.replay_path))
+            self.assertFalse(mock_sha1.called)
+
+    def test_load_reparses_yaml_when_it_changes(self):
+        replay_cache.load_replays(self.replay_path)
+        replay_stat = os.stat(self.replay_path)
+        changed_replays = {
+            '/baz': http_response.HttpResponse(200, {}, 'baz response')
+        }
+        self.write_replay_file(changed_replays)
+        # Make sure the modification time differs even on file systems with
+        # coarse timestamps.
+        os.utime(self.replay_path,
+                 (replay_stat.st_atime, replay_stat.st_mtime + 60))
+
+        self.assertEqual(changed_replays,
+                         replay_cache.load_replays(self.replay_path))
+        # The cache should now reflect the changed replays.
+        with mock.patch.object(http_response, 'parse_yaml') as mock_parse:
+            self.assertEqual(changed_replays,
+                             replay_cache.load_replays(self.replay_path))
+            self.assertFalse(mock_parse.called)
+
+    def test_load_ignores_corrupt_cache(self):
+        with open(self.cache_path, 'wb') as cache_file:
+            cache_file.write('corrupt cache contents')
+
+        self.assertEqual(self.replays,
+                         replay_cache.load_replays(self.replay_path))
+
+    def test_load_succeeds_when_cache_cannot_be_written(self):
+        with mock.patch.object(replay_cache.tempfile,
+                               'NamedTemporaryFile',
+                               side_effect=IOError('mock write failure')):
+            self.assertEqual(self.replays,
+                             replay_cache.load_replays(self.replay_path))
+        self.assertFalse(os.path.exists(self.cache_path))
+
+    def test_failed_cache_write_leaves_no_temporary_file(self):
+        with mock.patch.object(replay_cache,
+                               '_replace_file',
+                               side_effect=OSError('mock rename failure')):
+            self.assertEqual(self.replays,
+                             replay_cache.load_replays(self.replay_path))
+
+        self.assertListEqual(['replay.yaml'], os.listdir(self.temp_dir))
+
+    def test_unexpected_cache_write_error_leaves_no_temporary_file(self):
+        with mock.patch.object(replay_cache,
+                               '_replace_file',
+                               side_effect=RuntimeError('mock error')):
+            with self.assertRaises(RuntimeError):
+                replay_cache.load_replays(self.replay_path)
+
+        self.assertListEqual(['replay.yaml'], os.listdir(self.temp_dir))
+
+    def test_load_with_mapped_bodies_on_first_load(self):
+        replays = replay_cache.load_replays(self.replay_path, map_bodies=True)
+
+        self.assertEqual(self.replays, replays)
+        for response in replays.itervalues():
+            self.assertIsInstance(response.data, replay_cache.MappedBody)
+
+    def test_load_with_mapped_bodies_from_fresh_cache(self):
+        replay_cache.load_replays(self.replay_path)
+
+        replays = replay_cache.load_replays(self.replay_path, map_bodies=True)
+        self.assertEqual(self.replays, replays)
+        self.assertEqual('foo response', str(replays['/foo'].data))
+        self.assertEqual('foo response', str(replays['/foo'].data.as_buffer()))
+
+    def test_load_round_trips_unicode_bodies(self):
+        self.replays['/unicode'] = http_response.HttpResponse(200, {},
+                                                              u'caf\xe9')
+        self.write_replay_file(self.replays)
+        replay_cache.load_replays(self.replay_path)
+
+        self.assertEqual(self.replays,
+                         replay_cache.load_replays(self.replay_path))
+
+    def test_load_with_mapped_bodies_falls_back_when_cache_is_unwritable(self):
+        with mock.patch.object(replay_cache.tempfile,
+                               'NamedTemporaryFile',
+                               side_effect=IOError('mock write failure')):
+            replays = replay_cache.load_replays(self.replay_path,
+                                                map_bodies=True)
+        self.assertEqual(self.replays, replays)
+        self.assertEqual('foo response', replays['/foo'].data)
+
+
+class MappedBodyTest(unittest.TestCase):
+
+    def setUp(self):
+        mapping = mmap.mmap(-1, 32)
+        mapping.write('xxxxhello 127.0.0.1 worldxxxx')
+        self.body = replay_cache.MappedBody(mapping, 4, 21)
+
+    def test_behaves_like_underlying_string(self):
+        self.assertEqual(21, len(self.body))
+        self.assertEqual('hello 127.0.0.1 world', str(self.body))
+        self.assertEqual(self.body, 'hello 127.0.0.1 world')
+        self.assertEqual(6, self.body.find('127.0.0.1'))
+        self.assertEqual(-1, self.body.find('xxxx'))
+
+    def test_replace_copies_body_only_when_it_changes(self):
+        self.assertIs(self.body, self.body.replace('10.0.0.1', 'localhost'))
+        self.assertEqual('hello localhost world',
+                         self.body.replace('127.0.0.1', 'localhost'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+import unittest
+import urlparse
+
+from client_wrapper import http_response
+from replay_generator import replay_generator
+
+
+def _process_responses_with_replace(original):
+    """Rewrites domains with one str.replace pass per domain, longest first.
+
+    This is the rewrite that _process_responses did before it matched every
+    domain in a single pass. It replaced domains in set order, so when domains
+    overlap, we fix the order to longest first, which is the order that
+    rewrites each domain as a whole.
+    """
+    domains = set(urlparse.urlparse(url).netloc for url in original)
+    processed = {}
+    for url, response in original.iteritems():
+        data_processed = response.data
+        for domain in sorted(domains, key=len, reverse=True):
+            data_processed = data_processed.replace(domain, '127.0.0.1')
+        processed[urlparse.urlparse(url).path] = data_processed
+    return processed
+
+
+class ProcessResponsesTest(unittest.TestCase):
+
+    def assertMatchesReplace(self, original):
+        processed = replay_generator._process_responses(original)
+        self.assertDictEqual(
+            _process_responses_with_replace(original),
+            {path: response.data
+             for path, response in processed.iteritems()})
+
+    def test_rewrites_domain_that_is_prefix_of_another(self):
+        original = {
+            'http://example.com/a': http_response.HttpResponse(
+                200, {}, 'see http://example.com:8080/x and example.com/y'),
+            'http://example.com:8080/b': http_response.HttpResponse(
+                200, {}, '<a href="//example.com:8080/">example.com</a>'),
+        }
+
+        self.assertMatchesReplace(original)
+        self.assertEqual(
+            'see http://127.0.0.1/x and 127.0.0.1/y',
+            replay_generator._process_responses(original)['/a'].data)
+
+    def test_rewrites_domain_that_is_suffix_of_another(self):
+        original = {
+            'http://example.com/a': http_response.HttpResponse(
+                200, {}, 'cdn.example.com/lib.js example.com/index.html'),
+            'http://cdn.example.com/b': http_response.HttpResponse(
+                200, {}, 'static.cdn.example.com cdn.example.com'),
+        }
+
+        self.assertMatchesReplace(original)
+        self.assertEqual(
+            '127.0.0.1/lib.js 127.0.0.1/index.html',
+            replay_generator._process_responses(original)['/a'].data)
+
+    def test_leaves_responses_without_domains_unchanged(self):
+        original = {
+            'http://example.com/a': http_response.HttpResponse(
+                200, {'Content-Type': 'text/plain'}, 'nothing to rewrite'),
+            'http://example.org/b': http_response.HttpResponse(404, {}, ''),
+        }
+
+        self.assertMatchesReplace(original)
+        processed = replay_generator._process_responses(original)
+        self.assertEqual('nothing to rewrite', processed['/a'].data)
+        self.assertEqual({'Content-Type': 'text/plain'},
+                         processed['/a'].headers)
+        self.assertEqual(404, processed['/b'].response_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
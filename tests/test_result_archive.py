@@ -0,0 +1,237 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+import pytz
+
+from client_wrapper import filename
+from client_wrapper import names
+from client_wrapper import result_archive
+from client_wrapper import result_encoder
+from client_wrapper import results
+from tests import result_factory
+
+
+class ResultArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.results_dir = os.path.join(self.temp_dir, 'results')
+        os.mkdir(self.results_dir)
+        self.archive_path = os.path.join(self.temp_dir, 'archive.db')
+        self.archive = self.open_archive()
+
+    def open_archive(self):
+        archive = result_archive.ResultArchive(self.archive_path)
+        self.addCleanup(archive.close)
+        return archive
+
+    def write_result_file(self, result):
+        with open(
+                os.path.join(self.results_dir,
+                             filename.create_result_filename(result)),
+                'w') as result_file:
+            result_file.write(result_encoder.NdtResultEncoder().encode(result))
+
+    def append_to_segment(self, segment_filename, result):
+        with open(
+                os.path.join(self.results_dir, segment_filename),
+                'a') as segment_file:
+            segment_file.write(result_encoder.encode_compact(result) + '\n')
+
+    def test_ingest_only_reads_new_result_files(self):
+        self.write_result_file(result_factory.create_result(
+            0, 10.0, client=names.BANJO,
+            browser_version='49.0'))
+        self.write_result_file(result_factory.create_result(
+            1, 20.0, client=names.NDT_HTML5,
+            browser_version='49.0'))
+        self.assertEqual(2, self.archive.ingest(self.results_dir))
+        self.assertEqual(0, self.archive.ingest(self.results_dir))
+
+        self.write_result_file(result_factory.create_result(
+            2, 30.0, client=names.BANJO,
+            browser_version='50.0'))
+        self.assertEqual(1, self.open_archive().ingest(self.results_dir))
+        self.assertEqual(3, self.archive.count())
+
+    def test_ingest_reads_lines_appended_to_segments(self):
+        self.append_to_segment('results-2016-01-01T000000Z-0001.jsonl',
+                               result_factory.create_result(
+                                   0,
+                                   10.0,
+                                   client=names.BANJO,
+                                   browser_version='49.0'))
+        self.assertEqual(1, self.archive.ingest(self.results_dir))
+
+        self.append_to_segment('results-2016-01-01T000000Z-0001.jsonl',
+                               result_factory.create_result(
+                                   1,
+                                   20.0,
+                                   client=names.BANJO,
+                                   browser_version='49.0'))
+        self.assertEqual(1, self.open_archive().ingest(self.results_dir))
+        self.assertEqual(2, self.archive.count())
+
+    def test_ingest_retries_unreadable_files(self):
+        result = result_factory.create_result(0,
+                                              10.0,
+                                              client=names.BANJO,
+                                              browser_version='49.0')
+        corrupt_path = os.path.join(self.results_dir,
+                                    filename.create_result_filename(result))
+        with open(corrupt_path, 'w') as corrupt_file:
+            corrupt_file.write('{truncated')
+        self.assertEqual(0, self.archive.ingest(self.results_dir))
+
+        with open(corrupt_path, 'w') as corrupt_file:
+            corrupt_file.write(result_encoder.NdtResultEncoder().encode(result))
+        self.assertEqual(1, self.archive.ingest(self.results_dir))
+
+    def test_ingest_tracks_files_separately_for_each_directory(self):
+        other_results_dir = os.path.join(self.temp_dir, 'other_results')
+        os.mkdir(other_results_dir)
+        result = result_factory.create_result(0,
+                                              10.0,
+                                              client=names.BANJO,
+                                              browser_version='49.0')
+        self.write_result_file(result)
+        self.append_to_segment('results-w0-2016-01-01T000000Z-0001.jsonl',
+                               result)
+        self.assertEqual(2, self.archive.ingest(self.results_dir))
+
+        # The other directory's files have the same names as the ones already
+        # ingested, but hold different results.
+        self.results_dir = other_results_dir
+        self.write_result_file(result)
+        self.append_to_segment('results-w0-2016-01-01T000000Z-0001.jsonl',
+                               result)
+        self.append_to_segment('results-w0-2016-01-01T000000Z-0001.jsonl',
+                               result)
+        self.assertEqual(3, self.archive.ingest(other_results_dir))
+        self.assertEqual(5, self.archive.count())
+
+    def test_ingest_skips_result_files_that_are_not_json_objects(self):
+        result = result_factory.create_result(0,
+                                              10.0,
+                                              client=names.BANJO,
+                                              browser_version='49.0')
+        with open(
+                os.path.join(self.results_dir,
+                             filename.create_result_filename(result)),
+                'w') as result_file:
+            result_file.write('[1, 2]')
+        self.write_result_file(result_factory.create_result(
+            1, 10.0, client=names.BANJO,
+            browser_version='49.0'))
+
+        self.assertEqual(1, self.archive.ingest(self.results_dir))
+
+    def test_ingest_ignores_json_files_that_are_not_results(self):
+        with open(
+                os.path.join(self.results_dir, 'trace.json'),
+                'w') as trace_file:
+            trace_file.write('{"traceEvents": []}')
+        self.write_result_file(result_factory.create_result(
+            0, 10.0, client=names.BANJO,
+            browser_version='49.0'))
+
+        with mock.patch.object(result_archive.logger,
+                               'warning') as mock_warning:
+            self.assertEqual(1, self.archive.ingest(self.results_dir))
+            self.assertEqual(0, self.archive.ingest(self.results_dir))
+
+        self.assertFalse(mock_warning.called)
+
+    def test_count_filters_by_columns_and_start_time(self):
+        self.write_result_file(result_factory.create_result(
+            0, 10.0, client=names.BANJO,
+            browser_version='49.0'))
+        self.write_result_file(result_factory.create_result(
+            1,
+            20.0,
+            client=names.BANJO,
+            browser_version='49.0',
+            errors=[results.TestError('mock error')]))
+        self.write_result_file(result_factory.create_result(
+            2, 30.0, client=names.BANJO,
+            browser_version='50.0'))
+        self.write_result_file(result_factory.create_result(
+            3, 40.0, client=names.NDT_HTML5,
+            browser_version='49.0'))
+        self.archive.ingest(self.results_dir)
+
+        self.assertEqual(2,
+                         self.archive.count(client=names.BANJO,
+                                            os_shortname='win10',
+                                            browser_canonical_name='chrome49'))
+        self.assertEqual(1, self.archive.count(has_errors=True))
+        self.assertEqual(
+            2,
+            self.archive.count(
+                since=datetime.datetime(2016, 1, 1, 1, 0, 0, 0, pytz.utc),
+                until=datetime.datetime(2016, 1, 1, 3, 0, 0, 0, pytz.utc)))
+
+    def test_summarize_groups_results(self):
+        self.write_result_file(result_factory.create_result(
+            0, 10.0, client=names.BANJO,
+            browser_version='49.0'))
+        self.write_result_file(result_factory.create_result(
+            1,
+            20.0,
+            client=names.BANJO,
+            browser_version='49.0',
+            errors=[results.TestError('mock error')]))
+        self.write_result_file(result_factory.create_result(
+            2, 40.0, client=names.NDT_HTML5,
+            browser_version='49.0'))
+        self.archive.ingest(self.results_dir)
+
+        summaries = self.archive.summarize(['client'])
+
+        self.assertEqual(2, len(summaries))
+        self.assertEqual(
+            result_archive.ResultSummary(group={'client': names.BANJO},
+                                         count=2,
+                                         error_count=1,
+                                         mean_c2s_throughput=None,
+                                         mean_s2c_throughput=15.0,
+                                         mean_latency=None,
+                                         first_start_time=datetime.datetime(
+                                             2016, 1, 1, 0, 0, 0, 0, pytz.utc),
+                                         last_start_time=datetime.datetime(
+                                             2016, 1, 1, 1, 0, 0, 0, pytz.utc)),
+            summaries[0])
+        self.assertEqual({'client': names.NDT_HTML5}, summaries[1].group)
+
+    def test_summarize_returns_no_summaries_when_nothing_matches(self):
+        self.assertListEqual([], self.archive.summarize())
+        self.assertListEqual([], self.archive.summarize(['browser']))
+
+    def test_rejects_unknown_columns(self):
+        with self.assertRaises(ValueError):
+            self.archive.count(color='blue')
+        with self.assertRaises(ValueError):
+            self.archive.summarize(['start_time; DROP TABLE results'])
+
+
+if __name__ == '__main__':
+    unittest.main()
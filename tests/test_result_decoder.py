@@ -124,3 +124,150 @@ class NdtResultDecoderTest(unittest.TestCase):
 
         decoded_actual = self.decoder.decode(encoded)
         self.assertEqual(decoded_expected, decoded_actual)
+
+    def test_decodes_throughput_samples(self):
+        encoded = """
+{
+    "start_time": "2016-02-26T15:51:23.452234Z",
+    "end_time": "2016-02-26T15:59:33.284345Z",
+    "client": "mock_client",
+    "client_version": "mock_client_version",
+    "browser": null,
+    "browser_version": null,
+    "os": "mock_os",
+    "os_version": "mock_os_version",
+    "c2s_start_time": null,
+    "c2s_end_time": null,
+    "c2s_throughput": null,
+    "s2c_start_time": null,
+    "s2c_end_time": null,
+    "s2c_throughput": 98.235,
+    "s2c_throughput_samples": [[0.5, 90.25], [1.0, 98.5]],
+    "latency": null,
+    "errors": []
+}"""
+
+        decoded_actual = self.decoder.decode(encoded)
+        self.assertIsNone(decoded_actual.c2s_result.throughput_samples)
+        self.assertEqual(
+            results.ThroughputSeries([(0.5, 90.25), (1.0, 98.5)]),
+            decoded_actual.s2c_result.throughput_samples)
+
+    def test_decodes_browser_headless(self):
+        encoded = """
+{
+    "start_time": "2016-02-26T15:51:23.452234Z",
+    "end_time": "2016-02-26T15:59:33.284345Z",
+    "client": "mock_client",
+    "client_version": "mock_client_version",
+    "browser": "mock_browser",
+    "browser_version": "mock_browser_version",
+    "browser_headless": true,
+    "os": "mock_os",
+    "os_version": "mock_os_version",
+    "c2s_start_time": null,
+    "c2s_end_time": null,
+    "c2s_throughput": null,
+    "s2c_start_time": null,
+    "s2c_end_time": null,
+    "s2c_throughput": null,
+    "latency": null,
+    "errors": []
+}"""
+
+        self.assertTrue(self.decoder.decode(encoded).browser_headless)
+
+    def test_decodes_spans(self):
+        encoded = """
+{
+    "start_time": "2016-02-26T15:51:23.452234Z",
+    "end_time": "2016-02-26T15:59:33.284345Z",
+    "client": "mock_client",
+    "client_version": "mock_client_version",
+    "browser": "mock_browser",
+    "browser_version": "mock_browser_version",
+    "os": "mock_os",
+    "os_version": "mock_os_version",
+    "c2s_start_time": null,
+    "c2s_end_time": null,
+    "c2s_throughput": null,
+    "s2c_start_time": null,
+    "s2c_end_time": null,
+    "s2c_throughput": null,
+    "latency": null,
+    "errors": [],
+    "spans": [
+        {
+            "name": "load_url",
+            "start_time": "2016-02-26T15:51:24.000000Z",
+            "end_time": "2016-02-26T15:51:25.500000Z"
+        },
+        {
+            "name": "close_browser",
+            "start_time": "2016-02-26T15:59:33.000000Z",
+            "end_time": null
+        }
+    ]
+}"""
+
+        self.assertListEqual([results.Span(
+            'load_url', datetime.datetime(2016, 2, 26, 15, 51, 24, 0, pytz.utc),
+            datetime.datetime(2016, 2, 26, 15, 51, 25, 500000, pytz.utc)),
+                              results.Span('close_browser', datetime.datetime(
+                                  2016, 2, 26, 15, 59, 33, 0, pytz.utc))],
+                             self.decoder.decode(encoded).spans)
+
+    def test_decodes_only_spans_field_as_spans(self):
+        # An object with a "name" field outside the spans list is not a span.
+        encoded = """
+{
+    "start_time": "2016-02-26T15:51:23.452234Z",
+    "end_time": "2016-02-26T15:59:33.284345Z",
+    "client": "mock_client",
+    "client_version": "mock_client_version",
+    "browser": "mock_browser",
+    "browser_version": "mock_browser_version",
+    "os": "mock_os",
+    "os_version": "mock_os_version",
+    "os_details": {"name": "Ubuntu"},
+    "c2s_start_time": null,
+    "c2s_end_time": null,
+    "c2s_throughput": null,
+    "s2c_start_time": null,
+    "s2c_end_time": null,
+    "s2c_throughput": null,
+    "latency": null,
+    "errors": [
+        {
+            "timestamp": "2016-02-26T15:53:29.123456Z",
+            "message": "mock error message"
+        }
+    ]
+}"""
+
+        result = self.decoder.decode(encoded)
+
+        self.assertListEqual([], result.spans)
+        self.assertListEqual([results.TestError(
+            'mock error message', datetime.datetime(
+                2016, 2, 26, 15, 53, 29, 123456, pytz.utc))], result.errors)
+
+
+class DecodeTimeTest(unittest.TestCase):
+
+    def test_decodes_encoder_format_as_utc(self):
+        self.assertEqual(
+            datetime.datetime(2016, 2, 26, 15, 51, 23, 452234, pytz.utc),
+            result_decoder._decode_time('2016-02-26T15:51:23.452234Z'))
+
+    def test_decodes_other_iso_8601_formats(self):
+        self.assertEqual(
+            datetime.datetime(2016, 2, 26, 14, 51, 23, 0, pytz.utc),
+            result_decoder._decode_time('2016-02-26T15:51:23+01:00'))
+        self.assertEqual(
+            datetime.datetime(2016, 2, 26, 15, 51, 23, 500000, pytz.utc),
+            result_decoder._decode_time('2016-02-26T15:51:23.5Z'))
+
+    def test_decodes_empty_time_as_None(self):
+        self.assertIsNone(result_decoder._decode_time(None))
+        self.assertIsNone(result_decoder._decode_time(''))
@@ -211,6 +211,99 @@ class NdtResultEncoderTest(unittest.TestCase):
         encoded_actual = self.encoder.encode(result)
         self.assertJsonEqual(encoded_expected, encoded_actual)
 
+    def test_encodes_throughput_samples_when_present(self):
+        result = results.NdtResult(
+            start_time=datetime.datetime(2016, 2, 26, 15, 51, 23, 452234,
+                                         pytz.utc),
+            end_time=datetime.datetime(2016, 2, 26, 15, 59, 33, 284345,
+                                       pytz.utc),
+            client='mock_client',
+            client_version='mock_client_version',
+            os='mock_os',
+            os_version='mock_os_version',
+            c2s_result=results.NdtSingleTestResult(
+                throughput=10.127,
+                throughput_samples=results.ThroughputSeries([(0.5, 9.25),
+                                                             (1.0, 10.5)])))
+        encoded_expected = """
+{
+    "start_time": "2016-02-26T15:51:23.452234Z",
+    "end_time": "2016-02-26T15:59:33.284345Z",
+    "client": "mock_client",
+    "client_version": "mock_client_version",
+    "browser": null,
+    "browser_version": null,
+    "os": "mock_os",
+    "os_version": "mock_os_version",
+    "c2s_start_time": null,
+    "c2s_end_time": null,
+    "c2s_throughput": 10.127,
+    "c2s_throughput_samples": [[0.5, 9.25], [1.0, 10.5]],
+    "s2c_start_time": null,
+    "s2c_end_time": null,
+    "s2c_throughput": null,
+    "latency": null,
+    "errors": []
+}"""
+
+        encoded_actual = self.encoder.encode(result)
+        self.assertJsonEqual(encoded_expected, encoded_actual)
+
+    def test_encodes_browser_headless_when_known(self):
+        result = results.NdtResult(start_time=datetime.datetime(
+            2016, 2, 26, 15, 51, 23, 452234, pytz.utc),
+                                   end_time=datetime.datetime(2016, 2, 26, 15,
+                                                              59, 33, 284345,
+                                                              pytz.utc),
+                                   client='mock_client',
+                                   client_version='mock_client_version',
+                                   os='mock_os',
+                                   os_version='mock_os_version',
+                                   browser='mock_browser',
+                                   browser_version='mock_browser_version',
+                                   browser_headless=True)
+
+        encoded_actual = json.loads(self.encoder.encode(result))
+
+        self.assertIs(True, encoded_actual['browser_headless'])
+
+    def test_encodes_scheduled_start_time_when_set(self):
+        result = results.NdtResult(
+            start_time=datetime.datetime(2016, 2, 26, 15, 51, 23, 452234,
+                                         pytz.utc),
+            end_time=datetime.datetime(2016, 2, 26, 15, 59, 33, 284345,
+                                       pytz.utc),
+            client='mock_client',
+            client_version='mock_client_version',
+            os='mock_os',
+            os_version='mock_os_version',
+            scheduled_start_time=datetime.datetime(2016, 2, 26, 15, 51, 20, 0,
+                                                   pytz.utc))
+
+        encoded_actual = json.loads(self.encoder.encode(result))
+
+        self.assertEqual('2016-02-26T15:51:20.000000Z',
+                         encoded_actual['scheduled_start_time'])
+
+    def test_encodes_spans_when_present(self):
+        result = results.NdtResult(
+            start_time=datetime.datetime(2016, 2, 26, 15, 51, 23, 452234,
+                                         pytz.utc),
+            end_time=datetime.datetime(2016, 2, 26, 15, 59, 33, 284345,
+                                       pytz.utc),
+            spans=[results.Span('load_url', datetime.datetime(
+                2016, 2, 26, 15, 51, 24, 0, pytz.utc), datetime.datetime(
+                    2016, 2, 26, 15, 51, 25, 500000, pytz.utc))])
+
+        encoded_actual = json.loads(self.encoder.encode(result))
+
+        self.assertListEqual([{'name': 'load_url',
+                               'start_time': '2016-02-26T15:51:24.000000Z',
+                               'end_time': '2016-02-26T15:51:25.500000Z'}],
+                             encoded_actual['spans'])
+        self.assertNotIn('spans',
+                         json.loads(self.encoder.encode(results.NdtResult())))
+
     def test_encodes_correctly_when_c2s_result_is_missing(self):
         result = results.NdtResult(
             start_time=datetime.datetime(2016, 2, 26, 15, 51, 23, 452234,
@@ -382,3 +475,70 @@ class NdtResultEncoderTest(unittest.TestCase):
 
         encoded_actual = self.encoder.encode(result)
         self.assertJsonEqual(encoded_expected, encoded_actual)
+
+
+class EncodeCompactTest(unittest.TestCase):
+
+    def assertMatchesStandardEncoder(self, result):
+        self.assertEqual(
+            result_encoder.NdtResultEncoder(
+                sort_keys=True, separators=(',', ':')).encode(result),
+            result_encoder.encode_compact(result))
+
+    def test_matches_standard_encoder_when_only_required_fields_are_set(self):
+        self.assertMatchesStandardEncoder(results.NdtResult(
+            start_time=datetime.datetime(2016, 2, 26, 15, 51, 23, 452234,
+                                         pytz.utc),
+            end_time=None,
+            os='mock_os',
+            os_version='mock_os_version',
+            client='mock_client',
+            client_version='mock_client_version'))
+
+    def test_matches_standard_encoder_for_fully_populated_result(self):
+        self.assertMatchesStandardEncoder(results.NdtResult(
+            start_time=datetime.datetime(2016, 2, 26, 15, 51, 23, 452234,
+                                         pytz.utc),
+            end_time=datetime.datetime(2016, 2, 26, 15, 59, 33, 0, pytz.utc),
+            client='mock_client',
+            client_version='1.0',
+            os='mock_os',
+            os_version='mock_os_version',
+            c2s_result=results.NdtSingleTestResult(
+                start_time=datetime.datetime(2016, 2, 26, 15, 51, 24, 123456,
+                                             pytz.utc),
+                end_time=datetime.datetime(2016, 2, 26, 15, 51, 34, 123456,
+                                           pytz.utc),
+                throughput=10.127,
+                throughput_samples=results.ThroughputSeries([(0.5, 1e-7), (
+                    1.0, 12.0)])),
+            s2c_result=results.NdtSingleTestResult(throughput=98),
+            latency=0.1,
+            browser=u'mock_br\xf6wser',
+            browser_version='mock_browser_version',
+            browser_headless=False,
+            scheduled_start_time=datetime.datetime(2016, 2, 26, 15, 51, 0, 0,
+                                                   pytz.utc),
+            spans=[
+                results.Span('load_url', datetime.datetime(
+                    2016, 2, 26, 15, 51, 1, 0, pytz.utc), datetime.datetime(
+                        2016, 2, 26, 15, 51, 2, 250000, pytz.utc)),
+                results.Span('close_browser', datetime.datetime(
+                    2016, 2, 26, 15, 59, 32, 0, pytz.utc))
+            ],
+            errors=[
+                results.TestError('mock "quoted" error\n', datetime.datetime(
+                    2016, 2, 26, 15, 53, 29, 123456, pytz.utc)),
+                results.TestError('mock error message 2', datetime.datetime(
+                    2016, 2, 26, 15, 53, 30, 0, pytz.utc))
+            ]))
+
+    def test_matches_standard_encoder_when_subtests_are_missing(self):
+        result = results.NdtResult(
+            start_time=datetime.datetime(2016, 2, 26, 15, 51, 23, 452234,
+                                         pytz.utc),
+            end_time=datetime.datetime(2016, 2, 26, 15, 59, 33, 0, pytz.utc),
+            latency=float('nan'))
+        result.c2s_result = None
+        result.s2c_result = None
+        self.assertMatchesStandardEncoder(result)
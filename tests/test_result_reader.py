@@ -0,0 +1,213 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+import __builtin__
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+import pytz
+
+from client_wrapper import filename
+from client_wrapper import names
+from client_wrapper import result_encoder
+from client_wrapper import result_reader
+from tests import result_factory
+
+
+class ReadDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.results_dir)
+        self.results = [
+            result_factory.create_result(0,
+                                         os='Ubuntu',
+                                         os_version='14.04',
+                                         browser=names.FIREFOX,
+                                         browser_version='45.0'),
+            result_factory.create_result(1),
+            result_factory.create_result(2,
+                                         os='Ubuntu',
+                                         os_version='14.04',
+                                         browser=names.CHROME,
+                                         browser_version='51.0.2704'),
+            result_factory.create_result(3,
+                                         browser=names.FIREFOX,
+                                         browser_version='45.0'),
+        ]
+        encoder = result_encoder.NdtResultEncoder()
+        for result in self.results:
+            self.write_file(
+                filename.create_result_filename(result), encoder.encode(result))
+
+    def write_file(self, result_filename, contents):
+        with open(
+                os.path.join(self.results_dir, result_filename),
+                'w') as result_file:
+            result_file.write(contents)
+
+    def read_start_hours(self, **kwargs):
+        return sorted(
+            r.start_time.hour
+            for r in result_reader.read_directory(self.results_dir, **kwargs))
+
+    def test_reads_every_result_file(self):
+        self.assertListEqual([0, 1, 2, 3], self.read_start_hours())
+
+    def test_reads_every_result_file_with_thread_pool(self):
+        self.assertListEqual([0, 1, 2, 3], self.read_start_hours(threads=3))
+
+    def test_skips_undecodable_and_non_json_files(self):
+        self.write_file('corrupt.json', '{not json')
+        self.write_file('list.json', '[1,2]')
+        self.write_file('notes.txt', 'not a result')
+
+        self.assertListEqual([0, 1, 2, 3], self.read_start_hours())
+
+    def test_filters_by_filename_components(self):
+        self.assertListEqual([1, 2],
+                             self.read_start_hours(
+                                 filename_filter=result_reader.FilenameFilter(
+                                     browser='chrome')))
+        self.assertListEqual([2],
+                             self.read_start_hours(
+                                 filename_filter=result_reader.FilenameFilter(
+                                     os_name='ubuntu',
+                                     browser='chrome51')))
+        self.assertListEqual(
+            [1, 2],
+            self.read_start_hours(filename_filter=result_reader.FilenameFilter(
+                client=names.NDT_HTML5,
+                since=datetime.datetime(2016, 1, 1, 1, 0, 0, 0, pytz.utc),
+                until=datetime.datetime(2016, 1, 1, 3, 0, 0, 0, pytz.utc))))
+
+    def test_does_not_open_files_that_do_not_match_filter(self):
+        real_open = open
+        opened_paths = []
+
+        def mock_open(path, *args):
+            opened_paths.append(os.path.basename(path))
+            return real_open(path, *args)
+
+        with mock.patch.object(__builtin__, 'open', side_effect=mock_open):
+            read_results = list(result_reader.read_directory(
+                self.results_dir,
+                filename_filter=result_reader.FilenameFilter(
+                    browser='firefox')))
+
+        self.assertEqual(2, len(read_results))
+        self.assertListEqual(
+            ['ubuntu14.04-firefox45-ndt_js-2016-01-01T000000Z-results.json',
+             'win10-firefox45-ndt_js-2016-01-01T030000Z-results.json'],
+            sorted(opened_paths))
+
+    def test_reader_threads_exit_when_iteration_stops_early(self):
+        for i in range(20):
+            self.write_file('extra-%d.json' % i, 'not a result')
+        thread_count = threading.active_count()
+        read_results = result_reader.read_directory(self.results_dir, threads=2)
+
+        next(read_results)
+        read_results.close()
+
+        for _ in range(100):
+            if threading.active_count() == thread_count:
+                break
+            time.sleep(0.01)
+        self.assertEqual(thread_count, threading.active_count())
+
+    def test_rejects_invalid_thread_count(self):
+        with self.assertRaises(ValueError):
+            result_reader.read_directory(self.results_dir, threads=0)
+
+
+class ReadJsonLinesTest(unittest.TestCase):
+
+    def setUp(self):
+        results_file = tempfile.NamedTemporaryFile(delete=False)
+        self.results_path = results_file.name
+        self.addCleanup(os.remove, self.results_path)
+        encoder = result_encoder.NdtResultEncoder()
+        for hour in range(3):
+            results_file.write(encoder.encode(result_factory.create_result(
+                hour)) + '\n')
+            if hour == 1:
+                results_file.write('\n{truncated result\n[1,2]\n')
+        results_file.close()
+
+    def test_reads_each_line_and_skips_undecodable_lines(self):
+        read_results = list(result_reader.read_results(self.results_path))
+
+        self.assertListEqual([0, 1, 2],
+                             [r.start_time.hour for r in read_results])
+        self.assertEqual(names.CHROME, read_results[0].browser)
+
+
+class SegmentTailerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.segments_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.segments_dir)
+        self.tailer = result_reader.SegmentTailer(self.segments_dir)
+        self.encoder = result_encoder.NdtResultEncoder()
+
+    def append(self, segment_filename, data):
+        with open(
+                os.path.join(self.segments_dir, segment_filename),
+                'a') as segment_file:
+            segment_file.write(data)
+
+    def encode(self, hour):
+        return self.encoder.encode(result_factory.create_result(hour))
+
+    def read_new_start_hours(self):
+        return [r.start_time.hour for r in self.tailer.read_new_results()]
+
+    def test_returns_only_results_appended_since_last_read(self):
+        self.append('results-2016-01-01T000000Z-0001.jsonl',
+                    self.encode(0) + '\n' + self.encode(1) + '\n')
+        self.assertListEqual([0, 1], self.read_new_start_hours())
+        self.assertListEqual([], self.read_new_start_hours())
+
+        self.append('results-2016-01-01T000000Z-0001.jsonl',
+                    self.encode(2) + '\n')
+        self.append('results-2016-01-01T030000Z-0002.jsonl',
+                    self.encode(3) + '\n')
+        self.append('notes.txt', 'not a segment\n')
+        self.assertListEqual([2, 3], self.read_new_start_hours())
+
+    def test_skips_lines_that_are_not_json_objects(self):
+        self.append('results-2016-01-01T000000Z-0001.jsonl',
+                    '[1,2]\n' + self.encode(0) + '\n')
+
+        self.assertListEqual([0], self.read_new_start_hours())
+
+    def test_waits_for_partially_written_line_to_complete(self):
+        encoded = self.encode(0)
+        self.append('results-2016-01-01T000000Z-0001.jsonl', encoded[:20])
+        self.assertListEqual([], self.read_new_start_hours())
+
+        self.append('results-2016-01-01T000000Z-0001.jsonl',
+                    encoded[20:] + '\n')
+        self.assertListEqual([0], self.read_new_start_hours())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+import pickle
+import unittest
+
+from client_wrapper import names
+from client_wrapper import result_stats
+from tests import result_factory
+
+
+class MetricStatsTest(unittest.TestCase):
+
+    def test_computes_mean_stddev_and_percentiles(self):
+        stats = result_stats.MetricStats()
+        for value in (2, 4, 4, 4, 5, 5, 7, 9):
+            stats.add(value)
+
+        self.assertEqual(8, stats.count)
+        self.assertAlmostEqual(5.0, stats.mean)
+        self.assertAlmostEqual(2.0, stats.stddev)
+        self.assertEqual(2, stats.percentile(0))
+        self.assertEqual(9, stats.percentile(100))
+
+    def test_merged_stats_match_stats_of_all_values(self):
+        merged = result_stats.MetricStats()
+        for values in ((2, 4, 4), (), (4, 5, 5, 7, 9)):
+            stats = result_stats.MetricStats()
+            for value in values:
+                stats.add(value)
+            merged.merge(stats)
+
+        self.assertEqual(8, merged.count)
+        self.assertAlmostEqual(5.0, merged.mean)
+        self.assertAlmostEqual(2.0, merged.stddev)
+        self.assertAlmostEqual(4.5, merged.percentile(50))
+
+    def test_empty_stats_have_no_values(self):
+        stats = result_stats.MetricStats()
+
+        self.assertIsNone(stats.mean)
+        self.assertIsNone(stats.stddev)
+        self.assertIsNone(stats.percentile(50))
+
+
+class ResultStatsTest(unittest.TestCase):
+
+    def test_groups_metrics_by_client_browser_and_os(self):
+        stats = result_stats.ResultStats()
+        stats.add(result_factory.create_result(s2c_throughput=10.0,
+                                               client=names.BANJO,
+                                               latency=20.0))
+        stats.add(result_factory.create_result(s2c_throughput=30.0,
+                                               client=names.BANJO))
+        stats.add(result_factory.create_result(s2c_throughput=50.0,
+                                               client=names.NDT_HTML5))
+
+        banjo_group = result_stats.ResultGroup(client=names.BANJO,
+                                               browser=names.CHROME,
+                                               os='Windows')
+        self.assertListEqual([banjo_group,
+                              result_stats.ResultGroup(client=names.NDT_HTML5,
+                                                       browser=names.CHROME,
+                                                       os='Windows')],
+                             stats.groups())
+        self.assertEqual(20.0, stats.get(banjo_group, 's2c_throughput').mean)
+        self.assertEqual(1, stats.get(banjo_group, 'latency').count)
+        self.assertEqual(0, stats.get(banjo_group, 'c2s_throughput').count)
+        self.assertEqual(10.0, stats.get(banjo_group, 's2c_duration').mean)
+        self.assertEqual(60.0, stats.get(banjo_group, 'total_duration').mean)
+
+    def test_merges_stats_sent_between_workers(self):
+        worker_stats = []
+        for s2c_throughput in (10.0, 30.0):
+            stats = result_stats.ResultStats()
+            stats.add(result_factory.create_result(
+                s2c_throughput=s2c_throughput,
+                client=names.BANJO))
+            # Workers send their statistics to the parent process pickled.
+            worker_stats.append(pickle.loads(pickle.dumps(stats)))
+        run_stats = result_stats.ResultStats()
+        for stats in worker_stats:
+            run_stats.merge(stats)
+
+        group = run_stats.groups()[0]
+        self.assertEqual(2, run_stats.get(group, 's2c_throughput').count)
+        self.assertEqual(20.0, run_stats.get(group, 's2c_throughput').mean)
+        summary = run_stats.format_summary()
+        self.assertIn('client=banjo browser=chrome os=Windows (2 results)',
+                      summary)
+        self.assertIn('s2c_throughput (Mbps)', summary)
+        self.assertNotIn('c2s_throughput', summary)
+
+
+if __name__ == '__main__':
+    unittest.main()
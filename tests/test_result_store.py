@@ -0,0 +1,135 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+import datetime
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+import pytz
+
+from client_wrapper import names
+from client_wrapper import result_encoder
+from client_wrapper import result_store
+from tests import result_factory
+
+
+class ResultStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = result_store.ResultStore.from_results([
+            result_factory.create_result(0,
+                                         10.0,
+                                         browser='firefox',
+                                         latency=20.0),
+            result_factory.create_result(1, 20.0, browser='chrome'),
+            result_factory.create_result(2,
+                                         30.0,
+                                         browser='firefox',
+                                         latency=40.0),
+            result_factory.create_result(3, None, browser='firefox'),
+            result_factory.create_result(4,
+                                         50.0,
+                                         browser='chrome',
+                                         latency=60.0),
+        ])
+
+    def test_store_holds_one_row_per_result(self):
+        self.assertEqual(5, len(self.store))
+        self.assertEqual(1451606400.0, self.store.column('start_time')[0])
+        self.assertTrue(math.isnan(self.store.column('s2c_throughput')[3]))
+        self.assertItemsEqual(['firefox', 'chrome'],
+                              self.store.categories('browser'))
+
+    def test_select_filters_by_categorical_columns(self):
+        self.assertListEqual([0, 2, 3],
+                             list(self.store.select(browser='firefox')))
+        self.assertListEqual([1, 4],
+                             list(self.store.select(browser='chrome',
+                                                    client=names.NDT_HTML5)))
+        self.assertListEqual([], list(self.store.select(browser='safari')))
+
+    def test_select_filters_by_start_time(self):
+        rows = self.store.select(
+            browser='firefox',
+            since=datetime.datetime(2016, 1, 1, 1, 0, 0, 0, pytz.utc),
+            until=datetime.datetime(2016, 1, 1, 3, 0, 0, 0, pytz.utc))
+
+        self.assertListEqual([2], list(rows))
+
+    def test_select_rejects_unknown_column(self):
+        with self.assertRaises(ValueError):
+            self.store.select(color='blue')
+
+    def test_values_excludes_missing_values(self):
+        self.assertListEqual([20.0, 40.0, 60.0], self.store.values('latency'))
+        self.assertListEqual([10.0, 30.0],
+                             self.store.values(
+                                 's2c_throughput',
+                                 self.store.select(browser='firefox')))
+
+    def test_percentiles_interpolate_between_values(self):
+        self.assertListEqual(
+            [10.0, 25.0, 50.0],
+            self.store.percentiles('s2c_throughput', [0, 50, 100]))
+        self.assertEqual(20.0,
+                         self.store.percentile(
+                             's2c_throughput',
+                             50,
+                             self.store.select(browser='firefox')))
+
+    def test_percentile_is_None_when_no_values_match(self):
+        self.assertIsNone(self.store.percentile(
+            'latency', 50, self.store.select(browser='safari')))
+
+    def test_count_by_counts_rows_per_category(self):
+        self.assertDictEqual({'firefox': 3,
+                              'chrome': 2}, self.store.count_by('browser'))
+        self.assertDictEqual({'chrome': 1}, self.store.count_by('browser', [4]))
+
+
+class ResultStoreFromDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.results_dir)
+
+    def test_from_directory_loads_valid_result_files(self):
+        encoder = result_encoder.NdtResultEncoder()
+        for hour in range(3):
+            result = result_factory.create_result(hour,
+                                                  float(hour),
+                                                  browser='firefox')
+            with open(
+                    os.path.join(self.results_dir, 'result-%d.json' % hour),
+                    'w') as result_file:
+                result_file.write(encoder.encode(result))
+        with open(
+                os.path.join(self.results_dir, 'corrupt.json'),
+                'w') as result_file:
+            result_file.write('{not json')
+        with open(
+                os.path.join(self.results_dir, 'notes.txt'), 'w') as other_file:
+            other_file.write('not a result')
+
+        store = result_store.ResultStore.from_directory(self.results_dir)
+
+        self.assertEqual(3, len(store))
+        self.assertListEqual([0.0, 1.0, 2.0], store.values('s2c_throughput'))
+
+
+if __name__ == '__main__':
+    unittest.main()
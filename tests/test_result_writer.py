@@ -0,0 +1,242 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+import datetime
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import mock
+import pytz
+
+from client_wrapper import result_decoder
+from client_wrapper import result_writer
+from client_wrapper import trace_events
+from tests import result_factory
+
+
+def create_result(minute):
+    """Creates a valid NdtResult that started at the given minute."""
+    return result_factory.create_result(
+        start_time=datetime.datetime(2016, 2, 26, 15, minute, 23, 0, pytz.utc),
+        end_time=datetime.datetime(2016, 2, 26, 15, minute, 45, 0, pytz.utc))
+
+
+class ResultWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+
+    def read_result(self, output_filename):
+        with open(os.path.join(self.output_dir, output_filename)) as f:
+            return result_decoder.NdtResultDecoder().decode(f.read())
+
+    def test_close_saves_all_queued_results(self):
+        writer = result_writer.ResultWriter(self.output_dir)
+        writer.start()
+        for minute in range(20):
+            writer.write(create_result(minute))
+        writer.close()
+
+        output_filenames = sorted(os.listdir(self.output_dir))
+        self.assertEqual(20, len(output_filenames))
+        self.assertEqual(
+            'win10-chrome49-ndt_js-2016-02-26T150023Z-results.json',
+            output_filenames[0])
+        self.assertEqual(
+            create_result(0), self.read_result(output_filenames[0]))
+
+    def test_saves_results_with_worker_id_in_filename(self):
+        writer = result_writer.ResultWriter(self.output_dir, worker_id=2)
+        writer.start()
+        writer.write(create_result(0))
+        writer.close()
+
+        self.assertListEqual(
+            ['win10-chrome49-ndt_js-2016-02-26T150023Z-w2-results.json'],
+            os.listdir(self.output_dir))
+
+    def test_syncs_every_saved_result_to_disk(self):
+        with mock.patch.object(result_writer.os, 'fsync') as mock_fsync:
+            writer = result_writer.ResultWriter(self.output_dir,
+                                                max_batch_size=4)
+            writer.start()
+            for minute in range(10):
+                writer.write(create_result(minute))
+            writer.close()
+
+        self.assertEqual(10, mock_fsync.call_count)
+
+    def test_continues_saving_after_a_result_fails_to_save(self):
+        invalid_result = create_result(0)
+        invalid_result.os = 'invalid OS'
+        writer = result_writer.ResultWriter(self.output_dir)
+        writer.start()
+        writer.write(invalid_result)
+        writer.write(create_result(1))
+        writer.close()
+
+        self.assertListEqual(
+            ['win10-chrome49-ndt_js-2016-02-26T150123Z-results.json'],
+            os.listdir(self.output_dir))
+
+    def test_continues_saving_after_a_result_fails_to_encode(self):
+        unencodable_result = create_result(0)
+        unencodable_result.latency = object()
+        writer = result_writer.ResultWriter(self.output_dir)
+        writer.start()
+        writer.write(unencodable_result)
+        writer.write(create_result(1))
+        writer.close()
+
+        self.assertListEqual(
+            ['win10-chrome49-ndt_js-2016-02-26T150123Z-results.json'],
+            os.listdir(self.output_dir))
+
+    def test_continues_saving_batch_after_a_result_cannot_be_named(self):
+        no_browser_result = create_result(0)
+        no_browser_result.browser = None
+        no_start_time_result = create_result(1)
+        no_start_time_result.start_time = None
+        writer = result_writer.ResultWriter(self.output_dir)
+        for result in (no_browser_result, no_start_time_result,
+                       create_result(2)):
+            writer.write(result)
+        # Starting after queueing puts every result in the same batch.
+        writer.start()
+        writer.close()
+
+        self.assertListEqual(
+            ['win10-chrome49-ndt_js-2016-02-26T150223Z-results.json'],
+            os.listdir(self.output_dir))
+
+    def test_continues_saving_after_a_batch_fails_to_save(self):
+        writer = result_writer.ResultWriter(self.output_dir, max_batch_size=1)
+        with mock.patch.object(result_writer.os,
+                               'fsync',
+                               side_effect=[IOError('mock sync error'), None]):
+            writer.start()
+            writer.write(create_result(0))
+            writer.write(create_result(1))
+            writer.close()
+
+        self.assertEqual(2, len(os.listdir(self.output_dir)))
+
+    def test_records_each_batch_on_trace_recorder(self):
+        events_file = StringIO.StringIO()
+        recorder = trace_events.TraceRecorder(1, 'mock worker', events_file)
+        writer = result_writer.ResultWriter(self.output_dir,
+                                            trace_recorder=recorder)
+        for minute in range(3):
+            writer.write(create_result(minute))
+        writer.start()
+        writer.close()
+
+        events_file.seek(0)
+        self.assertListEqual([('save_results', {'results': 3})],
+                             [(e['name'], e['args'])
+                              for e in trace_events.read_events(events_file)
+                              if e['ph'] == 'X'])
+
+    def test_close_does_nothing_when_writer_never_started(self):
+        result_writer.ResultWriter(self.output_dir).close()
+
+        self.assertListEqual([], os.listdir(self.output_dir))
+
+
+class JsonLinesResultWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        self.now = 1456501463.0
+        time_patcher = mock.patch.object(result_writer, 'time')
+        self.addCleanup(time_patcher.stop)
+        time_patcher.start().time.side_effect = lambda: self.now
+
+    def read_segment(self, segment_filename):
+        with open(os.path.join(self.output_dir, segment_filename)) as f:
+            return f.read().splitlines()
+
+    def test_appends_results_as_single_lines(self):
+        writer = result_writer.JsonLinesResultWriter(self.output_dir)
+        writer.start()
+        for minute in range(3):
+            writer.write(create_result(minute))
+        writer.close()
+
+        self.assertListEqual(['results-2016-02-26T154423Z-0001.jsonl'],
+                             os.listdir(self.output_dir))
+        lines = self.read_segment('results-2016-02-26T154423Z-0001.jsonl')
+        self.assertEqual(3, len(lines))
+        self.assertEqual(
+            create_result(2),
+            result_decoder.NdtResultDecoder().decode(lines[2]))
+
+    def test_rotates_segment_at_maximum_size(self):
+        writer = result_writer.JsonLinesResultWriter(self.output_dir,
+                                                     worker_id=1,
+                                                     max_segment_bytes=1)
+        writer.start()
+        for minute in range(3):
+            writer.write(create_result(minute))
+        writer.close()
+
+        self.assertListEqual(['results-w1-2016-02-26T154423Z-0001.jsonl',
+                              'results-w1-2016-02-26T154423Z-0002.jsonl',
+                              'results-w1-2016-02-26T154423Z-0003.jsonl'],
+                             sorted(os.listdir(self.output_dir)))
+
+    def test_rotates_segment_at_maximum_age(self):
+        writer = result_writer.JsonLinesResultWriter(self.output_dir,
+                                                     max_segment_age=60)
+        writer._save_batch([create_result(0), create_result(1)])
+        self.now += 60
+        writer._save_batch([create_result(2)])
+        writer.close()
+
+        self.assertListEqual(['results-2016-02-26T154423Z-0001.jsonl',
+                              'results-2016-02-26T154523Z-0002.jsonl'],
+                             sorted(os.listdir(self.output_dir)))
+        self.assertEqual(
+            1, len(self.read_segment('results-2016-02-26T154523Z-0002.jsonl')))
+
+    def test_continues_appending_after_a_result_fails_to_encode(self):
+        unencodable_result = create_result(0)
+        unencodable_result.latency = object()
+        writer = result_writer.JsonLinesResultWriter(self.output_dir)
+        writer.start()
+        writer.write(unencodable_result)
+        writer.write(create_result(1))
+        writer.close()
+
+        lines = self.read_segment('results-2016-02-26T154423Z-0001.jsonl')
+        self.assertListEqual(
+            [create_result(1)],
+            [result_decoder.NdtResultDecoder().decode(l) for l in lines])
+
+    def test_syncs_each_batch_once(self):
+        with mock.patch.object(result_writer.os, 'fsync') as mock_fsync:
+            writer = result_writer.JsonLinesResultWriter(self.output_dir)
+            writer._save_batch([create_result(minute) for minute in range(4)])
+            writer._save_batch([create_result(4)])
+
+        self.assertEqual(2, mock_fsync.call_count)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,10 +16,31 @@ import datetime
 import unittest
 
 import mock
+import pytz
 
 from client_wrapper import results
 
 
+class ThroughputSeriesTest(unittest.TestCase):
+
+    def test_series_iterates_samples_in_order_appended(self):
+        series = results.ThroughputSeries([(0.0, 1.5), (0.25, 3.0)])
+        series.append(0.5, 4.5)
+
+        self.assertEqual(3, len(series))
+        self.assertListEqual([(0.0, 1.5), (0.25, 3.0), (0.5, 4.5)],
+                             list(series))
+
+    def test_series_with_same_samples_are_equal(self):
+        self.assertEqual(
+            results.ThroughputSeries([(0.0, 1.5), (0.25, 3.0)]),
+            results.ThroughputSeries([(0.0, 1.5), (0.25, 3.0)]))
+        self.assertNotEqual(
+            results.ThroughputSeries([(0.0, 1.5), (0.25, 3.0)]),
+            results.ThroughputSeries([(0.0, 1.5)]))
+        self.assertNotEqual(results.ThroughputSeries(), None)
+
+
 class TestErrorTest(unittest.TestCase):
 
     def test_constructor_using_default_timestamp_creates_distinct_timestamps(
@@ -42,5 +63,23 @@ class TestErrorTest(unittest.TestCase):
             self.assertEqual(datetime.datetime(2002, 1, 1), error_b.timestamp)
 
 
+class SpanTest(unittest.TestCase):
+
+    def test_duration_is_None_until_span_finishes(self):
+        start_time = datetime.datetime(2016, 1, 1, 0, 0, 0, 0, pytz.utc)
+        end_time = datetime.datetime(2016, 1, 1, 0, 0, 1, 500000, pytz.utc)
+        span = results.Span('load_url', start_time)
+        self.assertIsNone(span.duration)
+
+        with mock.patch.object(results.datetime,
+                               'datetime',
+                               autospec=True) as mocked_datetime:
+            mocked_datetime.now.return_value = end_time
+            span.finish()
+
+        self.assertEqual(end_time, span.end_time)
+        self.assertEqual(1.5, span.duration)
+
+
 if __name__ == '__main__':
     unittest.main()
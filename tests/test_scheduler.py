@@ -0,0 +1,173 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+import datetime
+import unittest
+
+import mock
+import pytz
+
+from client_wrapper import scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        # Simulate a clock that only advances when the scheduler sleeps or a
+        # test runs.
+        self.now = 1451606400.0
+
+        def mock_sleep(seconds):
+            self.now += seconds
+
+        time_patcher = mock.patch.object(scheduler, 'time')
+        self.addCleanup(time_patcher.stop)
+        mock_time = time_patcher.start()
+        mock_time.time.side_effect = lambda: self.now
+        mock_time.sleep.side_effect = mock_sleep
+
+    def run_schedule(self, test_scheduler, test_durations):
+        """Runs a schedule, simulating each test taking a given duration.
+
+        Args:
+            test_scheduler: Scheduler to run.
+            test_durations: Function that takes the index of a test and
+                returns how long the test takes to run (in seconds).
+
+        Returns:
+            A list of the actual start times of each test (in seconds since
+            the start of the run).
+        """
+        run_start = self.now
+        start_times = []
+        for scheduled_test in test_scheduler.schedule():
+            start_times.append(self.now - run_start)
+            self.now += test_durations(scheduled_test.index)
+        return start_times
+
+    def test_runs_specified_iterations_back_to_back(self):
+        start_times = self.run_schedule(
+            scheduler.Scheduler(iterations=3),
+            lambda unused_index: 20.0)
+
+        self.assertListEqual([0.0, 20.0, 40.0], start_times)
+
+    def test_stops_starting_tests_when_duration_elapses(self):
+        start_times = self.run_schedule(
+            scheduler.Scheduler(duration=50.0),
+            lambda unused_index: 20.0)
+
+        self.assertListEqual([0.0, 20.0, 40.0], start_times)
+
+    def test_iterations_limit_applies_within_duration(self):
+        start_times = self.run_schedule(
+            scheduler.Scheduler(iterations=2, duration=3600.0),
+            lambda unused_index: 20.0)
+
+        self.assertListEqual([0.0, 20.0], start_times)
+
+    def test_spaces_tests_evenly_at_target_rate(self):
+        test_scheduler = scheduler.Scheduler(duration=3600.0, tests_per_hour=12)
+
+        start_times = self.run_schedule(test_scheduler,
+                                        lambda unused_index: 20.0)
+
+        self.assertListEqual([i * 300.0 for i in range(12)], start_times)
+        self.assertListEqual([0.0] * 12, test_scheduler.drifts)
+
+    def test_records_drift_when_test_overruns_schedule(self):
+        test_scheduler = scheduler.Scheduler(iterations=3, tests_per_hour=60)
+
+        # The second test takes 90 seconds, which delays the third test by 30
+        # seconds, but the schedule stays anchored to the start of the run.
+        start_times = self.run_schedule(
+            test_scheduler, lambda index: 90.0 if index == 1 else 20.0)
+
+        self.assertListEqual([0.0, 60.0, 150.0], start_times)
+        self.assertListEqual([0.0, 0.0, 30.0], test_scheduler.drifts)
+
+    def test_skips_slots_missed_while_test_overruns_schedule(self):
+        test_scheduler = scheduler.Scheduler(iterations=4, tests_per_hour=60)
+
+        # The second test takes 150 seconds, which overruns the slots at 120
+        # and 180 seconds. The slot at 120 seconds is skipped, and the third
+        # test starts late in the slot at 180 seconds.
+        start_times = self.run_schedule(
+            test_scheduler, lambda index: 150.0 if index == 1 else 20.0)
+
+        self.assertListEqual([0.0, 60.0, 210.0, 240.0], start_times)
+        self.assertListEqual([0.0, 0.0, 30.0, 0.0], test_scheduler.drifts)
+        self.assertEqual(1, test_scheduler.missed_slots)
+
+    def test_missed_slots_count_toward_duration(self):
+        test_scheduler = scheduler.Scheduler(duration=300.0, tests_per_hour=60)
+
+        scheduled_tests = []
+        for scheduled_test in test_scheduler.schedule():
+            scheduled_tests.append(scheduled_test)
+            self.now += 200.0 if scheduled_test.index == 0 else 20.0
+
+        self.assertListEqual([0, 1, 2], [t.index for t in scheduled_tests])
+        self.assertEqual(
+            datetime.datetime(2016, 1, 1, 0, 3,
+                              tzinfo=pytz.utc),
+            scheduled_tests[1].scheduled_time)
+        self.assertEqual(2, test_scheduler.missed_slots)
+
+    @mock.patch.object(scheduler.logger, 'warning')
+    def test_drift_summary_reports_missed_slots(self, mock_warning):
+        test_scheduler = scheduler.Scheduler(iterations=2, tests_per_hour=60)
+        self.run_schedule(test_scheduler, lambda index: 150.0)
+
+        test_scheduler.log_drift_summary()
+
+        self.assertEqual(1, mock_warning.call_args[0][1])
+
+    def test_scheduled_test_reports_scheduled_time(self):
+        test_scheduler = scheduler.Scheduler(iterations=2, tests_per_hour=60)
+
+        scheduled_tests = list(test_scheduler.schedule())
+
+        self.assertEqual(
+            datetime.datetime(2016, 1, 1, 0, 1,
+                              tzinfo=pytz.utc),
+            scheduled_tests[1].scheduled_time)
+        self.assertEqual(1, scheduled_tests[1].index)
+
+    @mock.patch.object(scheduler.random, 'random')
+    def test_jitter_shifts_scheduled_start_within_interval(self, mock_random):
+        # Shift each test by the maximum amount later, then earlier.
+        mock_random.side_effect = [1.0, 0.0, 1.0]
+        test_scheduler = scheduler.Scheduler(iterations=3,
+                                             tests_per_hour=60,
+                                             jitter=0.5)
+
+        start_times = self.run_schedule(test_scheduler,
+                                        lambda unused_index: 0.0)
+
+        self.assertListEqual([15.0, 45.0, 135.0], start_times)
+
+    def test_rejects_unbounded_run(self):
+        with self.assertRaises(ValueError):
+            scheduler.Scheduler(tests_per_hour=12)
+
+    def test_rejects_invalid_rate_and_jitter(self):
+        with self.assertRaises(ValueError):
+            scheduler.Scheduler(iterations=1, tests_per_hour=0)
+        with self.assertRaises(ValueError):
+            scheduler.Scheduler(iterations=1, tests_per_hour=12, jitter=1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+import bisect
+import random
+import unittest
+
+from client_wrapper import tdigest
+
+
+class TDigestTest(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(0)
+        self.values = [random.expovariate(0.1) for _ in range(20000)]
+        self.sorted_values = sorted(self.values)
+
+    def assertPercentilesClose(self, digest):
+        self.assertEqual(self.sorted_values[0], digest.percentile(0))
+        self.assertEqual(self.sorted_values[-1], digest.percentile(100))
+        # t-digest bounds the error in the rank of each estimate, rather than
+        # in its value.
+        for percent in (1, 5, 25, 50, 75, 95, 99):
+            estimate = digest.percentile(percent)
+            rank = bisect.bisect(self.sorted_values, estimate)
+            self.assertAlmostEqual(percent / 100.0,
+                                   float(rank) / len(self.sorted_values),
+                                   delta=0.002)
+
+    def test_estimates_percentiles_of_large_stream(self):
+        digest = tdigest.TDigest()
+        for value in self.values:
+            digest.add(value)
+
+        self.assertEqual(20000, digest.count)
+        self.assertPercentilesClose(digest)
+
+    def test_merged_digests_estimate_percentiles_of_combined_streams(self):
+        digests = [tdigest.TDigest() for _ in range(4)]
+        for i, value in enumerate(self.values):
+            digests[i % 4].add(value)
+        merged = tdigest.TDigest()
+        for digest in digests:
+            merged.merge(digest)
+
+        self.assertEqual(20000, merged.count)
+        self.assertEqual(self.sorted_values[0], merged.min)
+        self.assertEqual(self.sorted_values[-1], merged.max)
+        self.assertPercentilesClose(merged)
+
+    def test_interpolates_exactly_between_few_values(self):
+        digest = tdigest.TDigest()
+        for value in (1.0, 2.0, 3.0, 4.0, 5.0):
+            digest.add(value)
+
+        self.assertListEqual(
+            [1.0, 1.75, 3.0, 4.25, 5.0],
+            [digest.percentile(percent) for percent in (0, 25, 50, 75, 100)])
+
+    def test_empty_digest_has_no_percentiles(self):
+        digest = tdigest.TDigest()
+        digest.merge(tdigest.TDigest())
+
+        self.assertEqual(0, digest.count)
+        self.assertIsNone(digest.percentile(50))
+
+    def test_rejects_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            tdigest.TDigest(compression=0)
+        with self.assertRaises(ValueError):
+            tdigest.TDigest().percentile(101)
+
+
+if __name__ == '__main__':
+    unittest.main()
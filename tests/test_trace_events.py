@@ -0,0 +1,153 @@
+# Copyright 2016 Measurement Lab
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+import datetime
+import json
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import pytz
+
+from client_wrapper import trace_events
+
+
+def _time_at(seconds):
+    return datetime.datetime(2016, 1, 1, 0, 0, 0, 0, pytz.utc) + (
+        datetime.timedelta(seconds=seconds))
+
+# 2016-01-01T00:00:00Z in microseconds since the epoch.
+_MICROS_AT_ZERO = 1451606400 * 1000000
+
+
+class TraceRecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.events_file = StringIO.StringIO()
+        self.recorder = trace_events.TraceRecorder(3, 'worker 2',
+                                                   self.events_file)
+
+    def get_events(self, phase):
+        events_file = StringIO.StringIO(self.events_file.getvalue())
+        return [e for e in trace_events.read_events(events_file)
+                if e['ph'] == phase]
+
+    def test_records_complete_events_in_microseconds_since_epoch(self):
+        self.recorder.add_event('load_url', 'test_step', 'tests', _time_at(1),
+                                _time_at(2.5), {'mock_arg': 'mock_value'})
+
+        self.assertListEqual([{'name': 'load_url',
+                               'cat': 'test_step',
+                               'ph': 'X',
+                               'ts': _MICROS_AT_ZERO + 1000000,
+                               'dur': 1500000,
+                               'pid': 3,
+                               'tid': 1,
+                               'args': {'mock_arg': 'mock_value'}}],
+                             self.get_events('X'))
+
+    def test_names_process_and_each_track(self):
+        self.recorder.add_event('a', 'mock', 'tests', _time_at(0), _time_at(1))
+        self.recorder.add_event('b', 'mock', 'writer', _time_at(0), _time_at(1))
+        self.recorder.add_event('c', 'mock', 'tests', _time_at(1), _time_at(2))
+
+        self.assertListEqual([(0, 'process_name', 'worker 2'),
+                              (1, 'thread_name', 'tests'),
+                              (2, 'thread_name', 'writer')],
+                             [(e['tid'], e['name'], e['args']['name'])
+                              for e in self.get_events('M')])
+        self.assertListEqual([1, 2, 1],
+                             [e['tid'] for e in self.get_events('X')])
+
+    def test_record_adds_event_with_args_set_in_block(self):
+        with self.assertRaises(ValueError):
+            with self.recorder.record('GET /foo', 'replay', 'server') as args:
+                args['found'] = False
+                raise ValueError('mock error')
+
+        events = self.get_events('X')
+        self.assertEqual(1, len(events))
+        self.assertEqual('GET /foo', events[0]['name'])
+        self.assertDictEqual({'found': False}, events[0]['args'])
+        self.assertGreaterEqual(events[0]['dur'], 0)
+
+    def test_writes_each_event_as_it_is_recorded(self):
+        self.recorder.add_event('a', 'mock', 'tests', _time_at(0), _time_at(1))
+        self.assertEqual(1, len(self.get_events('X')))
+
+        self.recorder.add_event('b', 'mock', 'tests', _time_at(1), _time_at(2))
+        self.assertEqual(2, len(self.get_events('X')))
+
+    def test_record_without_recorder_records_nothing(self):
+        with trace_events.record(None, 'GET /foo', 'replay', 'server') as args:
+            args['found'] = True
+
+
+class WriteTraceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.trace_path = os.path.join(self.temp_dir, 'trace.json')
+
+    def record_events(self, events_filename, process_id, event_names):
+        events_path = os.path.join(self.temp_dir, events_filename)
+        with open(events_path, 'w') as events_file:
+            recorder = trace_events.TraceRecorder(process_id, 'worker %d' %
+                                                  process_id, events_file)
+            for event_name in event_names:
+                recorder.add_event(event_name, 'mock', 'tests', _time_at(0),
+                                   _time_at(1))
+        return events_path
+
+    def read_trace(self):
+        with open(self.trace_path) as trace_file:
+            return json.load(trace_file)
+
+    def test_merges_events_files_in_chrome_trace_format(self):
+        events_paths = [self.record_events('w0.events', 1, ['a', 'b']),
+                        self.record_events('w1.events', 2, ['c'])]
+
+        trace_events.write_trace(self.trace_path, events_paths)
+
+        trace = self.read_trace()
+        self.assertEqual('ms', trace['displayTimeUnit'])
+        self.assertListEqual([(1, 'a'), (1, 'b'), (2, 'c')],
+                             [(e['pid'], e['name'])
+                              for e in trace['traceEvents'] if e['ph'] == 'X'])
+
+    def test_skips_missing_files_and_partially_written_events(self):
+        events_path = self.record_events('w0.events', 1, ['a'])
+        # Simulate a worker that crashed in the middle of writing an event.
+        with open(events_path, 'a') as events_file:
+            events_file.write('{"name": "b", "ph": "X"')
+
+        trace_events.write_trace(
+            self.trace_path,
+            [events_path, os.path.join(self.temp_dir, 'missing.events')])
+
+        self.assertListEqual(['a'], [e['name']
+                                     for e in self.read_trace()['traceEvents']
+                                     if e['ph'] == 'X'])
+
+    def test_writes_empty_trace_when_no_events_were_recorded(self):
+        trace_events.write_trace(self.trace_path, [])
+
+        self.assertListEqual([], self.read_trace()['traceEvents'])
+
+
+if __name__ == '__main__':
+    unittest.main()